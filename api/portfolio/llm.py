@@ -1,7 +1,10 @@
-from flask import current_app
+from flask import current_app, has_app_context
+import asyncio
 import logging
 from api.utils.llm.google import Google
-import json
+from api.utils.timing import span
+from api.portfolio.prompts import build_within_budget, ANALYSIS_FIELDS, CHAT_FIELDS
+from api.portfolio.report import REPORT_SCHEMA, parse_report_values, render_report
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -11,15 +14,62 @@ class PortfolioLLM:
     
     def __init__(self):
         """Initialize the portfolio LLM manager"""
+        # Google() is lightweight; the underlying client comes from the shared registry
         self.google_model = Google()
-        logger.info("Google model initialized for portfolio LLM")
     
-    def get_portfolio_news(self, symbols):
-        """Get news for portfolio assets"""
+    def _token_budget(self, endpoint):
+        """Input token budget configured for an endpoint (None means unlimited)"""
+        if has_app_context():
+            return current_app.config.get('LLM_INPUT_TOKEN_BUDGETS', {}).get(endpoint)
+        return None
+    
+    def _build_prompt(self, build_prompt, portfolio_data, fields, endpoint):
+        """Build a prompt around compacted portfolio data that fits the endpoint's token budget"""
+        count_tokens = None
+        if has_app_context() and current_app.config.get('LLM_COUNT_TOKENS_REMOTE', False):
+            count_tokens = self.google_model.count_tokens
+        
+        kwargs = {'count_tokens': count_tokens} if count_tokens else {}
+        with span('prompt'):
+            prompt, _ = build_within_budget(build_prompt, portfolio_data, fields, self._token_budget(endpoint), endpoint, **kwargs)
+        return prompt
+    
+    def _respond(self, prompt, stream=False, endpoint='default'):
+        """
+        Run a prompt through the Google model
+        
+        Returns the response dictionary, or a generator of stream chunks
+        (see Google.generate_stream) when stream is True.
+        """
+        if stream:
+            return self.google_model.generate_stream(prompt, endpoint=endpoint)
+        
+        # Generate response using Google model
+        result = self.google_model.generate(prompt, endpoint=endpoint)
+        return self._message(result)
+    
+    async def _arespond(self, prompt, stream=False, endpoint='default'):
+        """Async counterpart of _respond, returning an async generator of chunks when stream is True"""
+        if stream:
+            return await self.google_model.agenerate_stream(prompt, endpoint=endpoint)
+        
+        result = await self.google_model.agenerate(prompt, endpoint=endpoint)
+        return self._message(result)
+    
+    def _message(self, result):
+        """Response dictionary of a generation"""
+        return {
+            "message": result["text"],
+            "sources": result["sources"],
+            "search_suggestions": result.get("rendered_content")
+        }
+    
+    def _news_prompt(self, symbols):
+        """Build the portfolio news prompt"""
         logger.info(f"Getting news for portfolio symbols: {symbols}")
         
         # Construct the prompt here in the backend
-        prompt = f"""Please find and analyse 5-10 recent True Existing news items about these financial assets: {symbols}. 
+        return f"""Please find and analyse 5-10 recent True Existing news items about these financial assets: {symbols}. 
         
 For each news item, provide:
 1. Title: The headline of the news
@@ -30,151 +80,146 @@ For each news item, provide:
 6. Sentiment: A score from 0 to 1 indicating how positive the news is for the asset(s) (0=very negative, 0.5=neutral, 1=very positive)
 
 Format the response as a proper JSON array. Each news item should be an object with keys: title, source, date, url, summary, and sentiment."""
+    
+    def get_portfolio_news(self, symbols, stream=False):
+        """Get news for portfolio assets"""
+        return self._respond(self._news_prompt(symbols), stream, endpoint='portfolio_news')
+    
+    async def aget_portfolio_news(self, symbols, stream=False):
+        """Async counterpart of get_portfolio_news"""
+        return await self._arespond(self._news_prompt(symbols), stream, endpoint='portfolio_news')
+    
+    def _analysis_prompt(self, portfolio_data):
+        """Build the portfolio analysis prompt around compact portfolio JSON"""
+        logger.info(f"Generating portfolio analysis for {len(portfolio_data.get('assets', []))} assets")
         
-        # Generate response using Google model
-        result = self.google_model.generate(prompt)
+        # Construct the prompt here in the backend around compact portfolio JSON
+        def build_prompt(portfolio_json):
+            return f"""Please analyze this portfolio data for a concise visual report:
+{portfolio_json}
+
+Return only the report values as JSON, written in British English with currency in $ USD:
+1. grade: A+ to F based on overall performance, diversification, and risk/return metrics.
+2. risk_level: Low, Moderate, High or Very High, based on the asset volatilities and allocations.
+3. key_takeaways: 3-4 short takeaways based on news sentiment and market conditions.
+4. recommendation: Maintain, Increase (allocation), Reduce (allocation) or Rebalance.
+5. current_allocation: a few words summarising the current allocation.
+6. recommendation_details: one or two sentences explaining the recommendation.
+
+Keep all text concise."""
+        
+        return self._build_prompt(build_prompt, portfolio_data, ANALYSIS_FIELDS, 'portfolio_analysis')
+    
+    def _report_response(self, portfolio_data, result):
+        """Render the report from the generated values"""
+        values = parse_report_values(result["text"])
+        if values is None:
+            return {
+                "message": "<p>Unable to generate the portfolio report. Please try again.</p>",
+                "sources": [],
+                "search_suggestions": None
+            }
         
+        html, report = render_report(portfolio_data, values)
         return {
-            "message": result["text"],
+            "message": html,
+            "report": report,
             "sources": result["sources"],
             "search_suggestions": result.get("rendered_content")
         }
     
-    def generate_portfolio_analysis(self, portfolio_data):
-        """Generate portfolio analysis report"""
-        logger.info(f"Generating portfolio analysis for {len(portfolio_data['assets'])} assets")
+    def generate_portfolio_analysis(self, portfolio_data, stream=False):
+        """
+        Generate portfolio analysis report
         
-        # Construct the prompt here in the backend
-        prompt = f"""Please analyze this portfolio data and create a detailed but concise VISUAL report:
-{json.dumps(portfolio_data, indent=2)}
-
-Create a highly VISUAL report with minimal text using HTML components like cards, progress bars, color-coded indicators, and visual cues rather than paragraphs of text in British English but keep currency as $ USD. 
-
-Use this exact HTML template structure, filling in the appropriate values from the portfolio data:
-<div class="glass-card p-4">
-
-  <!-- Portfolio Grade -->
-  <div class="text-center mb-4">
-    <span class="text-3xl font-bold" style="color: var(--success-color);">[GRADE]</span>
-  </div>
-
-  <!-- Dashboard Summary -->
-  <div class="grid grid-cols-2 gap-4">
-    <div class="analysis-card border border-custom mb-4">
-      <div class="flex items-center">
-        <span class="text-lg font-semibold" style="color: var(--success-color);">Five-Year Value</span>
-      </div>
-      <div class="text-2xl font-bold" style="color: var(--success-color);">[5YR-VALUE]</div>
-      <div class="flex items-center mt-2">
-        <span class="text-sm" style="color: var(--success-color);">Initial: [INITIAL-INVESTMENT]</span>
-      </div>
-    </div>
-
-    <div class="analysis-card border border-custom mb-4">
-      <div class="flex items-center">
-        <span class="text-lg font-semibold" style="color: var(--info-color);">Ten-Year Value</span>
-      </div>
-      <div class="text-2xl font-bold" style="color: var(--info-color);">[10YR-VALUE]</div>
-      <div class="flex items-center mt-2">
-        <span class="text-sm" style="color: var(--info-color);">Recurring: [RECURRING-AMOUNT]/[FREQUENCY]</span>
-      </div>
-    </div>
-  </div>
-
-  <!-- Risk Assessment -->
-  <div class="analysis-card border border-custom mb-4">
-    <h2 class="text-lg font-semibold" style="color: var(--text-light);">Risk Assessment</h2>
-    <div class="flex items-center mt-2">
-      <span class="text-xl mr-2">[RISK-ICON]</span>
-      <span style="color: var(--text-light);">[RISK-LEVEL] Volatility ([VOLATILITY-VALUE])</span>
-    </div>
-  </div>
-
-  <!-- Growth Projections -->
-  <div class="analysis-card border border-custom mb-4">
-    <h2 class="text-lg font-semibold" style="color: var(--text-light);">Growth Projections</h2>
-    <div class="grid grid-cols-2 gap-4 mt-2">
-      <div>
-        <span style="color: var(--text-light);" class="block">5-Year Growth:</span>
-        <div class="w-full" style="background: var(--border-color); border-radius: 9999px; height: 10px;">
-          <div style="background: var(--success-color); border-radius: 9999px; height: 10px; width: [5YR-GROWTH-PCT-WIDTH]%"></div>
-        </div>
-        <span style="color: var(--success-color);">[5YR-GROWTH-PCT]%</span>
-      </div>
-      <div>
-        <span style="color: var(--text-light);" class="block">10-Year Growth:</span>
-        <div class="w-full" style="background: var(--border-color); border-radius: 9999px; height: 10px;">
-          <div style="background: var(--info-color); border-radius: 9999px; height: 10px; width: [10YR-GROWTH-PCT-WIDTH]%"></div>
-        </div>
-        <span style="color: var(--info-color);">[10YR-GROWTH-PCT]%</span>
-      </div>
-    </div>
-  </div>
-
-  <!-- Market Sentiment -->
-  <div class="analysis-card border border-custom mb-4">
-    <h2 class="text-lg font-semibold" style="color: var(--text-light);">Market Sentiment</h2>
-    <div class="flex items-center justify-between mt-2">
-      <span style="color: var(--text-light);">Bearish</span>
-      <div class="w-1/2" style="background: var(--border-color); border-radius: 9999px; height: 10px;">
-        <div style="background: var(--info-color); border-radius: 9999px; height: 10px; width: [SENTIMENT-PCT]%"></div>
-      </div>
-      <span style="color: var(--text-light);">Bullish</span>
-    </div>
-    <div class="mt-4">
-      <h3 class="text-md font-semibold" style="color: var(--text-light);">Key Takeaways:</h3>
-      <ul class="list-disc list-inside mt-2" style="color: var(--text-light);">
-        [KEY-TAKEAWAYS-LIST-ITEMS]
-      </ul>
-    </div>
-  </div>
-
-  <!-- Asset Allocation Recommendations -->
-  <div class="analysis-card border border-custom">
-    <h2 class="text-lg font-semibold" style="color: var(--text-light);">Asset Allocation</h2>
-    <div class="flex items-center justify-between mt-2">
-      <div>
-        <span class="text-3xl">[RECOMMENDATION-ICON]</span>
-        <span style="color: var(--text-light);" class="font-bold">[RECOMMENDATION]</span>
-      </div>
-      <span style="color: var(--text-light);">[CURRENT-ALLOCATION]</span>
-    </div>
-    <p class="text-sm mt-2" style="color: var(--text-light);">
-      [RECOMMENDATION-DETAILS]
-    </p>
-  </div>
-
-</div>
-
-Instructions:
-1. Grade the portfolio from A+ to F based on overall performance, diversification, and risk/return metrics.
-2. For risk assessment, use these icons: ✓ (Low), ⚠️ (Moderate), ⚠️⚠️ (High), ⚠️⚠️⚠️ (Very High).
-3. Calculate growth percentages properly from initial investment to projected values.
-4. Width percentages for progress bars should be capped at 100% even for high growth rates.
-5. For sentiment, convert the sentiment score (0-1) to a percentage (0-100%).
-6. Provide 3-4 key takeaways based on news sentiment and market conditions as list items.
-7. For recommendations, use icons: ✓ (Maintain), ↑ (Increase allocation), ↓ (Reduce allocation), ⚠️ (Rebalance).
-8. Keep all text concise and focused on visual elements.
-9. Ensure proper color contrast in both light and dark modes - don't use light text on light backgrounds or dark text on dark backgrounds.
-
-Complete the template by replacing all placeholder values [IN-BRACKETS] with the appropriate data from the portfolio."""
+        The model only returns a small JSON document of report values (see
+        REPORT_SCHEMA); the HTML report is rendered server-side from those values
+        and the portfolio data.
+        """
+        prompt = self._analysis_prompt(portfolio_data)
         
-        # Generate response using Google model
-        result = self.google_model.generate(prompt)
+        # Structured output cannot be combined with search grounding; the news is already in the prompt
+        if stream:
+            chunks = self.google_model.generate_stream(prompt, with_search=False, endpoint='portfolio_analysis',
+                                                       response_schema=REPORT_SCHEMA)
+            return self._stream_report(portfolio_data, chunks)
         
-        return {
-            "message": result["text"],
-            "sources": result["sources"],
-            "search_suggestions": result.get("rendered_content")
-        }
+        result = self.google_model.generate(prompt, with_search=False, endpoint='portfolio_analysis',
+                                            response_schema=REPORT_SCHEMA)
+        return self._report_response(portfolio_data, result)
     
-    def generate_chat_response(self, portfolio_data, user_message):
-        """Generate response to user chat message about portfolio"""
+    async def agenerate_portfolio_analysis(self, portfolio_data, stream=False):
+        """
+        Async counterpart of generate_portfolio_analysis
+        
+        Prompt compaction may count tokens with a blocking API call, so it runs
+        in a worker thread.
+        """
+        prompt = await asyncio.to_thread(self._analysis_prompt, portfolio_data)
+        
+        if stream:
+            chunks = await self.google_model.agenerate_stream(prompt, with_search=False, endpoint='portfolio_analysis',
+                                                              response_schema=REPORT_SCHEMA)
+            return self._astream_report(portfolio_data, chunks)
+        
+        result = await self.google_model.agenerate(prompt, with_search=False, endpoint='portfolio_analysis',
+                                                   response_schema=REPORT_SCHEMA)
+        return self._report_response(portfolio_data, result)
+    
+    def _report_chunks(self, portfolio_data, text, chunk):
+        """
+        Chunks to emit for one streamed chunk of report values
+        
+        Returns:
+            (chunks, finished) tuple; finished is True once the report failed
+        """
+        if chunk["type"] == "text":
+            return [{"type": "progress", "characters": len(text)}], False
+        if chunk["type"] == "sources":
+            values = parse_report_values(text)
+            if values is None:
+                return [{"type": "error", "error": "Unable to generate the portfolio report"}], True
+            html, report = render_report(portfolio_data, values)
+            return [{"type": "report", "html": html, "report": report}, chunk], False
+        return [chunk], False
+    
+    def _stream_report(self, portfolio_data, chunks):
+        """
+        Collect streamed report values and emit the rendered report
+        
+        The JSON fragments are not useful to display, so text chunks become
+        progress updates and the rendered HTML is sent as a "report" chunk
+        before the final sources.
+        """
+        text = ""
+        for chunk in chunks:
+            if chunk["type"] == "text":
+                text += chunk["text"]
+            emitted, finished = self._report_chunks(portfolio_data, text, chunk)
+            yield from emitted
+            if finished:
+                return
+    
+    async def _astream_report(self, portfolio_data, chunks):
+        """Async counterpart of _stream_report"""
+        text = ""
+        async for chunk in chunks:
+            if chunk["type"] == "text":
+                text += chunk["text"]
+            emitted, finished = self._report_chunks(portfolio_data, text, chunk)
+            for item in emitted:
+                yield item
+            if finished:
+                return
+    
+    def _chat_prompt(self, portfolio_data, user_message):
+        """Build the portfolio chat prompt around compact portfolio JSON"""
         logger.info(f"Generating chat response for portfolio. User message: {user_message[:50]}...")
         
-        # Construct the prompt here in the backend
-        prompt = f"""You are a financial portfolio assistant analyzing this portfolio:
-{json.dumps(portfolio_data, indent=2)}
+        # Construct the prompt here in the backend around compact portfolio JSON
+        def build_prompt(portfolio_json):
+            return f"""You are a financial portfolio assistant analyzing this portfolio:
+{portfolio_json}
 
 The user asks: {user_message}
 
@@ -182,11 +227,14 @@ Please provide a brief, helpful answer with financial insights related specifica
 Keep answers concise (1-3 paragraphs max), visually formatted with HTML for emphasis where appropriate, and focused on actionable advice. 
 If the portfolio doesn't have enough information to answer a question, explain what information would be needed."""
         
-        # Generate response using Google model
-        result = self.google_model.generate(prompt)
-        
-        return {
-            "message": result["text"],
-            "sources": result["sources"],
-            "search_suggestions": result.get("rendered_content")
-        } 
\ No newline at end of file
+        return self._build_prompt(build_prompt, portfolio_data, CHAT_FIELDS, 'portfolio_chat')
+    
+    def generate_chat_response(self, portfolio_data, user_message, stream=False):
+        """Generate response to user chat message about portfolio"""
+        prompt = self._chat_prompt(portfolio_data, user_message)
+        return self._respond(prompt, stream, endpoint='portfolio_chat')
+    
+    async def agenerate_chat_response(self, portfolio_data, user_message, stream=False):
+        """Async counterpart of generate_chat_response (the prompt is built in a worker thread)"""
+        prompt = await asyncio.to_thread(self._chat_prompt, portfolio_data, user_message)
+        return await self._arespond(prompt, stream, endpoint='portfolio_chat')
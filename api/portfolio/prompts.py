@@ -0,0 +1,154 @@
+import json
+import logging
+import math
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Fields the prompt templates actually use; anything else the client sends is dropped
+ASSET_FIELDS = ('symbol', 'name', 'allocation', 'avgReturn', 'volatility', 'fiveYearGrowth', 'tenYearGrowth')
+ANALYSIS_FIELDS = ('assets', 'initialInvestment', 'recurringAmount', 'recurringFrequency',
+                   'fiveYearValue', 'tenYearValue', 'portfolioSentiment', 'news')
+CHAT_FIELDS = ('assets', 'initialInvestment', 'recurringAmount', 'recurringFrequency',
+               'projectedValue', 'marketSentiment', 'portfolioSentiment')
+NEWS_FIELDS = ('title', 'source', 'date', 'sentiment', 'summary')
+
+budget_exceeded = metrics.counter(
+    'llm_prompt_budget_exceeded_total',
+    'Prompts sent over their input token budget after maximum compaction',
+    ('endpoint',)
+)
+
+# Series longer than this are replaced by summary statistics
+MAX_SERIES_LENGTH = 12
+
+# Progressively harsher settings tried until the prompt fits its token budget
+COMPACTION_LEVELS = [
+    {'max_news': 10, 'summary_chars': 200, 'max_assets': None},
+    {'max_news': 5, 'summary_chars': 80, 'max_assets': None},
+    {'max_news': 3, 'summary_chars': 0, 'max_assets': 25},
+    {'max_news': 0, 'summary_chars': 0, 'max_assets': 10},
+]
+
+def estimate_tokens(text):
+    """Cheap token estimate (roughly four characters per token for English and JSON)"""
+    return math.ceil(len(text) / 4)
+
+def _round(value):
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        return round(value, 4) if abs(value) < 1 else round(value, 2)
+    return value
+
+def summarize_series(values):
+    """Reduce a long numeric series (or list of {"value": ...} points) to summary statistics"""
+    numbers = []
+    for item in values:
+        if isinstance(item, dict):
+            item = item.get('value')
+        if isinstance(item, (int, float)) and not isinstance(item, bool):
+            numbers.append(float(item))
+    if not numbers:
+        return {'count': len(values)}
+    return {
+        'count': len(numbers),
+        'first': _round(numbers[0]),
+        'last': _round(numbers[-1]),
+        'min': _round(min(numbers)),
+        'max': _round(max(numbers)),
+        'mean': _round(sum(numbers) / len(numbers))
+    }
+
+def _compact_value(value):
+    if isinstance(value, float):
+        return _round(value)
+    if isinstance(value, dict):
+        return {key: _compact_value(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        if len(value) > MAX_SERIES_LENGTH:
+            return summarize_series(value)
+        return [_compact_value(item) for item in value]
+    return value
+
+def compact_portfolio(portfolio_data, fields, level=0):
+    """
+    Keep only the fields a prompt uses, round numbers and summarize long series
+
+    Args:
+        portfolio_data: Portfolio dictionary as sent by the client
+        fields: Top-level fields to keep
+        level: Index into COMPACTION_LEVELS
+
+    Returns:
+        Compacted dictionary
+    """
+    settings = COMPACTION_LEVELS[level]
+    compact = {}
+    for field in fields:
+        if field not in portfolio_data or portfolio_data[field] is None:
+            continue
+        value = portfolio_data[field]
+        if field == 'assets':
+            assets = [asset for asset in value if isinstance(asset, dict)]
+            if settings['max_assets'] is not None and len(assets) > settings['max_assets']:
+                # Keep the largest positions and fold the rest into one line
+                assets = sorted(assets, key=lambda a: a.get('allocation') or 0, reverse=True)
+                rest = assets[settings['max_assets']:]
+                assets = assets[:settings['max_assets']]
+                compact['otherAssets'] = {
+                    'count': len(rest),
+                    'allocation': _round(sum(a.get('allocation') or 0 for a in rest))
+                }
+            compact['assets'] = [
+                {key: _compact_value(asset[key]) for key in ASSET_FIELDS if asset.get(key) is not None}
+                for asset in assets
+            ]
+        elif field == 'news':
+            news = []
+            for item in value[:settings['max_news']]:
+                if not isinstance(item, dict):
+                    continue
+                entry = {key: _compact_value(item[key]) for key in NEWS_FIELDS if item.get(key) not in (None, '')}
+                if 'summary' in entry:
+                    if settings['summary_chars']:
+                        entry['summary'] = entry['summary'][:settings['summary_chars']]
+                    else:
+                        del entry['summary']
+                news.append(entry)
+            if news:
+                compact['news'] = news
+        else:
+            compact[field] = _compact_value(value)
+    return compact
+
+def to_compact_json(data):
+    """Serialize without indentation or padding"""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+def build_within_budget(build_prompt, portfolio_data, fields, budget, endpoint, count_tokens=estimate_tokens):
+    """
+    Build a prompt from compacted portfolio data, compacting harder until it fits
+
+    Args:
+        build_prompt: Callable taking the compact portfolio JSON and returning the prompt
+        portfolio_data: Portfolio dictionary as sent by the client
+        fields: Top-level fields the prompt uses
+        budget: Maximum estimated input tokens, or None for no limit
+        endpoint: Endpoint name used in logs
+        count_tokens: Callable returning the token count of a prompt
+
+    Returns:
+        Tuple of (prompt, estimated_tokens)
+    """
+    for level in range(len(COMPACTION_LEVELS)):
+        prompt = build_prompt(to_compact_json(compact_portfolio(portfolio_data, fields, level)))
+        tokens = count_tokens(prompt)
+        if budget is None or tokens <= budget:
+            logger.info(f"Prompt for {endpoint}: ~{tokens} input tokens (compaction level {level})")
+            return prompt, tokens
+
+    budget_exceeded.inc(endpoint=endpoint)
+    logger.warning(f"Prompt for {endpoint} is ~{tokens} tokens, over its budget of {budget} even at maximum compaction")
+    return prompt, tokens
@@ -0,0 +1,118 @@
+import json
+import logging
+from flask import render_template
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# The model only returns the judgement calls; every number in the report is computed here
+REPORT_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'grade': {
+            'type': 'STRING',
+            'enum': ['A+', 'A', 'A-', 'B+', 'B', 'B-', 'C+', 'C', 'C-', 'D+', 'D', 'D-', 'F']
+        },
+        'risk_level': {'type': 'STRING', 'enum': ['Low', 'Moderate', 'High', 'Very High']},
+        'key_takeaways': {'type': 'ARRAY', 'items': {'type': 'STRING'}, 'min_items': 3, 'max_items': 4},
+        'recommendation': {'type': 'STRING', 'enum': ['Maintain', 'Increase', 'Reduce', 'Rebalance']},
+        'current_allocation': {'type': 'STRING'},
+        'recommendation_details': {'type': 'STRING'}
+    },
+    'required': ['grade', 'risk_level', 'key_takeaways', 'recommendation', 'current_allocation', 'recommendation_details'],
+    'property_ordering': ['grade', 'risk_level', 'key_takeaways', 'recommendation', 'current_allocation', 'recommendation_details']
+}
+
+RISK_ICONS = {
+    'Low': '✓',
+    'Moderate': '⚠️',
+    'High': '⚠️⚠️',
+    'Very High': '⚠️⚠️⚠️'
+}
+
+RECOMMENDATION_ICONS = {
+    'Maintain': '✓',
+    'Increase': '↑',
+    'Reduce': '↓',
+    'Rebalance': '⚠️'
+}
+
+def _number(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def format_currency(value):
+    """Format a number as whole US dollars"""
+    return f"${_number(value):,.0f}"
+
+def growth_pct(initial, projected):
+    """Growth from the initial investment to a projected value, in percent"""
+    initial = _number(initial)
+    if initial <= 0:
+        return 0.0
+    return round((_number(projected) - initial) / initial * 100, 1)
+
+def portfolio_volatility(assets):
+    """Allocation-weighted volatility of the portfolio's assets, in percent"""
+    total = 0.0
+    for asset in assets or []:
+        total += _number(asset.get('allocation')) / 100 * _number(asset.get('volatility'))
+    return round(total * 100, 1)
+
+def parse_report_values(text):
+    """Parse the model's JSON report values, returning None if they are unusable"""
+    try:
+        values = json.loads(text)
+    except (TypeError, ValueError) as e:
+        logger.error(f"Could not parse report values from LLM response: {str(e)}")
+        return None
+    if not isinstance(values, dict):
+        logger.error("LLM report values are not a JSON object")
+        return None
+    return values
+
+def render_report(portfolio_data, values):
+    """
+    Render the portfolio report HTML from the model's values and the portfolio data
+
+    Args:
+        portfolio_data: Portfolio dictionary as sent by the client
+        values: Dictionary matching REPORT_SCHEMA
+
+    Returns:
+        Tuple of (html, report) where report holds every value shown in the template
+    """
+    initial = portfolio_data.get('initialInvestment')
+    five_year_growth = growth_pct(initial, portfolio_data.get('fiveYearValue'))
+    ten_year_growth = growth_pct(initial, portfolio_data.get('tenYearValue'))
+    sentiment = portfolio_data.get('portfolioSentiment', portfolio_data.get('marketSentiment'))
+    risk_level = values.get('risk_level', 'Moderate')
+    recommendation = values.get('recommendation', 'Maintain')
+
+    report = {
+        'grade': values.get('grade', 'N/A'),
+        'five_year_value': format_currency(portfolio_data.get('fiveYearValue')),
+        'ten_year_value': format_currency(portfolio_data.get('tenYearValue')),
+        'initial_investment': format_currency(initial),
+        'recurring_amount': format_currency(portfolio_data.get('recurringAmount')),
+        'recurring_frequency': portfolio_data.get('recurringFrequency') or 'month',
+        'risk_level': risk_level,
+        'risk_icon': RISK_ICONS.get(risk_level, '⚠️'),
+        'volatility': f"{portfolio_volatility(portfolio_data.get('assets'))}%",
+        'five_year_growth': five_year_growth,
+        'ten_year_growth': ten_year_growth,
+        # Progress bars are capped at 100% even for high growth rates
+        'five_year_growth_width': max(0, min(100, five_year_growth)),
+        'ten_year_growth_width': max(0, min(100, ten_year_growth)),
+        'sentiment_pct': round(max(0.0, min(1.0, _number(sentiment, 0.5))) * 100),
+        'key_takeaways': values.get('key_takeaways', []),
+        'recommendation': recommendation,
+        'recommendation_icon': RECOMMENDATION_ICONS.get(recommendation, '✓'),
+        'current_allocation': values.get('current_allocation', ''),
+        'recommendation_details': values.get('recommendation_details', '')
+    }
+
+    html = render_template('partials/portfolio_report.html', report=report)
+    return html, report
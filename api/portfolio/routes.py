@@ -1,5 +1,10 @@
 from flask import Blueprint, request, jsonify, current_app
 from api.utils.yahoo import YahooFinanceManager
+from api.utils.sse import sse_response, llm_stream_events, allm_stream_events
+from api.utils.asgi import AsyncRoutes, EventStream
+from api.utils.timing import span
+from api.utils.views import api_errors, InvalidRequest
+import asyncio
 import logging
 import traceback
 
@@ -12,6 +17,10 @@ yahoo_bp = Blueprint('yahoo_finance', __name__, url_prefix='/api/yahoo-finance')
 # Create a separate blueprint for Portfolio endpoints
 portfolio_bp = Blueprint('portfolio', __name__, url_prefix='/api/portfolio')
 
+# Async handlers served natively by the ASGI entry point (asgi.py)
+yahoo_async = AsyncRoutes('/api/yahoo-finance')
+portfolio_async = AsyncRoutes('/api/portfolio')
+
 # Create a Yahoo Finance Manager instance
 yf_manager = YahooFinanceManager()
 logger.info("Yahoo Finance manager initialized")
@@ -40,36 +49,38 @@ def yahoo_finance_chart():
         
         logger.info(f"Received {len(hist)} data points for {symbol}")
         
-        # Convert DataFrame to dictionary with lists
-        # Ensure all pandas/numpy types are converted to Python native types
-        import numpy as np
-        timestamps = hist.index.astype(np.int64) // 10**9
-        timestamps_list = timestamps.tolist()  # Convert to Python list
-        
-        data_dict = {
-            "chart": {
-                "result": [{
-                    "meta": {
-                        "symbol": symbol,
-                        "period": period,
-                        "interval": interval
-                    },
-                    "timestamp": timestamps_list,
-                    "indicators": {
-                        "quote": [{
-                            "open": hist['Open'].tolist(),
-                            "high": hist['High'].tolist(),
-                            "low": hist['Low'].tolist(),
-                            "close": hist['Close'].tolist(),
-                            "volume": hist['Volume'].tolist() if 'Volume' in hist.columns else []
-                        }]
-                    }
-                }]
+        with span('convert'):
+            # Convert DataFrame to dictionary with lists
+            # Ensure all pandas/numpy types are converted to Python native types
+            import numpy as np
+            timestamps = hist.index.astype(np.int64) // 10**9
+            timestamps_list = timestamps.tolist()  # Convert to Python list
+        
+            data_dict = {
+                "chart": {
+                    "result": [{
+                        "meta": {
+                            "symbol": symbol,
+                            "period": period,
+                            "interval": interval
+                        },
+                        "timestamp": timestamps_list,
+                        "indicators": {
+                            "quote": [{
+                                "open": hist['Open'].tolist(),
+                                "high": hist['High'].tolist(),
+                                "low": hist['Low'].tolist(),
+                                "close": hist['Close'].tolist(),
+                                "volume": hist['Volume'].tolist() if 'Volume' in hist.columns else []
+                            }]
+                        }
+                    }]
+                }
             }
-        }
         
         logger.info(f"Successfully prepared chart data for {symbol}")
-        return jsonify(data_dict)
+        with span('serialize'):
+            return jsonify(data_dict)
         
     except Exception as e:
         logger.error(f"Error in chart endpoint for {client_ip} - symbol={symbol if 'symbol' in locals() else 'unknown'}: {str(e)}")
@@ -124,7 +135,8 @@ def yahoo_finance_quote():
         }
         
         logger.info(f"Successfully prepared quote data for {symbol}")
-        return jsonify(result)
+        with span('serialize'):
+            return jsonify(result)
         
     except Exception as e:
         logger.error(f"Error in quote endpoint for {client_ip} - symbol={symbol if 'symbol' in locals() else 'unknown'}: {str(e)}")
@@ -135,79 +147,117 @@ def yahoo_finance_quote():
 from api.portfolio.llm import PortfolioLLM
 portfolio_llm = PortfolioLLM()
 
-# Portfolio LLM routes
+def _news_symbols():
+    """Symbols of a portfolio news request"""
+    symbols = request.json.get('symbols')
+    logger.info(f"Portfolio news request from {request.remote_addr} for symbols: {symbols}")
+    if not symbols:
+        raise InvalidRequest("Symbols are required")
+    return symbols
+
+def _analysis_portfolio(kind):
+    """Portfolio data of an analysis request"""
+    portfolio_data = request.json.get('portfolio')
+    logger.info(f"{kind} request from {request.remote_addr}")
+    if not portfolio_data:
+        raise InvalidRequest("Portfolio data is required")
+    return portfolio_data
+
+def _chat_request(kind):
+    """Portfolio data and user message of a chat request"""
+    data = request.json
+    portfolio_data = data.get('portfolio')
+    user_message = data.get('message')
+    if not portfolio_data or not user_message:
+        raise InvalidRequest("Portfolio data and message are required")
+    logger.info(f"{kind} request from {request.remote_addr}: {user_message[:50]}...")
+    return portfolio_data, user_message
+
+def _analysis_json(result):
+    """Serialize a portfolio analysis report"""
+    with span('serialize'):
+        return jsonify(result)
+
+# Portfolio LLM routes; the prompts are constructed in the backend by PortfolioLLM
 @portfolio_bp.route('/news', methods=['POST'])
+@api_errors('portfolio news endpoint')
 def portfolio_news():
     """Get news for portfolio assets using LLM"""
-    client_ip = request.remote_addr
-    try:
-        # Get JSON data from request
-        data = request.json
-        symbols = data.get('symbols')
-        
-        logger.info(f"Portfolio news request from {client_ip} for symbols: {symbols}")
-        
-        if not symbols:
-            logger.warning(f"Missing symbols in portfolio news request from {client_ip}")
-            return jsonify({"error": "Symbols are required"}), 400
-        
-        # Process using PortfolioLLM (prompt is now constructed in the backend)
-        result = portfolio_llm.get_portfolio_news(symbols)
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        logger.error(f"Error in portfolio news endpoint for {client_ip}: {str(e)}")
-        logger.error(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+    symbols = _news_symbols()
+    return jsonify(portfolio_llm.get_portfolio_news(symbols))
 
 @portfolio_bp.route('/analysis', methods=['POST'])
+@api_errors('portfolio analysis endpoint')
 def portfolio_analysis():
     """Generate portfolio analysis report using LLM"""
-    client_ip = request.remote_addr
-    try:
-        # Get JSON data from request
-        data = request.json
-        portfolio_data = data.get('portfolio')
-        
-        logger.info(f"Portfolio analysis request from {client_ip}")
-        
-        if not portfolio_data:
-            logger.warning(f"Missing portfolio data in analysis request from {client_ip}")
-            return jsonify({"error": "Portfolio data is required"}), 400
-        
-        # Process using PortfolioLLM (prompt is now constructed in the backend)
-        result = portfolio_llm.generate_portfolio_analysis(portfolio_data)
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        logger.error(f"Error in portfolio analysis endpoint for {client_ip}: {str(e)}")
-        logger.error(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+    portfolio_data = _analysis_portfolio("Portfolio analysis")
+    return _analysis_json(portfolio_llm.generate_portfolio_analysis(portfolio_data))
+
+@portfolio_bp.route('/analysis/stream', methods=['POST'])
+@api_errors('streaming portfolio analysis endpoint')
+def portfolio_analysis_stream():
+    """Stream the portfolio analysis report as Server-Sent Events"""
+    portfolio_data = _analysis_portfolio("Streaming portfolio analysis")
+    return sse_response(llm_stream_events(portfolio_llm.generate_portfolio_analysis(portfolio_data, stream=True)))
 
 @portfolio_bp.route('/chat', methods=['POST'])
+@api_errors('portfolio chat endpoint')
 def portfolio_chat():
     """Generate chat response about portfolio using LLM"""
-    client_ip = request.remote_addr
-    try:
-        # Get JSON data from request
-        data = request.json
-        portfolio_data = data.get('portfolio')
-        user_message = data.get('message')
-        
-        logger.info(f"Portfolio chat request from {client_ip}: {user_message[:50]}...")
-        
-        if not portfolio_data or not user_message:
-            logger.warning(f"Missing data in portfolio chat request from {client_ip}")
-            return jsonify({"error": "Portfolio data and message are required"}), 400
-        
-        # Process using PortfolioLLM (prompt is now constructed in the backend)
-        result = portfolio_llm.generate_chat_response(portfolio_data, user_message)
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        logger.error(f"Error in portfolio chat endpoint for {client_ip}: {str(e)}")
-        logger.error(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500 
\ No newline at end of file
+    portfolio_data, user_message = _chat_request("Portfolio chat")
+    return jsonify(portfolio_llm.generate_chat_response(portfolio_data, user_message))
+
+@portfolio_bp.route('/chat/stream', methods=['POST'])
+@api_errors('streaming portfolio chat endpoint')
+def portfolio_chat_stream():
+    """Stream a chat response about the portfolio as Server-Sent Events"""
+    portfolio_data, user_message = _chat_request("Streaming portfolio chat")
+    return sse_response(llm_stream_events(portfolio_llm.generate_chat_response(portfolio_data, user_message, stream=True)))
+
+# Native ASGI handlers; each mirrors the view of the same path above.
+# yfinance has no async API, so market data views run unchanged in the
+# event loop's worker threads (ASGI_BLOCKING_THREADS) with the request context.
+@yahoo_async.route('/chart', methods=['GET'])
+async def yahoo_finance_chart_async():
+    """Async variant of yahoo_finance_chart"""
+    return await asyncio.to_thread(yahoo_finance_chart)
+
+@yahoo_async.route('/quote', methods=['GET'])
+async def yahoo_finance_quote_async():
+    """Async variant of yahoo_finance_quote"""
+    return await asyncio.to_thread(yahoo_finance_quote)
+
+@portfolio_async.route('/news', methods=['POST'])
+@api_errors('portfolio news endpoint')
+async def portfolio_news_async():
+    """Async variant of portfolio_news"""
+    symbols = _news_symbols()
+    return jsonify(await portfolio_llm.aget_portfolio_news(symbols))
+
+@portfolio_async.route('/analysis', methods=['POST'])
+@api_errors('portfolio analysis endpoint')
+async def portfolio_analysis_async():
+    """Async variant of portfolio_analysis"""
+    portfolio_data = _analysis_portfolio("Portfolio analysis")
+    return _analysis_json(await portfolio_llm.agenerate_portfolio_analysis(portfolio_data))
+
+@portfolio_async.route('/analysis/stream', methods=['POST'])
+@api_errors('streaming portfolio analysis endpoint')
+async def portfolio_analysis_stream_async():
+    """Async variant of portfolio_analysis_stream"""
+    portfolio_data = _analysis_portfolio("Streaming portfolio analysis")
+    return EventStream(allm_stream_events(await portfolio_llm.agenerate_portfolio_analysis(portfolio_data, stream=True)))
+
+@portfolio_async.route('/chat', methods=['POST'])
+@api_errors('portfolio chat endpoint')
+async def portfolio_chat_async():
+    """Async variant of portfolio_chat"""
+    portfolio_data, user_message = _chat_request("Portfolio chat")
+    return jsonify(await portfolio_llm.agenerate_chat_response(portfolio_data, user_message))
+
+@portfolio_async.route('/chat/stream', methods=['POST'])
+@api_errors('streaming portfolio chat endpoint')
+async def portfolio_chat_stream_async():
+    """Async variant of portfolio_chat_stream"""
+    portfolio_data, user_message = _chat_request("Streaming portfolio chat")
+    return EventStream(allm_stream_events(await portfolio_llm.agenerate_chat_response(portfolio_data, user_message, stream=True)))
@@ -1,10 +1,15 @@
-from flask import Blueprint, request, jsonify, render_template, url_for
+from flask import Blueprint, request, jsonify, render_template, url_for, Response, send_file, abort
 from api.utils.llm.google import Google
+from api.portfolio.llm import PortfolioLLM
+from api.utils.sse import sse_response, llm_stream_events, allm_stream_events
+from api.utils.asgi import AsyncRoutes, EventStream
+from api.utils.llm.executor import LLMUnavailableError
+from api.utils import metrics
+from api.utils.artifacts import get_artifact_store
+from api.utils.intents import parse_inference_request
+from api.utils.views import api_errors
 import logging
-import traceback
 import os
-import re
-import json
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -12,9 +17,12 @@ logger = logging.getLogger(__name__)
 # Create the blueprint
 main_bp = Blueprint('main', __name__)
 
-# Initialize Google LLM model
+# Async handlers served natively by the ASGI entry point (asgi.py)
+main_async = AsyncRoutes()
+
+# LLM wrappers are cheap to construct; clients are created lazily by the registry
 google_model = Google()
-logger.info("Google model initialized for main routes")
+portfolio_llm = PortfolioLLM()
 
 @main_bp.route('/')
 def index():
@@ -38,129 +46,189 @@ def technical_analysis_prototype():
     logger.info(f"Technical analysis prototype page accessed by {client_ip}")
     return render_template('technical_analysis_prototype.html')
 
-@main_bp.route('/infer', methods=['POST'])
-def infer():
-    """General inference endpoint for LLM queries - redirects to appropriate portfolio endpoints"""
-    client_ip = request.remote_addr
-    try:
-        logger.info(f"Inference request received from {client_ip}")
-        
-        # Get the JSON data from the request
-        data = request.json
-        logger.debug(f"Request data: {data}")
-        
-        # Extract the prompt from the JSON
-        prompt = data.get('prompt')
-        
-        if not prompt:
-            logger.warning(f"No prompt provided in request from {client_ip}")
-            return jsonify({"error": "No prompt provided"}), 400
-        
-        logger.info(f"Processing prompt from {client_ip}: {prompt[:50]}...")
-        
-        # Import portfolio LLM functionality
-        from api.portfolio.llm import PortfolioLLM
-        portfolio_llm = PortfolioLLM()
-        
-        # Check prompt content to determine which endpoint to use
-        if "news items about these financial assets" in prompt:
-            # This is a news request
-            # Extract symbols from the prompt
-            symbols_section = prompt.split("these financial assets:")[1].split(".")[0].strip()
-            logger.info(f"Routing to portfolio news endpoint for symbols: {symbols_section}")
-            result = portfolio_llm.get_portfolio_news(symbols_section)
-        elif "Please analyze this portfolio data" in prompt:
-            # This is a portfolio analysis request
-            logger.info(f"Routing to portfolio analysis endpoint")
-            # Extract portfolio data from the prompt
-            portfolio_data = {}  # Default empty data
-            try:
-                # Try to extract the JSON data from the prompt
-                json_match = re.search(r'{\s*"assets":.+?news":\s*\[.+?\]\s*}', prompt, re.DOTALL)
-                if json_match:
-                    portfolio_data = json.loads(json_match.group(0))
-                    logger.info(f"Extracted portfolio data with {len(portfolio_data.get('assets', []))} assets")
-            except Exception as e:
-                logger.error(f"Error extracting portfolio data: {str(e)}")
-            
-            result = portfolio_llm.generate_portfolio_analysis(portfolio_data)
-        elif "You are a financial portfolio assistant analyzing this portfolio" in prompt:
-            # This is a chat request
-            logger.info(f"Routing to portfolio chat endpoint")
-            # Extract the user's message
-            user_message = prompt.split("The user asks:")[1].split("\n")[0].strip()
-            # Extract portfolio data
-            portfolio_data = {}
-            try:
-                # Try to extract the JSON data from the prompt
-                json_match = re.search(r'{\s*"assets":.+?marketSentiment":\s*[\d\.]+\s*}', prompt, re.DOTALL)
-                if json_match:
-                    portfolio_data = json.loads(json_match.group(0))
-                    logger.info(f"Extracted portfolio data for chat with {len(portfolio_data.get('assets', []))} assets")
-            except Exception as e:
-                logger.error(f"Error extracting portfolio data for chat: {str(e)}")
-            
-            result = portfolio_llm.generate_chat_response(portfolio_data, user_message)
+def _symbols(payload):
+    symbols = payload['symbols']
+    if isinstance(symbols, list):
+        symbols = ', '.join(str(symbol) for symbol in symbols)
+    logger.info(f"Routing to portfolio news endpoint for symbols: {symbols}")
+    return symbols
+
+def _news(payload, stream):
+    return portfolio_llm.get_portfolio_news(_symbols(payload), stream=stream)
+
+def _analysis(payload, stream):
+    logger.info(f"Routing to portfolio analysis endpoint")
+    return portfolio_llm.generate_portfolio_analysis(payload['portfolio'], stream=stream)
+
+def _chat(payload, stream):
+    logger.info(f"Routing to portfolio chat endpoint")
+    return portfolio_llm.generate_chat_response(payload['portfolio'], payload['message'], stream=stream)
+
+def _context_urls(payload, stream):
+    """Valid URLs of a generate payload, or [] when URL context is not used"""
+    logger.info(f"Using generic LLM endpoint")
+    urls = payload.get('urls', [])
+    
+    # Validate URLs if provided
+    validated_urls = []
+    for url in urls:
+        if url and isinstance(url, str) and (url.startswith('http://') or url.startswith('https://')):
+            validated_urls.append(url)
         else:
-            # Generic LLM request
-            logger.info(f"Using generic LLM endpoint")
-            # Use the original Google model
-            
-            # Check if URL context is provided
-            urls = data.get('urls', [])
-            
-            # Validate URLs if provided
-            if urls:
-                # Ensure URLs are properly formatted
-                validated_urls = []
-                for url in urls:
-                    if url and isinstance(url, str) and (url.startswith('http://') or url.startswith('https://')):
-                        validated_urls.append(url)
-                    else:
-                        logger.warning(f"Invalid URL provided: {url}")
-                
-                if validated_urls:
-                    logger.info(f"Using {len(validated_urls)} validated URLs for context")
-                    result = google_model.generate_with_url_context(prompt, validated_urls)
-                else:
-                    logger.warning("No valid URLs found in request, proceeding without URL context")
-                    result = google_model.generate(prompt)
-            else:
-                result = google_model.generate(prompt)
-        
-        logger.info(f"Generated response for {client_ip}: {result['text'][:50]}...")
-        logger.info(f"Response includes {len(result.get('sources', []))} sources")
-        
-        # Return the response as JSON with sources and search suggestions
-        return jsonify({
-            "message": result["text"],
-            "sources": result.get("sources", []),
-            "search_suggestions": result.get("rendered_content", "")
-        })
+            logger.warning(f"Invalid URL provided: {url}")
+    
+    if urls and not validated_urls:
+        logger.warning("No valid URLs found in request, proceeding without URL context")
+    
+    if validated_urls and stream:
+        logger.warning("URL context is not supported for streaming, proceeding without URL context")
+        return []
+    if validated_urls:
+        logger.info(f"Using {len(validated_urls)} validated URLs for context")
+    return validated_urls
+
+def _generate(payload, stream):
+    prompt = payload['prompt']
+    urls = _context_urls(payload, stream)
+    if urls:
+        return google_model.generate_with_url_context(prompt, urls)
+    return google_model.generate_stream(prompt) if stream else google_model.generate(prompt)
+
+# Handler for each inference intent (see api.utils.intents.INTENT_FIELDS for the payloads)
+INTENT_HANDLERS = {
+    'portfolio_news': _news,
+    'portfolio_analysis': _analysis,
+    'portfolio_chat': _chat,
+    'generate': _generate,
+}
+
+async def _anews(payload, stream):
+    return await portfolio_llm.aget_portfolio_news(_symbols(payload), stream=stream)
+
+async def _aanalysis(payload, stream):
+    logger.info(f"Routing to portfolio analysis endpoint")
+    return await portfolio_llm.agenerate_portfolio_analysis(payload['portfolio'], stream=stream)
+
+async def _achat(payload, stream):
+    logger.info(f"Routing to portfolio chat endpoint")
+    return await portfolio_llm.agenerate_chat_response(payload['portfolio'], payload['message'], stream=stream)
+
+async def _agenerate(payload, stream):
+    prompt = payload['prompt']
+    urls = _context_urls(payload, stream)
+    if urls:
+        return await google_model.agenerate_with_url_context(prompt, urls)
+    return await (google_model.agenerate_stream(prompt) if stream else google_model.agenerate(prompt))
+
+# Async counterparts of INTENT_HANDLERS for the ASGI handlers
+ASYNC_INTENT_HANDLERS = {
+    'portfolio_news': _anews,
+    'portfolio_analysis': _aanalysis,
+    'portfolio_chat': _achat,
+    'generate': _agenerate,
+}
+
+def _dispatch(data, stream=False):
+    """
+    Resolve an inference request to its intent and run the handler
+    
+    Returns the handler's response dictionary, or a generator of stream
+    chunks (see Google.generate_stream) when stream is True.
     
-    except Exception as e:
-        logger.error(f"Error in inference endpoint for {client_ip}: {str(e)}")
-        logger.error(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
-
-# Add middleware to log all requests
-@main_bp.before_request
-def log_request_info():
+    Raises:
+        IntentError: If the request is invalid
+    """
+    intent, payload = parse_inference_request(data)
+    return INTENT_HANDLERS[intent](payload, stream)
+
+async def _adispatch(data, stream=False):
+    """Async counterpart of _dispatch"""
+    intent, payload = parse_inference_request(data)
+    return await ASYNC_INTENT_HANDLERS[intent](payload, stream)
+
+def _infer_response(result):
+    """Normalize handler results: portfolio handlers return "message", generic generation returns "text" """
+    response = {
+        "message": result["message"] if "message" in result else result.get("text", ""),
+        "sources": result.get("sources") or [],
+        "search_suggestions": result.get("search_suggestions") or result.get("rendered_content") or ""
+    }
+    if "report" in result:
+        response["report"] = result["report"]
+    return response
+
+def _infer_data(kind):
+    """Log an inference request and return its JSON body"""
+    logger.info(f"{kind} request received from {request.remote_addr}")
+    data = request.get_json(silent=True)
+    logger.debug(f"Request data: {data}")
+    return data
+
+def _infer_json(response):
+    """Log a generated inference response and return it as JSON"""
     client_ip = request.remote_addr
-    path = request.path
-    method = request.method
-    user_agent = request.headers.get('User-Agent', 'Unknown')
+    logger.info(f"Generated response for {client_ip}: {response['message'][:50]}...")
+    logger.info(f"Response includes {len(response['sources'])} sources")
     
-    # Filter out health checks or static file requests if needed
-    if not (path.startswith('/static/') or path == '/health'):
-        logger.info(f"Request: {method} {path} from {client_ip} using {user_agent}")
+    # Return the response as JSON with sources and search suggestions
+    return jsonify(response)
+
+@main_bp.route('/infer', methods=['POST'])
+@api_errors('inference endpoint')
+def infer():
+    """
+    General inference endpoint for LLM queries
     
-    # Log suspicious or potential attack paths
-    suspicious_patterns = ['.php', 'wp-', 'admin', 'shell', '.git', 'cgi-bin', 'wp-content']
-    if any(pattern in path for pattern in suspicious_patterns):
-        logger.warning(f"Suspicious request pattern detected: {method} {path} from {client_ip}")
-
-@main_bp.after_request
-def log_response_info(response):
-    logger.info(f"Response: {response.status} - {response.content_length} bytes")
-    return response 
\ No newline at end of file
+    Accepts {"intent": ..., "payload": {...}} or the legacy {"prompt": ...}
+    format, whose prompt is mapped onto an intent.
+    """
+    data = _infer_data("Inference")
+    return _infer_json(_infer_response(_dispatch(data)))
+
+@main_bp.route('/infer/stream', methods=['POST'])
+@api_errors('streaming inference endpoint')
+def infer_stream():
+    """Streaming variant of /infer that forwards tokens as Server-Sent Events"""
+    data = _infer_data("Streaming inference")
+    return sse_response(llm_stream_events(_dispatch(data, stream=True)))
+
+@main_async.route('/infer', methods=['POST'])
+@api_errors('inference endpoint')
+async def infer_async():
+    """Async variant of infer, served natively by the ASGI entry point"""
+    data = _infer_data("Inference")
+    return _infer_json(_infer_response(await _adispatch(data)))
+
+@main_async.route('/infer/stream', methods=['POST'])
+@api_errors('streaming inference endpoint')
+async def infer_stream_async():
+    """Async variant of infer_stream, served natively by the ASGI entry point"""
+    data = _infer_data("Streaming inference")
+    return EventStream(allm_stream_events(await _adispatch(data, stream=True)))
+
+@main_bp.route('/metrics')
+def metrics_endpoint():
+    """Expose the metrics of all worker processes in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@main_bp.route('/temp/<name>')
+def temp_artifact(name):
+    """Serve a file from the temporary artifact store"""
+    store = get_artifact_store()
+    path = store.path(name)
+    if path is None:
+        abort(404)
+    store.touch(name)
+    # Names are content hashes, so a name always refers to the same bytes
+    response = send_file(path, conditional=True, etag=name.rsplit('.', 1)[0], max_age=store.max_age)
+    response.headers['Cache-Control'] = f"public, max-age={store.max_age}, immutable"
+    return response
+
+@main_bp.app_errorhandler(LLMUnavailableError)
+def llm_unavailable(e):
+    """Fail LLM-bound requests quickly when the executor is saturated (503) or the deadline passed (504)"""
+    logger.warning(f"LLM request from {request.remote_addr} failed with {e.status_code}: {str(e)}")
+    response = jsonify({"success": False, "error": str(e)})
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
@@ -0,0 +1,677 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app, g
+from api.utils.llm.google import Google
+from api.utils.llm.executor import get_executor
+from api.tech_analyze.images import to_original_coordinates
+from api.tech_analyze.cache import get_analysis_cache
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+parse_failures = metrics.counter(
+    'llm_parse_failures_total',
+    'LLM responses that could not be parsed as the expected JSON structure',
+    ('endpoint',)
+)
+
+pipeline_timeframes = metrics.counter(
+    'tech_pipeline_timeframes_total',
+    'Timeframe analyses run by the pipeline, by result (ok, error)',
+    ('result',)
+)
+
+pipeline_duration = metrics.histogram(
+    'tech_pipeline_stage_seconds',
+    'Duration of the pipeline stages (timeframes: until every timeframe finished, merge: the merge call)',
+    ('stage',),
+    buckets=(1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+)
+
+# Initialize the Google LLM model (the client is created lazily by the registry)
+google_model = Google()
+
+# Form fields and labels of the charts accepted in advanced mode
+TIMEFRAMES = [
+    ('weekly_chart', 'Weekly'),
+    ('daily_chart', 'Daily'),
+    ('four_hour_chart', '4-Hour'),
+    ('one_hour_chart', '1-Hour')
+]
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "OFF"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "OFF"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "OFF"
+    },
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "OFF"
+    }
+]
+
+# Response schemas; insights are ordered before the long HTML field so they can be streamed early
+ANALYSIS_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'verdict': {'type': 'STRING', 'enum': ['bullish', 'bearish', 'neutral']},
+        'verdict_strength': {'type': 'INTEGER', 'minimum': 0, 'maximum': 100},
+        'volatility': {'type': 'STRING', 'enum': ['high', 'medium', 'low']},
+        'volatility_strength': {'type': 'INTEGER', 'minimum': 0, 'maximum': 100},
+        'insights': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+        'trading_opportunity': {'type': 'STRING'}
+    },
+    'required': ['verdict', 'verdict_strength', 'volatility', 'volatility_strength', 'insights', 'trading_opportunity'],
+    'property_ordering': ['verdict', 'verdict_strength', 'volatility', 'volatility_strength', 'insights', 'trading_opportunity']
+}
+
+TIMEFRAME_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'timeframe': {'type': 'STRING'},
+        'trend': {'type': 'STRING', 'enum': ['up', 'down', 'sideways']},
+        'verdict': {'type': 'STRING', 'enum': ['bullish', 'bearish', 'neutral']},
+        'verdict_strength': {'type': 'INTEGER', 'minimum': 0, 'maximum': 100},
+        'volatility': {'type': 'STRING', 'enum': ['high', 'medium', 'low']},
+        'volatility_strength': {'type': 'INTEGER', 'minimum': 0, 'maximum': 100},
+        'support_levels': {'type': 'ARRAY', 'items': {'type': 'NUMBER'}, 'max_items': 3},
+        'resistance_levels': {'type': 'ARRAY', 'items': {'type': 'NUMBER'}, 'max_items': 3},
+        'insights': {'type': 'ARRAY', 'items': {'type': 'STRING'}, 'max_items': 2}
+    },
+    'required': ['trend', 'verdict', 'verdict_strength', 'volatility', 'volatility_strength',
+                 'support_levels', 'resistance_levels', 'insights'],
+    'property_ordering': ['timeframe', 'trend', 'verdict', 'verdict_strength', 'volatility', 'volatility_strength',
+                          'support_levels', 'resistance_levels', 'insights']
+}
+
+ANNOTATIONS_SCHEMA = {
+    'type': 'ARRAY',
+    'items': {
+        'type': 'OBJECT',
+        'properties': {
+            'type': {'type': 'STRING', 'enum': ['support', 'resistance', 'trendline', 'pattern', 'entry', 'exit', 'signal']},
+            'label': {'type': 'STRING'},
+            'coordinates': {'type': 'ARRAY', 'items': {'type': 'NUMBER'}, 'min_items': 2, 'max_items': 4},
+            'confidence': {'type': 'NUMBER', 'minimum': 0, 'maximum': 1},
+            'color': {'type': 'STRING'}
+        },
+        'required': ['type', 'label', 'coordinates', 'confidence'],
+        'property_ordering': ['type', 'label', 'coordinates', 'confidence', 'color']
+    }
+}
+
+ANALYSIS_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": ANALYSIS_SCHEMA,
+    "temperature": 0.3, 
+    "top_k": 20, 
+    "top_p": 0.95,
+    "seed": 0,
+    "max_output_tokens": 65535,
+    "safety_settings": SAFETY_SETTINGS,
+    "thinking_config": {
+        "thinking_budget": -1,
+    }
+}
+
+DRAW_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": ANNOTATIONS_SCHEMA,
+    "temperature": 0.2, 
+    "top_k": 10, 
+    "top_p": 0.95,
+    "seed": 0,
+    "max_output_tokens": 65535,
+    "safety_settings": SAFETY_SETTINGS,
+    "thinking_config": {
+        "thinking_budget": -1,
+    }
+}
+
+# Timeframe calls only need a short structured summary each. Thinking tokens count against
+# max_output_tokens, so the budgets leave room for the thinking_budget of their LLM_ROUTES entries
+TIMEFRAME_CONFIG = {**ANALYSIS_CONFIG, "response_schema": TIMEFRAME_SCHEMA, "max_output_tokens": 8192}
+
+MERGE_CONFIG = {**ANALYSIS_CONFIG, "max_output_tokens": 12288}
+
+def chart_parts(charts):
+    """
+    Convert chart dictionaries into image parts for the Google API
+    
+    Args:
+        charts: List of {"timeframe", "data", "mime_type"} dictionaries (plus the
+            preprocessing "transform", which the model does not need)
+    """
+    from google.genai.types import Part
+    return [Part.from_bytes(data=chart['data'], mime_type=chart['mime_type'] or 'image/jpeg') for chart in charts]
+
+def analysis_prompt(mode):
+    """Build the technical analysis prompt for the given mode"""
+    # Prepare comprehensive prompt based on mode
+    if mode == 'simple':
+        prompt_text = """You are a professional technical analyst. Analyze this price chart and provide a comprehensive technical analysis.
+
+Focus on:
+1. Price action patterns and market structure
+2. Key support and resistance levels  
+3. Trend direction and strength
+4. Volume analysis if visible
+5. Potential entry and exit points
+6. Risk management considerations
+
+Provide your analysis as a JSON object with the following structure:
+{
+  "verdict": "bullish" | "bearish" | "neutral",
+  "verdict_strength": <number 0-100>,
+  "volatility": "high" | "medium" | "low", 
+  "volatility_strength": <number 0-100>,
+  "insights": [
+    "Key insight 1",
+    "Key insight 2", 
+    "Key insight 3",
+    "Key insight 4"
+  ],
+  "trading_opportunity": "<HTML formatted text describing potential trades, entry/exit points, and risk management>"
+}
+
+Be specific about price levels, patterns, and actionable insights. Focus on pure price action analysis without indicators."""
+    else:
+        prompt_text = """You are a professional technical analyst. Analyze these multiple timeframe charts and provide a comprehensive multi-timeframe technical analysis.
+
+Focus on:
+1. Overall trend direction across timeframes
+2. Key support and resistance levels on each timeframe
+3. Market structure and price action patterns
+4. Confluence between timeframes for potential entries/exits
+5. Volume analysis if visible
+6. Risk management across timeframes
+7. Higher timeframe bias vs lower timeframe execution
+
+Provide your analysis as a JSON object with the following structure:
+{
+  "verdict": "bullish" | "bearish" | "neutral",
+  "verdict_strength": <number 0-100>,
+  "volatility": "high" | "medium" | "low",
+  "volatility_strength": <number 0-100>, 
+  "insights": [
+    "Multi-timeframe insight 1",
+    "Multi-timeframe insight 2",
+    "Multi-timeframe insight 3", 
+    "Multi-timeframe insight 4"
+  ],
+  "trading_opportunity": "<HTML formatted text describing potential trades with timeframe analysis, entry/exit points, and risk management, each point should <br> seperated>"
+}
+
+Be specific about confluence zones, timeframe alignment, and actionable multi-timeframe insights. Focus on pure price action analysis without indicators."""
+    
+    return prompt_text
+
+def timeframe_prompt(timeframe):
+    """Build the lightweight single-chart prompt used by the pipeline mode"""
+    return f"""You are a professional technical analyst. Analyze this {timeframe or 'price'} chart on its own, using pure price action.
+
+Return only a JSON object with this structure:
+{{
+  "timeframe": "{timeframe or 'Chart'}",
+  "trend": "up" | "down" | "sideways",
+  "verdict": "bullish" | "bearish" | "neutral",
+  "verdict_strength": <number 0-100>,
+  "volatility": "high" | "medium" | "low",
+  "volatility_strength": <number 0-100>,
+  "support_levels": [<price>, ...],
+  "resistance_levels": [<price>, ...],
+  "insights": ["Insight 1", "Insight 2"]
+}}
+
+Keep it brief: at most three levels of each kind and two insights."""
+
+def merge_prompt(timeframe_results):
+    """Build the confluence prompt that merges per-timeframe results into the final analysis"""
+    return f"""You are a professional technical analyst. Below are independent analyses of the same market on several timeframes, as JSON:
+
+{json.dumps(timeframe_results, indent=1)}
+
+Combine them into one multi-timeframe view: weigh the higher timeframe bias against lower timeframe execution, and look for confluence between the levels.
+
+Provide your analysis as a JSON object with the following structure:
+{{
+  "verdict": "bullish" | "bearish" | "neutral",
+  "verdict_strength": <number 0-100>,
+  "volatility": "high" | "medium" | "low",
+  "volatility_strength": <number 0-100>,
+  "insights": [
+    "Multi-timeframe insight 1",
+    "Multi-timeframe insight 2",
+    "Multi-timeframe insight 3",
+    "Multi-timeframe insight 4"
+  ],
+  "trading_opportunity": "<HTML formatted text describing potential trades with timeframe analysis, entry/exit points, and risk management, each point should <br> seperated>"
+}}"""
+
+def draw_prompt(existing_analysis=''):
+    """Build the support/resistance line drawing prompt"""
+    prompt_text = f"""System instruction: You are an expert technical chart analyst. Your task is to analyze the provided trading chart image and identify key technical elements. Return these elements as a JSON array. Each object in the array should represent a single annotation (like a support line, resistance line, trend line, chart pattern, entry/exit point, or signal).
+
+Ensure the JSON array is the only output. Do not include any explanatory text before or after the JSON array. Do not use markdown code fencing (```json ... ```) around the JSON.
+
+Context from previous general analysis (use this to inform your drawing, but focus on coordinate-based annotations):
+{existing_analysis}
+
+Analyze this trading chart and identify the following elements:
+1.  Support levels: Horizontal lines where price has found support.
+2.  Resistance levels: Horizontal lines where price has faced resistance.
+3.  Trend lines: Diagonal lines indicating the primary direction of price movement.
+4.  Chart patterns: Recognizable formations like triangles, head and shoulders, flags, etc.
+5.  Potential entry points: Specific points or small regions suggesting favorable trade entries.
+6.  Potential exit points: Specific points or small regions for taking profits or cutting losses.
+7.  Key signals: Important indicators or candlestick patterns that traders should note (e.g., a pin bar at support).
+
+For each identified element, provide a JSON object with the following fields:
+-   "type": (string) The type of element. Examples: "support", "resistance", "trendline", "pattern", "entry", "exit", "signal".
+-   "label": (string) A concise description of the element (e.g., "Major Support", "Ascending Triangle", "Entry Signal").
+-   "coordinates": (array) The coordinates for the element, expressed as percentages of the image dimensions (0-100).
+    -   For horizontal or diagonal lines (support, resistance, trendline): `[x1, y1, x2, y2]`
+    -   For points (entry, exit, signal): `[x, y]`
+    -   For patterns (e.g., bounding box of a pattern): `[x, y, width, height]`
+-   "confidence": (number, 0.0 to 1.0) Your confidence in the accuracy of this identified element.
+-   "color": (string, optional) A suggested hex color code for displaying this element (e.g., "#FF0000" for resistance). If not specified, a default will be used.
+
+Example of a single element in the JSON array:
+{{
+  "type": "support",
+  "label": "Support at 100.50",
+  "coordinates": [0, 50, 100, 50],
+  "confidence": 0.85,
+  "color": "#00FF00"
+}}
+
+Provide the response as a single, valid JSON array of such objects. No other text or formatting.
+"""
+    return prompt_text
+
+def parse_analysis(response_text, endpoint='technical_analysis'):
+    """
+    Parse the schema-constrained analysis JSON from the LLM response
+    
+    Failures are counted in llm_parse_failures_total and return a result
+    flagged with "parse_error" rather than being passed off as an analysis.
+    """
+    logger.info(f"LLM response received: {len(response_text or '')} characters")
+    try:
+        structured_data = json.loads(response_text)
+        if isinstance(structured_data, dict):
+            return structured_data
+        error = "response is not a JSON object"
+    except (TypeError, ValueError) as e:
+        error = str(e)
+    
+    parse_failures.inc(endpoint=endpoint)
+    logger.error(f"Could not parse {endpoint} response: {error}: {(response_text or '')[:200]}")
+    return {"parse_error": True}
+
+def format_analysis(structured_data):
+    """Shape the structured LLM output into the analysis object returned to clients"""
+    return {
+        'sentiment': {
+            'verdict': structured_data.get('verdict', 'neutral'),
+            'strength': structured_data.get('verdict_strength', 50)
+        },
+        'volatility': {
+            'level': structured_data.get('volatility', 'medium'),
+            'strength': structured_data.get('volatility_strength', 50)
+        },
+        'insights': structured_data.get('insights', []),
+        'trading_opportunity': structured_data.get('trading_opportunity', '')
+    }
+
+def parse_annotations(response_text):
+    """Parse the schema-constrained JSON array of chart annotations, or None if it is unusable"""
+    logger.info(f"Line analysis response received: {len(response_text or '')} characters")
+    try:
+        annotations_data = json.loads(response_text)
+        if isinstance(annotations_data, list):
+            return annotations_data
+        error = "response is not a JSON array"
+    except (TypeError, ValueError) as e:
+        error = str(e)
+    
+    parse_failures.inc(endpoint='technical_analysis_draw')
+    logger.error(f"Could not parse line analysis response: {error}: {(response_text or '')[:200]}")
+    return None
+
+def analysis_response(mode, structured_data):
+    """Build the response dictionary for an analysis; results that could not be parsed are failures"""
+    if structured_data.get('parse_error'):
+        return {
+            'success': False,
+            'mode': mode,
+            'error': 'The analysis could not be read, please try again',
+            'parse_error': True
+        }
+    return {
+        'success': True,
+        'mode': mode,
+        'analysis': format_analysis(structured_data)
+    }
+
+def annotations_response(annotations_data, transform=None):
+    """
+    Build the response dictionary for a line drawing; results that could not be parsed are failures
+    
+    Coordinates are mapped back from the preprocessed image to the uploaded one.
+    """
+    if annotations_data is None:
+        return {
+            'success': False,
+            'annotations': [],
+            'error': 'The chart annotations could not be read, please try again',
+            'parse_error': True
+        }
+    return {
+        'success': True,
+        'annotations': [to_original_coordinates(annotation, transform) for annotation in annotations_data]
+    }
+
+def _analysis_options(mode, charts, pipeline):
+    """Whether the pipeline applies, and the cache options of an analysis"""
+    pipeline = bool(pipeline and mode != 'simple' and len(charts) > 1)
+    return pipeline, {'mode': mode, 'pipeline': pipeline}
+
+def _is_complete(response):
+    # Unparsed results and pipelines with failed timeframes are not worth repeating
+    return not response.get('parse_error') and all('error' not in result for result in response.get('timeframes', []))
+
+def _single_call_response(mode, result):
+    # Parse the response to extract structured data
+    structured_data = parse_analysis(result.text)
+    logger.info(f"Technical analysis completed: {structured_data.get('verdict', 'unknown')} sentiment")
+    return analysis_response(mode, structured_data)
+
+def analyze_charts(mode, charts, pipeline=False):
+    """
+    Run the technical analysis for a set of charts
+    
+    Results are served from the analysis cache when the same or nearly the
+    same charts were analyzed with the same options within ANALYSIS_CACHE_TTL.
+    
+    Args:
+        mode: 'simple' or 'advanced'
+        charts: List of chart dictionaries (see chart_parts)
+        pipeline: Analyze each chart separately and merge the results (advanced mode only)
+        
+    Returns:
+        Response dictionary with success, mode and analysis
+    """
+    pipeline, options = _analysis_options(mode, charts, pipeline)
+    cache = get_analysis_cache()
+    if cache is not None:
+        cached, _ = cache.get('analysis', options, charts)
+        if cached is not None:
+            return cached
+    
+    started = time.monotonic()
+    if pipeline:
+        response = None
+        for event, data in iter_pipeline_analysis(charts):
+            if event == 'analysis':
+                response = data
+    else:
+        content_parts = [analysis_prompt(mode)] + chart_parts(charts)
+        
+        # Call Google LLM with image analysis
+        logger.info(f"Calling Google LLM for technical analysis with {len(charts)} images")
+        result = google_model.generate_content(
+            content_parts,
+            endpoint='technical_analysis',
+            request_class=mode,
+            config=ANALYSIS_CONFIG
+        )
+        response = _single_call_response(mode, result)
+    
+    if cache is not None and _is_complete(response):
+        cache.put('analysis', options, charts, response, time.monotonic() - started)
+    return response
+
+async def aanalyze_charts(mode, charts, pipeline=False):
+    """Async counterpart of analyze_charts; cache lookups run in a worker thread"""
+    pipeline, options = _analysis_options(mode, charts, pipeline)
+    cache = get_analysis_cache()
+    if cache is not None:
+        cached, _ = await asyncio.to_thread(cache.get, 'analysis', options, charts)
+        if cached is not None:
+            return cached
+    
+    started = time.monotonic()
+    if pipeline:
+        response = None
+        async for event, data in aiter_pipeline_analysis(charts):
+            if event == 'analysis':
+                response = data
+    else:
+        logger.info(f"Calling Google LLM for technical analysis with {len(charts)} images")
+        result = await google_model.agenerate_content(
+            [analysis_prompt(mode)] + chart_parts(charts),
+            endpoint='technical_analysis',
+            request_class=mode,
+            config=ANALYSIS_CONFIG
+        )
+        response = _single_call_response(mode, result)
+    
+    if cache is not None and _is_complete(response):
+        await asyncio.to_thread(cache.put, 'analysis', options, charts, response, time.monotonic() - started)
+    return response
+
+def _timeframe_request(chart):
+    """Contents and generation arguments of a single timeframe analysis"""
+    return {
+        'contents': [timeframe_prompt(chart.get('timeframe'))] + chart_parts([chart]),
+        'endpoint': 'technical_analysis_timeframe',
+        'config': TIMEFRAME_CONFIG
+    }
+
+def _timeframe_result(chart, result):
+    structured_data = parse_analysis(result.text, endpoint='technical_analysis_timeframe')
+    if structured_data.get('parse_error'):
+        raise ValueError("Could not parse the timeframe analysis")
+    structured_data['timeframe'] = chart.get('timeframe')
+    return structured_data
+
+def analyze_timeframe(chart):
+    """Analyze a single timeframe chart with the lightweight prompt"""
+    return _timeframe_result(chart, google_model.generate_content(**_timeframe_request(chart)))
+
+async def aanalyze_timeframe(chart):
+    """Async counterpart of analyze_timeframe"""
+    return _timeframe_result(chart, await google_model.agenerate_content(**_timeframe_request(chart)))
+
+def _run_in_app_context(app, request_started, fn, *args):
+    # Worker threads get their own app context; carrying the request start over
+    # keeps every call within the original request's deadline
+    with app.app_context():
+        g.request_started = request_started
+        return fn(*args)
+
+def _pipeline_width(charts):
+    """
+    Timeframe calls one pipeline runs at once
+    
+    At most TECH_ANALYSIS_PIPELINE_WIDTH and half of the LLM executor's
+    concurrency, so two pipelines cannot fill its slots and queue and get
+    every other LLM request rejected with 503.
+    """
+    width = current_app.config.get('TECH_ANALYSIS_PIPELINE_WIDTH', 4)
+    return max(1, min(len(charts), width, get_executor().max_concurrency // 2))
+
+def iter_pipeline_analysis(charts):
+    """
+    Analyze the timeframes concurrently, then merge the results in one short call
+    
+    Up to _pipeline_width() charts are analyzed at once (all four timeframes
+    with the default settings), so wall-clock time is about the slowest
+    single-chart call plus the merge instead of one long generation over
+    every chart.
+    
+    Yields:
+        ("timeframe", result) as each chart finishes, in completion order, then
+        ("analysis", response) with the merged response dictionary
+    """
+    app = current_app._get_current_object()
+    request_started = g.get('request_started', time.monotonic())
+    order = {chart.get('timeframe'): position for position, chart in enumerate(charts)}
+    results = []
+    
+    logger.info(f"Running pipeline technical analysis over {len(charts)} timeframes")
+    started = time.monotonic()
+    # Charts beyond the width wait in the pool rather than in the LLM executor's queue
+    pool = ThreadPoolExecutor(max_workers=_pipeline_width(charts), thread_name_prefix='tech-timeframe')
+    try:
+        futures = {
+            pool.submit(_run_in_app_context, app, request_started, analyze_timeframe, chart): chart
+            for chart in charts
+        }
+        for future in as_completed(futures):
+            timeframe = futures[future].get('timeframe')
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Timeframe analysis for {timeframe} failed: {str(e)}")
+                result = {'timeframe': timeframe, 'error': str(e)}
+            pipeline_timeframes.inc(result='error' if 'error' in result else 'ok')
+            results.append(result)
+            yield 'timeframe', result
+    finally:
+        # Stop waiting on the remaining charts if the consumer went away
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    pipeline_duration.observe(time.monotonic() - started, stage='timeframes')
+    completed = _completed_timeframes(results, order)
+    started = time.monotonic()
+    result = google_model.generate_content(merge_prompt(completed), endpoint='technical_analysis_merge', config=MERGE_CONFIG)
+    pipeline_duration.observe(time.monotonic() - started, stage='merge')
+    yield 'analysis', _merged_response(results, result)
+
+async def aiter_pipeline_analysis(charts):
+    """Async counterpart of iter_pipeline_analysis, running the timeframe calls as tasks"""
+    order = {chart.get('timeframe'): position for position, chart in enumerate(charts)}
+    results = []
+    
+    logger.info(f"Running pipeline technical analysis over {len(charts)} timeframes")
+    started = time.monotonic()
+    
+    slots = asyncio.Semaphore(_pipeline_width(charts))
+    
+    async def analyze(chart):
+        try:
+            async with slots:
+                return chart, await aanalyze_timeframe(chart)
+        except Exception as e:
+            return chart, e
+    
+    tasks = [asyncio.ensure_future(analyze(chart)) for chart in charts]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            chart, result = await next_done
+            if isinstance(result, Exception):
+                logger.error(f"Timeframe analysis for {chart.get('timeframe')} failed: {str(result)}")
+                result = {'timeframe': chart.get('timeframe'), 'error': str(result)}
+            pipeline_timeframes.inc(result='error' if 'error' in result else 'ok')
+            results.append(result)
+            yield 'timeframe', result
+    finally:
+        # Stop the remaining calls if the consumer went away
+        for task in tasks:
+            task.cancel()
+    
+    pipeline_duration.observe(time.monotonic() - started, stage='timeframes')
+    completed = _completed_timeframes(results, order)
+    started = time.monotonic()
+    result = await google_model.agenerate_content(merge_prompt(completed), endpoint='technical_analysis_merge', config=MERGE_CONFIG)
+    pipeline_duration.observe(time.monotonic() - started, stage='merge')
+    yield 'analysis', _merged_response(results, result)
+
+def _completed_timeframes(results, order):
+    """Sort the timeframe results by chart order and return the successful ones"""
+    results.sort(key=lambda result: order.get(result['timeframe'], len(order)))
+    completed = [result for result in results if 'error' not in result]
+    if not completed:
+        raise RuntimeError(f"All timeframe analyses failed: {results[0]['error']}")
+    return completed
+
+def _merged_response(results, result):
+    structured_data = parse_analysis(result.text, endpoint='technical_analysis_merge')
+    logger.info(f"Pipeline technical analysis completed: {structured_data.get('verdict', 'unknown')} sentiment")
+    
+    response = analysis_response('advanced', structured_data)
+    response.update(pipeline=True, timeframes=results)
+    return response
+
+def draw_annotations(chart, existing_analysis=''):
+    """
+    Identify support/resistance lines and other annotations on a chart
+    
+    Annotations are cached in the coordinates of the preprocessed image, so a
+    near-duplicate upload with different margins gets them mapped to its own crop.
+    
+    Args:
+        chart: Chart dictionary (see chart_parts)
+        existing_analysis: Context from a previous analysis
+        
+    Returns:
+        Response dictionary with success and annotations
+    """
+    cache = get_analysis_cache()
+    options = {'existing_analysis': existing_analysis}
+    if cache is not None:
+        cached, _ = cache.get('draw', options, [chart])
+        if cached is not None:
+            return annotations_response(cached, chart.get('transform'))
+    
+    content_parts = [draw_prompt(existing_analysis)] + chart_parts([chart])
+    
+    # Call Google LLM for line analysis
+    logger.info("Calling Google LLM for support/resistance line analysis")
+    started = time.monotonic()
+    result = google_model.generate_content(
+        content_parts,
+        endpoint='technical_analysis_draw',
+        config=DRAW_CONFIG
+    )
+    
+    annotations_data = parse_annotations(result.text)
+    if cache is not None and annotations_data is not None:
+        cache.put('draw', options, [chart], annotations_data, time.monotonic() - started)
+    return annotations_response(annotations_data, chart.get('transform'))
+
+async def adraw_annotations(chart, existing_analysis=''):
+    """Async counterpart of draw_annotations; cache lookups run in a worker thread"""
+    cache = get_analysis_cache()
+    options = {'existing_analysis': existing_analysis}
+    if cache is not None:
+        cached, _ = await asyncio.to_thread(cache.get, 'draw', options, [chart])
+        if cached is not None:
+            return annotations_response(cached, chart.get('transform'))
+    
+    logger.info("Calling Google LLM for support/resistance line analysis")
+    started = time.monotonic()
+    result = await google_model.agenerate_content(
+        [draw_prompt(existing_analysis)] + chart_parts([chart]),
+        endpoint='technical_analysis_draw',
+        config=DRAW_CONFIG
+    )
+    
+    annotations_data = parse_annotations(result.text)
+    if cache is not None and annotations_data is not None:
+        await asyncio.to_thread(cache.put, 'draw', options, [chart], annotations_data, time.monotonic() - started)
+    return annotations_response(annotations_data, chart.get('transform'))
@@ -0,0 +1,269 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app, has_app_context
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+lookups = metrics.counter(
+    'analysis_cache_lookups_total',
+    'Technical analysis cache lookups by result (exact, similar, miss)',
+    ('kind', 'result')
+)
+
+saved_seconds = metrics.counter(
+    'analysis_cache_saved_seconds_total',
+    'Generation time saved by serving technical analyses from the cache',
+    ('kind',)
+)
+
+# The perceptual hash is split into this many bands for the similarity index.
+# Two hashes within PHASH_BANDS - 1 bits of each other share at least one band.
+PHASH_BANDS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    key TEXT PRIMARY KEY,
+    signature TEXT NOT NULL,
+    charts TEXT NOT NULL,
+    result TEXT NOT NULL,
+    duration REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analysis_cache_expires ON analysis_cache (expires_at);
+CREATE TABLE IF NOT EXISTS analysis_cache_bands (
+    key TEXT NOT NULL,
+    bucket TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analysis_cache_bands_bucket ON analysis_cache_bands (bucket);
+CREATE INDEX IF NOT EXISTS idx_analysis_cache_bands_key ON analysis_cache_bands (key);
+"""
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _buckets(phash):
+    """Similarity index buckets ("band:bits") of a perceptual hash"""
+    width = len(phash) // PHASH_BANDS
+    return [f"{band}:{phash[band * width:(band + 1) * width]}" for band in range(PHASH_BANDS)]
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hex hashes"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+class AnalysisCache:
+    """
+    Technical analysis results keyed by the uploaded images, in a local SQLite database
+
+    Entries are found by the SHA-256 of every upload (exact duplicates) or, failing
+    that, by the perceptual hash of every chart being within max_distance bits of
+    a cached request with the same kind and options (re-encoded, rescaled or
+    re-cropped screenshots of the same chart). Candidates for the similarity
+    lookup come from a band index on the first chart's hash, so a lookup only
+    compares against entries that share at least one band. The database is
+    shared by every worker process on the host.
+    """
+    def __init__(self, path, ttl=900, max_distance=10, sweep_interval=60):
+        self.path = path
+        self.ttl = ttl
+        # Matches further apart than this could share no band
+        self.max_distance = min(max_distance, PHASH_BANDS - 1)
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _keys(self, kind, options, charts):
+        """Exact key and options signature of a request, or (None, None) if a chart has no fingerprint"""
+        fingerprints = [chart.get('fingerprint') for chart in charts]
+        if not fingerprints or not all(fingerprints):
+            return None, None
+        signature = _hash([kind, options])
+        key = _hash([signature, [[chart.get('timeframe'), chart['fingerprint']['digest']] for chart in charts]])
+        return key, signature
+
+    def get(self, kind, options, charts):
+        """
+        Look up a cached result
+
+        Args:
+            kind: 'analysis' or 'draw'
+            options: JSON-serializable options that change the result (mode, prompt inputs)
+            charts: Preprocessed chart dictionaries with fingerprints
+
+        Returns:
+            (result, match) where match is 'exact' or 'similar', or (None, None) on a miss
+        """
+        key, signature = self._keys(kind, options, charts)
+        if key is None:
+            return None, None
+
+        now = time.time()
+        try:
+            with contextlib.closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT * FROM analysis_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                match = 'exact'
+                if row is None:
+                    row = self._find_similar(conn, signature, charts, now)
+                    match = 'similar'
+                if row is not None:
+                    conn.execute("UPDATE analysis_cache SET hits = hits + 1 WHERE key = ?", (row['key'],))
+        except sqlite3.Error as e:
+            # The cache is an optimization; the analysis runs without it
+            logger.warning(f"Analysis cache lookup failed: {str(e)}")
+            row = None
+        if row is None:
+            lookups.inc(kind=kind, result='miss')
+            return None, None
+
+        lookups.inc(kind=kind, result=match)
+        saved_seconds.inc(row['duration'], kind=kind)
+        logger.info(f"Serving {kind} from the analysis cache ({match} match, {row['hits'] + 1} hits, "
+                    f"{row['duration']:.1f}s of generation saved)")
+        return json.loads(row['result']), match
+
+    def _find_similar(self, conn, signature, charts, now):
+        phashes = [chart['fingerprint'].get('phash') for chart in charts]
+        if not all(phashes):
+            return None
+        buckets = _buckets(phashes[0])
+        rows = conn.execute(
+            f"""SELECT DISTINCT c.* FROM analysis_cache_bands b JOIN analysis_cache c ON c.key = b.key
+                WHERE b.bucket IN ({','.join('?' * len(buckets))}) AND c.signature = ? AND c.expires_at > ?""",
+            (*buckets, signature, now)
+        ).fetchall()
+
+        best, best_distance = None, None
+        for row in rows:
+            cached = json.loads(row['charts'])
+            if len(cached) != len(charts):
+                continue
+            distances = []
+            for (timeframe, cached_phash), chart, phash in zip(cached, charts, phashes):
+                if timeframe != chart.get('timeframe') or not cached_phash:
+                    break
+                distances.append(hamming_distance(phash, cached_phash))
+            if len(distances) != len(charts) or max(distances) > self.max_distance:
+                continue
+            if best is None or sum(distances) < best_distance:
+                best, best_distance = row, sum(distances)
+        return best
+
+    def put(self, kind, options, charts, result, duration):
+        """
+        Store a result
+
+        Args:
+            kind, options, charts: As for get()
+            result: JSON-serializable result
+            duration: Seconds the result took to generate
+        """
+        key, signature = self._keys(kind, options, charts)
+        if key is None:
+            return
+        self._maybe_sweep()
+
+        now = time.time()
+        cached_charts = [[chart.get('timeframe'), chart['fingerprint'].get('phash')] for chart in charts]
+        try:
+            self._store(key, signature, cached_charts, result, duration, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not store {kind} in the analysis cache: {str(e)}")
+
+    def _store(self, key, signature, cached_charts, result, duration, now):
+        phash = cached_charts[0][1]
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    """INSERT OR REPLACE INTO analysis_cache
+                       (key, signature, charts, result, duration, hits, created_at, expires_at)
+                       VALUES (?, ?, ?, ?, ?, 0, ?, ?)""",
+                    (key, signature, json.dumps(cached_charts), json.dumps(result), duration, now, now + self.ttl)
+                )
+                conn.execute("DELETE FROM analysis_cache_bands WHERE key = ?", (key,))
+                if phash:
+                    conn.executemany(
+                        "INSERT INTO analysis_cache_bands (key, bucket) VALUES (?, ?)",
+                        [(key, bucket) for bucket in _buckets(phash)]
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _maybe_sweep(self):
+        with self._lock:
+            if time.time() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = time.time()
+        try:
+            self.purge_expired()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not purge the analysis cache: {str(e)}")
+
+    def purge_expired(self):
+        """Delete entries past their TTL"""
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                conn.execute(
+                    "DELETE FROM analysis_cache_bands WHERE key IN (SELECT key FROM analysis_cache WHERE expires_at < ?)",
+                    (now,)
+                )
+                deleted = conn.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (now,)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if deleted:
+            logger.info(f"Purged {deleted} expired technical analysis cache entries")
+        return deleted
+
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+def get_analysis_cache():
+    """Return the process-wide analysis cache, or None when ANALYSIS_CACHE_ENABLED is off"""
+    global _analysis_cache
+    config = current_app.config if has_app_context() else {}
+    if not config.get('ANALYSIS_CACHE_ENABLED', True):
+        return None
+    with _analysis_cache_lock:
+        if _analysis_cache is None:
+            default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data', 'analysis_cache.sqlite3')
+            _analysis_cache = AnalysisCache(
+                config.get('ANALYSIS_CACHE_DATABASE', default_path),
+                ttl=config.get('ANALYSIS_CACHE_TTL', 900),
+                max_distance=config.get('ANALYSIS_CACHE_MAX_DISTANCE', 10)
+            )
+        return _analysis_cache
+
+def _reset_after_fork():
+    # The lock may have been held by another thread at fork time
+    global _analysis_cache, _analysis_cache_lock
+    _analysis_cache = None
+    _analysis_cache_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
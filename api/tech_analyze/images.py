@@ -0,0 +1,203 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+image_bytes = metrics.counter(
+    'chart_image_bytes_total',
+    'Chart image bytes before and after preprocessing',
+    ('stage',)
+)
+
+preprocess_duration = metrics.histogram(
+    'chart_preprocess_seconds',
+    'Time spent preprocessing one chart image',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+MIME_TYPES = {'WEBP': 'image/webp', 'PNG': 'image/png', 'JPEG': 'image/jpeg'}
+
+# Pixels differing from the border colour by less than this count as border
+BORDER_TOLERANCE = 12
+
+# Borders are only cropped if the remaining content keeps at least this share of each side
+MIN_CROP_RATIO = 0.5
+
+def _settings():
+    config = current_app.config if has_app_context() else {}
+    return {
+        'max_edge': config.get('CHART_MAX_EDGE', 1536),
+        'format': config.get('CHART_IMAGE_FORMAT', 'WEBP').upper(),
+        'quality': config.get('CHART_IMAGE_QUALITY', 90)
+    }
+
+# Side of the difference hash grid; the hash has HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 16
+
+def identity_transform():
+    """Transform for an image that was passed through unchanged"""
+    return {'original_size': None, 'crop': None}
+
+def _content_box(image):
+    """Bounding box of the image without uniform borders, or None if there is nothing to crop"""
+    from PIL import Image, ImageChops
+    rgb = image.convert('RGB')
+    background = Image.new('RGB', rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert('L')
+    mask = diff.point(lambda value: 255 if value > BORDER_TOLERANCE else 0)
+    box = mask.getbbox()
+    if box is None or box == (0, 0, image.width, image.height):
+        return None
+    if (box[2] - box[0]) < image.width * MIN_CROP_RATIO or (box[3] - box[1]) < image.height * MIN_CROP_RATIO:
+        # Mostly uniform image; cropping would more likely cut the chart than a border
+        return None
+    return box
+
+def difference_hash(image):
+    """
+    Perceptual (difference) hash of an image as a hex string
+
+    Each bit records whether a pixel of the downscaled grayscale image is
+    brighter than its right neighbour, so re-encoding, rescaling and small
+    edits only flip a few bits.
+    """
+    from PIL import Image
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+def preprocess_chart(chart, settings=None):
+    """
+    Prepare an uploaded chart image for a multimodal call
+
+    Applies the EXIF orientation, drops metadata, crops uniform borders,
+    downsamples so the longest edge is at most CHART_MAX_EDGE and re-encodes
+    to CHART_IMAGE_FORMAT. Images Pillow cannot read are passed through.
+
+    Args:
+        chart: {"timeframe", "data", "mime_type"} dictionary
+        settings: Optional preprocessing settings (read from the app config by default)
+
+    Returns:
+        New chart dictionary with the processed data, a "transform" describing
+        the crop, used to map coordinates on the processed image back to the
+        original, and a "fingerprint" ({"digest", "phash"}) of the upload
+    """
+    # Pillow is imported on first use, keeping it out of worker start-up
+    from PIL import Image, ImageOps
+    
+    settings = settings or _settings()
+    started = time.monotonic()
+    digest = hashlib.sha256(chart['data']).hexdigest()
+    try:
+        image = Image.open(io.BytesIO(chart['data']))
+        image = ImageOps.exif_transpose(image)
+        original_size = image.size
+
+        box = _content_box(image)
+        if box is not None:
+            image = image.crop(box)
+
+        if max(image.size) > settings['max_edge']:
+            # thumbnail keeps the aspect ratio, so coordinate percentages are unaffected
+            image.thumbnail((settings['max_edge'], settings['max_edge']), Image.LANCZOS)
+
+        # Hashed after cropping, so the same chart with different margins still matches
+        phash = difference_hash(image)
+
+        if settings['format'] == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+
+        save_args = {'quality': settings['quality']}
+        if settings['format'] == 'WEBP':
+            save_args['method'] = 4
+        else:
+            save_args['optimize'] = True
+
+        output = io.BytesIO()
+        # Saving a new encode without exif/icc arguments leaves all metadata behind
+        image.save(output, format=settings['format'], **save_args)
+        data = output.getvalue()
+    except Exception as e:
+        logger.warning(f"Could not preprocess chart image, sending it unchanged: {str(e)}")
+        return {**chart, 'transform': identity_transform(), 'fingerprint': {'digest': digest, 'phash': None}}
+
+    image_bytes.inc(len(chart['data']), stage='original')
+    image_bytes.inc(len(data), stage='processed')
+    preprocess_duration.observe(time.monotonic() - started)
+    logger.info(f"Preprocessed {chart.get('timeframe') or 'chart'} image: {original_size[0]}x{original_size[1]} "
+                f"{len(chart['data'])} bytes -> {image.width}x{image.height} {len(data)} bytes")
+
+    return {
+        'timeframe': chart.get('timeframe'),
+        'data': data,
+        'mime_type': MIME_TYPES[settings['format']],
+        'transform': {'original_size': list(original_size), 'crop': list(box) if box else None},
+        'fingerprint': {'digest': digest, 'phash': phash}
+    }
+
+def to_original_coordinates(annotation, transform):
+    """
+    Map an annotation's percentage coordinates from the processed image to the original upload
+
+    Lines and points are [x1, y1, x2, y2] / [x, y]; patterns are [x, y, width, height].
+    Downsampling keeps percentages, so only the border crop needs to be undone.
+    """
+    if not transform or not transform.get('crop') or not isinstance(annotation, dict):
+        return annotation
+    coordinates = annotation.get('coordinates')
+    if not isinstance(coordinates, list) or not all(isinstance(value, (int, float)) for value in coordinates):
+        return annotation
+
+    width, height = transform['original_size']
+    left, top, right, bottom = transform['crop']
+    x_scale = (right - left) / width
+    y_scale = (bottom - top) / height
+    x_offset = left / width * 100
+    y_offset = top / height * 100
+
+    mapped = []
+    for index, value in enumerate(coordinates):
+        is_x = index % 2 == 0
+        if annotation.get('type') == 'pattern' and index >= 2:
+            # Width and height scale without an offset
+            mapped.append(round(value * (x_scale if is_x else y_scale), 2))
+        else:
+            mapped.append(round((x_offset + value * x_scale) if is_x else (y_offset + value * y_scale), 2))
+    return {**annotation, 'coordinates': mapped}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def submit_preprocess(chart):
+    """Preprocess a chart on the shared thread pool, returning a future with the processed chart"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = current_app.config.get('CHART_PREPROCESS_WORKERS', 4) if has_app_context() else 4
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chart-preprocess')
+    # Pool threads have no app context, so resolve the settings here
+    return _pool.submit(preprocess_chart, chart, _settings())
+
+def _reset_after_fork():
+    # Pool threads do not survive fork
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,443 @@
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from flask import current_app, g, has_app_context
+from api.tech_analyze.analysis import analyze_charts, draw_annotations
+from api.utils.llm.executor import LLMOverloadedError
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+jobs_total = metrics.counter(
+    'tech_analysis_jobs_total',
+    'Technical analysis jobs by kind and outcome (submitted, succeeded, failed, rejected, requeued)',
+    ('kind', 'outcome')
+)
+
+job_wait = metrics.histogram(
+    'tech_analysis_job_wait_seconds',
+    'Time technical analysis jobs spent queued before a worker claimed them',
+    ('kind',)
+)
+
+job_duration = metrics.histogram(
+    'tech_analysis_job_duration_seconds',
+    'Run time of technical analysis jobs',
+    ('kind',)
+)
+
+class JobLimitError(Exception):
+    """Raised when a client already has the maximum number of active jobs"""
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    requeues INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_expires REAL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, status);
+CREATE TABLE IF NOT EXISTS job_charts (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    timeframe TEXT,
+    mime_type TEXT,
+    transform TEXT,
+    fingerprint TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('succeeded', 'failed')
+
+# Job kinds and the functions that run them; each takes (params, charts) and returns the result
+HANDLERS = {
+    'analysis': lambda params, charts: analyze_charts(params.get('mode', 'simple'), charts, params.get('pipeline', False)),
+    'draw': lambda params, charts: draw_annotations(charts[0], params.get('existing_analysis', '')),
+}
+
+class JobStore:
+    """
+    Job state and inputs in a local SQLite database
+
+    The database is shared by every worker process on the host, so a job
+    submitted to one process can be run and polled by any other, and queued
+    or interrupted jobs are picked up again after a worker is recycled.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Databases created before overloaded jobs were counted lack the requeues column
+            if 'requeues' not in [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN requeues INTEGER NOT NULL DEFAULT 0")
+            # Databases created before charts were preprocessed lack the preprocessing columns
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(job_charts)")]
+            for column in ('transform', 'fingerprint'):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE job_charts ADD COLUMN {column} TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Connection with an immediate (write-locked) transaction, committed on success"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def create(self, kind, owner, params, charts, max_active=None):
+        """
+        Queue a new job
+
+        Args:
+            kind: Key of HANDLERS
+            owner: Client identifier used for the concurrency limit
+            params: JSON-serializable job parameters
+            charts: List of preprocessed chart dictionaries (see images.preprocess_chart)
+            max_active: Maximum queued or running jobs per owner, or None for no limit
+
+        Returns:
+            The new job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            if max_active is not None:
+                active = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE owner = ? AND status IN (?, ?)",
+                    (owner, *ACTIVE_STATUSES)
+                ).fetchone()[0]
+                if active >= max_active:
+                    raise JobLimitError(f"You already have {active} analysis jobs in progress, please wait for one to finish")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner, status, params, created_at, available_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, owner, json.dumps(params), now, now)
+            )
+            conn.executemany(
+                "INSERT INTO job_charts (job_id, position, timeframe, mime_type, transform, fingerprint, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, position, chart.get('timeframe'), chart.get('mime_type'),
+                  json.dumps(chart.get('transform')), json.dumps(chart.get('fingerprint')), chart['data'])
+                 for position, chart in enumerate(charts)]
+            )
+        return job_id
+
+    def claim(self, lease_seconds, max_attempts, result_ttl):
+        """
+        Take the oldest runnable job, or None if there is nothing to do
+
+        Runnable jobs are queued jobs that are due and running jobs whose lease
+        expired because their worker died. Jobs interrupted max_attempts times
+        are failed instead of being run again.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                    "OR (status = 'running' AND lease_expires < ?) ORDER BY created_at LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row['status'] == 'running' and row['attempts'] >= max_attempts:
+                    logger.error(f"Job {row['id']} was interrupted {row['attempts']} times, giving up")
+                    self._finish(conn, row['id'], 'failed', None, "Job was interrupted too many times", result_ttl)
+                    jobs_total.inc(kind=row['kind'], outcome='failed')
+                    continue
+                if row['status'] == 'running':
+                    logger.warning(f"Resuming job {row['id']} after its worker stopped")
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_expires = ? WHERE id = ?",
+                    (now, now + lease_seconds, row['id'])
+                )
+                charts = conn.execute(
+                    "SELECT timeframe, mime_type, transform, fingerprint, data FROM job_charts WHERE job_id = ? ORDER BY position",
+                    (row['id'],)
+                ).fetchall()
+                job = self._to_dict(row)
+                job.update(status='running', started_at=now, attempts=row['attempts'] + 1)
+                job['charts'] = [
+                    {
+                        **dict(chart),
+                        'transform': json.loads(chart['transform']) if chart['transform'] else None,
+                        'fingerprint': json.loads(chart['fingerprint']) if chart['fingerprint'] else None
+                    }
+                    for chart in charts
+                ]
+                return job
+
+    def _finish(self, conn, job_id, status, result, error, ttl):
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires = NULL, expires_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, now, now + ttl, job_id)
+        )
+        # The inputs are only needed while the job can still run
+        conn.execute("DELETE FROM job_charts WHERE job_id = ?", (job_id,))
+
+    def complete(self, job_id, result, ttl):
+        """Store a job's result, kept for ttl seconds"""
+        with self._transaction() as conn:
+            self._finish(conn, job_id, 'succeeded', result, None, ttl)
+
+    def fail(self, job_id, error, ttl):
+        """Mark a job as failed, kept for ttl seconds"""
+        with self._transaction() as conn:
+            self._finish(conn, job_id, 'failed', None, error, ttl)
+
+    def requeue(self, job_id, delay, max_requeues, ttl):
+        """
+        Put a running job back in the queue, due after delay seconds
+
+        Requeues do not count as attempts, but a job requeued max_requeues
+        times is failed instead (kept for ttl seconds).
+
+        Returns:
+            True if the job was requeued, False if it was failed
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT requeues FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return False
+            if row['requeues'] >= max_requeues:
+                self._finish(conn, job_id, 'failed', None, "The model stayed overloaded, please try again later", ttl)
+                return False
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, requeues = requeues + 1, "
+                "available_at = ?, lease_expires = NULL WHERE id = ?",
+                (time.time() + delay, job_id)
+            )
+            return True
+
+    def renew(self, job_ids, lease_seconds):
+        """Extend the leases of running jobs by lease_seconds from now"""
+        if not job_ids:
+            return
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running'",
+                [(time.time() + lease_seconds, job_id) for job_id in job_ids]
+            )
+
+    def get(self, job_id):
+        """Return a job as a dictionary, or None if it does not exist or has expired"""
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row['expires_at'] is not None and row['expires_at'] < time.time()):
+            return None
+        return self._to_dict(row)
+
+    def purge_expired(self):
+        """Delete finished jobs past their retention time"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM job_charts WHERE job_id IN (SELECT id FROM jobs WHERE expires_at < ?)", (time.time(),))
+            deleted = conn.execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),)).rowcount
+        if deleted:
+            logger.info(f"Purged {deleted} expired technical analysis jobs")
+        return deleted
+
+    def _to_dict(self, row):
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'params': json.loads(row['params']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'attempts': row['attempts'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'expires_at': row['expires_at']
+        }
+
+class JobQueue:
+    """
+    Runs jobs from a JobStore on a pool of local worker threads.
+
+    Every worker process runs its own pool; jobs are claimed from the shared
+    store with a lease that a heartbeat thread renews while they run, so a job
+    whose process was recycled mid-run is claimed again once the lease expires.
+    """
+    def __init__(self, store, workers=2, lease_seconds=300, result_ttl=3600, max_attempts=3,
+                 max_active_per_owner=2, max_requeues=20, poll_interval=1.0, sweep_interval=60):
+        self.store = store
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.max_active_per_owner = max_active_per_owner
+        self.max_requeues = max_requeues
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._last_sweep = 0
+
+    def start(self, app):
+        """Start the worker threads once per process"""
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, args=(app,), name=f'tech-job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            heartbeat = threading.Thread(target=self._heartbeat, name='tech-job-heartbeat', daemon=True)
+            heartbeat.start()
+            self._threads.append(heartbeat)
+        logger.info(f"Started {self.workers} technical analysis job workers")
+
+    def submit(self, kind, owner, params, charts):
+        """Queue a job and wake a local worker; raises JobLimitError when the owner is at the limit"""
+        try:
+            job_id = self.store.create(kind, owner, params, charts, self.max_active_per_owner)
+        except JobLimitError:
+            jobs_total.inc(kind=kind, outcome='rejected')
+            raise
+        jobs_total.inc(kind=kind, outcome='submitted')
+        logger.info(f"Queued {kind} job {job_id} for {owner} with {len(charts)} charts")
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _work(self, app):
+        while True:
+            try:
+                self._maybe_sweep()
+                job = self.store.claim(self.lease_seconds, self.max_attempts, self.result_ttl)
+            except Exception as e:
+                logger.error(f"Error claiming technical analysis job: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(app, job)
+
+    def _heartbeat(self):
+        # Renew well before the lease runs out, so a slow renewal does not let another worker take the job
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                running = list(self._running)
+            try:
+                self.store.renew(running, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Error renewing technical analysis job leases: {str(e)}")
+
+    def _maybe_sweep(self):
+        with self._lock:
+            if time.time() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = time.time()
+        self.store.purge_expired()
+
+    def _run(self, app, job):
+        with self._lock:
+            self._running.add(job['id'])
+        try:
+            self._execute(app, job)
+        finally:
+            with self._lock:
+                self._running.discard(job['id'])
+
+    def _execute(self, app, job):
+        kind = job['kind']
+        job_wait.observe(job['started_at'] - job['created_at'], kind=kind)
+        started = time.monotonic()
+        with app.app_context():
+            # LLM deadlines count from the start of the job
+            g.request_started = started
+            try:
+                result = HANDLERS[kind](job['params'], job['charts'])
+            except LLMOverloadedError as e:
+                # The LLM is busy with interactive requests; try again shortly
+                if self.store.requeue(job['id'], e.retry_after, self.max_requeues, self.result_ttl):
+                    logger.warning(f"Requeueing job {job['id']}: {str(e)}")
+                    jobs_total.inc(kind=kind, outcome='requeued')
+                else:
+                    logger.error(f"Technical analysis job {job['id']} failed after {self.max_requeues} requeues: {str(e)}")
+                    jobs_total.inc(kind=kind, outcome='failed')
+                return
+            except Exception as e:
+                logger.error(f"Technical analysis job {job['id']} failed: {str(e)}")
+                self.store.fail(job['id'], str(e), self.result_ttl)
+                jobs_total.inc(kind=kind, outcome='failed')
+                return
+        self.store.complete(job['id'], result, self.result_ttl)
+        job_duration.observe(time.monotonic() - started, kind=kind)
+        jobs_total.inc(kind=kind, outcome='succeeded')
+        logger.info(f"Technical analysis job {job['id']} finished in {time.monotonic() - started:.1f}s")
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Return the process-wide job queue, creating it from app config on first use"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            config = current_app.config if has_app_context() else {}
+            default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data', 'jobs.sqlite3')
+            _job_queue = JobQueue(
+                JobStore(config.get('JOB_DATABASE', default_path)),
+                workers=config.get('JOB_WORKERS', 2),
+                lease_seconds=config.get('JOB_LEASE_SECONDS', 300),
+                result_ttl=config.get('JOB_RESULT_TTL', 3600),
+                max_attempts=config.get('JOB_MAX_ATTEMPTS', 3),
+                max_active_per_owner=config.get('JOB_MAX_ACTIVE_PER_USER', 2),
+                max_requeues=config.get('JOB_MAX_REQUEUES', 20)
+            )
+        return _job_queue
+
+def _reset_after_fork():
+    # Worker threads do not survive fork, so each process starts its own pool
+    global _job_queue, _job_queue_lock
+    _job_queue = None
+    _job_queue_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
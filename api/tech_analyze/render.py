@@ -0,0 +1,184 @@
+import hashlib
+import io
+import json
+import logging
+import time
+from flask import url_for
+from api.utils.artifacts import get_artifact_store
+from api.utils import metrics
+from api.utils.timing import span
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+renders = metrics.counter(
+    'chart_renders_total',
+    'Annotated chart renders by result (hit served from the cache, miss rendered)',
+    ('result',)
+)
+
+render_duration = metrics.histogram(
+    'chart_render_seconds',
+    'Time spent rendering annotations onto one chart image',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+# Output formats: (Pillow format, file extension, save arguments)
+FORMATS = {
+    'png': ('PNG', '.png', {'optimize': True}),
+    'webp': ('WEBP', '.webp', {'quality': 85, 'method': 4}),
+}
+
+# Width of the thumbnail tier used by list views
+THUMBNAIL_WIDTH = 320
+
+DEFAULT_COLORS = {
+    'support': '#22C55E',
+    'resistance': '#EF4444',
+    'trendline': '#3B82F6',
+    'pattern': '#A855F7',
+    'entry': '#22C55E',
+    'exit': '#EF4444',
+    'signal': '#F59E0B',
+}
+
+# Opacity of pattern zones
+ZONE_ALPHA = 48
+
+def annotations_hash(annotations):
+    """Stable hash of a list of annotations"""
+    return hashlib.sha256(json.dumps(annotations, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _color(annotation):
+    from PIL import ImageColor
+    try:
+        return ImageColor.getrgb(annotation.get('color') or DEFAULT_COLORS.get(annotation.get('type'), '#F59E0B'))[:3]
+    except ValueError:
+        return ImageColor.getrgb(DEFAULT_COLORS.get(annotation.get('type'), '#F59E0B'))[:3]
+
+def _label(draw, position, text, color, font, bounds):
+    """Draw a label on a solid background, kept inside the image"""
+    if not text:
+        return
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    padding = max(2, font.size // 5)
+    width = right - left + 2 * padding
+    height = bottom - top + 2 * padding
+    x = min(max(0, position[0]), bounds[0] - width)
+    y = min(max(0, position[1] - height), bounds[1] - height)
+    draw.rectangle((x, y, x + width, y + height), fill=color + (220,))
+    draw.text((x + padding - left, y + padding - top), text, fill=(255, 255, 255, 255), font=font)
+
+def render_annotations(image_data, annotations):
+    """
+    Draw annotations onto a chart image
+
+    Coordinates are percentages of the uploaded image after its EXIF
+    orientation is applied, as returned by the draw endpoints.
+
+    Args:
+        image_data: Uploaded image bytes
+        annotations: List of annotation dictionaries
+
+    Returns:
+        RGB PIL image
+    """
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+    
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_data))).convert('RGBA')
+    width, height = image.size
+    overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+
+    # Scale strokes and text with the image so thumbnails and large screenshots look alike
+    stroke = max(2, round(min(width, height) / 300))
+    font = ImageFont.load_default(size=max(10, round(min(width, height) / 45)))
+
+    def point(x, y):
+        return (x / 100 * width, y / 100 * height)
+
+    for annotation in annotations:
+        coordinates = annotation.get('coordinates')
+        if not isinstance(coordinates, list) or not all(isinstance(value, (int, float)) for value in coordinates):
+            continue
+        color = _color(annotation)
+        kind = annotation.get('type')
+        label = annotation.get('label', '')
+
+        if kind == 'pattern' and len(coordinates) == 4:
+            x, y = point(coordinates[0], coordinates[1])
+            x2, y2 = point(coordinates[0] + coordinates[2], coordinates[1] + coordinates[3])
+            draw.rectangle((x, y, x2, y2), fill=color + (ZONE_ALPHA,), outline=color + (255,), width=stroke)
+            _label(draw, (x, y), label, color, font, (width, height))
+        elif len(coordinates) == 4:
+            start, end = point(coordinates[0], coordinates[1]), point(coordinates[2], coordinates[3])
+            draw.line((start, end), fill=color + (255,), width=stroke)
+            # Label the right-hand end, where the level matters for the next candles
+            _label(draw, max(start, end), label, color, font, (width, height))
+        elif len(coordinates) == 2:
+            x, y = point(coordinates[0], coordinates[1])
+            radius = stroke * 3
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                         fill=color + (255,), outline=(255, 255, 255, 255), width=max(1, stroke // 2))
+            _label(draw, (x + radius, y - radius), label, color, font, (width, height))
+
+    return Image.alpha_composite(image, overlay).convert('RGB')
+
+def _encode(image, fmt):
+    pil_format, _, save_args = FORMATS[fmt]
+    output = io.BytesIO()
+    image.save(output, format=pil_format, **save_args)
+    return output.getvalue()
+
+def render_chart(chart, annotations, fmt='png'):
+    """
+    Render annotations onto an uploaded chart, reusing earlier renders
+
+    Renders are stored in the temp artifact store under a name derived from
+    the image hash and the annotations hash, in full size and as a
+    THUMBNAIL_WIDTH thumbnail.
+
+    Args:
+        chart: Chart dictionary with the uploaded bytes in "original" and its "fingerprint"
+        annotations: Annotations in uploaded-image coordinates
+        fmt: 'png' or 'webp'
+
+    Returns:
+        {"format", "image_url", "thumbnail_url", "cached"} dictionary, or None
+        if the image cannot be rendered (e.g. an upload Pillow cannot read,
+        which preprocessing passed through to the model unchanged)
+    """
+    store = get_artifact_store()
+    extension = FORMATS[fmt][1]
+    key = hashlib.sha256(f"{chart['fingerprint']['digest']}:{annotations_hash(annotations)}".encode('utf-8')).hexdigest()
+    name = f"annotated_{key}{extension}"
+    thumbnail_name = f"annotated_{key}_thumb{extension}"
+
+    cached = store.path(name) is not None and store.path(thumbnail_name) is not None
+    if cached:
+        renders.inc(result='hit')
+        store.touch(name)
+        store.touch(thumbnail_name)
+    else:
+        from PIL import Image
+        renders.inc(result='miss')
+        started = time.monotonic()
+        try:
+            with span('render'):
+                image = render_annotations(chart['original'], annotations)
+                store.save_as(name, _encode(image, fmt))
+                image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4), Image.LANCZOS)
+                store.save_as(thumbnail_name, _encode(image, fmt))
+        except Exception as e:
+            # The annotations are still worth returning without the rendered image
+            logger.warning(f"Could not render annotations onto chart: {str(e)}")
+            return None
+        render_duration.observe(time.monotonic() - started)
+        logger.info(f"Rendered {len(annotations)} annotations onto chart as {fmt}")
+
+    return {
+        'format': fmt,
+        'image_url': url_for('main.temp_artifact', name=name),
+        'thumbnail_url': url_for('main.temp_artifact', name=thumbnail_name),
+        'cached': cached
+    }
@@ -1,13 +1,22 @@
-from flask import Blueprint, request, jsonify, render_template, url_for, current_app
-from api.utils.llm.google import Google
-from api.utils.helpers import save_temp_image, extract_structured_data_from_html
+from flask import Blueprint, Response, request, jsonify, url_for, current_app
+from api.utils.sse import sse_response, sse_event, chunk_events, achunk_events, SSE_HEADERS
+from api.utils.asgi import AsyncRoutes, EventStream
+from api.utils.timing import span
+from api.utils.views import api_errors, InvalidRequest
+from api.utils.admission import client_id
+from api.tech_analyze.analysis import (
+    google_model, TIMEFRAMES, ANALYSIS_SCHEMA, ANNOTATIONS_SCHEMA, analysis_prompt, draw_prompt, chart_parts,
+    parse_analysis, parse_annotations, analysis_response, annotations_response,
+    analyze_charts, iter_pipeline_analysis, draw_annotations,
+    aanalyze_charts, aiter_pipeline_analysis, adraw_annotations
+)
+from api.tech_analyze.images import submit_preprocess, to_original_coordinates
+from api.tech_analyze.render import render_chart, FORMATS as RENDER_FORMATS
+from api.utils.json_stream import IncrementalJSONParser
+from api.tech_analyze.jobs import get_job_queue, JobLimitError, HANDLERS, FINISHED_STATUSES
+import asyncio
 import logging
 import traceback
-import os
-import time
-import json
-import re
-from google.genai.types import Part
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -15,370 +24,429 @@ logger = logging.getLogger(__name__)
 # Create the blueprint
 tech_analyze_bp = Blueprint('tech_analyze', __name__, url_prefix='/api/technical-analysis')
 
-# Initialize the Google LLM model
-google_model = Google()
-logger.info("Google model initialized for technical analysis")
+# Async handlers served natively by the ASGI entry point (asgi.py)
+tech_analyze_async = AsyncRoutes('/api/technical-analysis')
+
+# Seconds between job status checks while streaming job events
+JOB_EVENTS_POLL_INTERVAL = 0.5
+# Seconds after which WSGI clients ask again for the events of a job that has not finished
+JOB_EVENTS_RETRY_AFTER = 2
+
+def _submit_charts(mode):
+    """
+    Read the uploaded chart images for the given analysis mode and submit them for preprocessing
+    
+    Each image is handed to the preprocessing pool as soon as it is read, so
+    resizing overlaps with reading the remaining uploads.
+    
+    Returns:
+        List of (uploaded bytes, future of the preprocessed chart) tuples
+    """
+    uploads = []
+    
+    # Handle images based on mode
+    if mode == 'simple':
+        if 'chart' in request.files:
+            file = request.files['chart']
+            if file.filename:
+                uploads.append((None, file))
+    else:
+        # Handle multiple timeframe charts
+        for file_key, label in TIMEFRAMES:
+            if file_key in request.files:
+                file = request.files[file_key]
+                if file.filename:
+                    uploads.append((label, file))
+    
+    pending = []
+    for label, file in uploads:
+        data = file.read()
+        pending.append((data, submit_preprocess({'timeframe': label, 'data': data, 'mime_type': file.content_type or 'image/jpeg'})))
+    return pending
+
+def _chart(data, chart, keep_original):
+    if keep_original:
+        chart['original'] = data
+    return chart
+
+def _read_charts(mode, keep_original=False):
+    """
+    Read and preprocess the uploaded chart images for the given analysis mode
+    
+    Args:
+        mode: 'simple' or 'advanced'
+        keep_original: Also keep the uploaded bytes in "original" (for rendering)
+    
+    Returns:
+        List of {"timeframe", "data", "mime_type", "transform", "fingerprint"} dictionaries
+    """
+    with span('image'):
+        return [_chart(data, future.result(), keep_original) for data, future in _submit_charts(mode)]
+
+async def _aread_charts(mode, keep_original=False):
+    """Async counterpart of _read_charts, awaiting the preprocessing pool instead of blocking on it"""
+    with span('image'):
+        return [_chart(data, await asyncio.wrap_future(future), keep_original) for data, future in _submit_charts(mode)]
+
+def _use_pipeline(mode, charts):
+    """Whether to fan the charts out per timeframe (form field "pipeline", defaulting to TECH_ANALYSIS_PIPELINE)"""
+    default = 'true' if current_app.config.get('TECH_ANALYSIS_PIPELINE', False) else 'false'
+    return mode != 'simple' and len(charts) > 1 and request.form.get('pipeline', default) == 'true'
+
+def _job_owner():
+    """Identify the client for the per-user job limit"""
+    return client_id()
+
+def _job_response(job):
+    """Public view of a job"""
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'expires_at': job['expires_at'],
+        'result': job['result'],
+        'error': job['error']
+    }
+
+class _AnalysisEvents:
+    """Translates streamed analysis chunks into events (see chunk_events)"""
+    def __init__(self, mode, client_ip):
+        self.mode = mode
+        self.client_ip = client_ip
+        # Each insight is sent as soon as it is complete in the streamed JSON
+        self.parser = IncrementalJSONParser(('insights',))
+        self.failed = False
+    
+    def feed(self, chunk):
+        if chunk["type"] == "text":
+            return [("token", {"text": chunk["text"]})] + [
+                ("insight", {"text": insight}) for insight in self.parser.feed(chunk["text"])
+            ]
+        if chunk["type"] == "error":
+            self.failed = True
+            return [("error", {"error": chunk["error"]})]
+        return []
+    
+    def finish(self):
+        # The full structured result is only available once the stream completes
+        structured_data = parse_analysis(self.parser.text)
+        logger.info(f"Streaming technical analysis completed for {self.client_ip}: {structured_data.get('verdict', 'unknown')} sentiment")
+        return [("analysis", analysis_response(self.mode, structured_data))]
+
+class _AnnotationEvents:
+    """Translates streamed line drawing chunks into events, one per complete annotation (see chunk_events)"""
+    def __init__(self, transform, client_ip):
+        self.transform = transform
+        self.client_ip = client_ip
+        self.parser = IncrementalJSONParser()
+        self.failed = False
+    
+    def feed(self, chunk):
+        if chunk["type"] == "text":
+            return [("annotation", to_original_coordinates(annotation, self.transform))
+                    for annotation in self.parser.feed(chunk["text"])]
+        if chunk["type"] == "error":
+            self.failed = True
+            return [("error", {"error": chunk["error"]})]
+        return []
+    
+    def finish(self):
+        logger.info(f"Streaming line drawing analysis completed for {self.client_ip}")
+        return [("annotations", annotations_response(parse_annotations(self.parser.text), self.transform))]
+
+def _stream_options(mode):
+    """Generation arguments of the streaming analysis"""
+    return dict(temperature=0.3, top_k=20, with_search=False, endpoint='technical_analysis',
+                request_class=mode, response_schema=ANALYSIS_SCHEMA)
+
+def _draw_stream_options():
+    """Generation arguments of the streaming line drawing"""
+    return dict(temperature=0.2, top_k=10, with_search=False, endpoint='technical_analysis_draw',
+                response_schema=ANNOTATIONS_SCHEMA)
+
+@tech_analyze_bp.before_app_request
+def start_job_workers():
+    """Start this process's job workers, which also resume jobs left by recycled workers"""
+    get_job_queue().start(current_app._get_current_object())
+
+@tech_analyze_bp.errorhandler(JobLimitError)
+def job_limit_exceeded(e):
+    """Reject job submissions from clients that already have too many jobs in progress"""
+    logger.warning(f"Job submission from {request.remote_addr} rejected: {str(e)}")
+    response = jsonify({"success": False, "error": str(e)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def _log_request(kind):
+    logger.info(f"{kind} request received from {request.remote_addr}")
+
+def _analysis_mode():
+    """Analysis mode of the request ('simple' or 'advanced')"""
+    mode = request.form.get('mode', 'simple')
+    logger.info(f"Analysis mode: {mode}")
+    return mode
+
+def _render_format():
+    """Format to render the annotations onto the chart in ('png' or 'webp'), or '' for none"""
+    render_format = request.form.get('render', '').lower()
+    if render_format and render_format not in RENDER_FORMATS:
+        raise InvalidRequest(f"Unsupported render format: {render_format}")
+    return render_format
+
+def _required(charts, message):
+    """Return the charts read from the request, rejecting requests without any"""
+    if not charts:
+        raise InvalidRequest(message)
+    return charts
+
+def _analysis_contents(mode, charts):
+    """Content parts of a streaming analysis"""
+    logger.info(f"Streaming Google LLM technical analysis with {len(charts)} images")
+    return [analysis_prompt(mode)] + chart_parts(charts)
+
+def _draw_contents(charts):
+    """Content parts of a streaming line drawing"""
+    return [draw_prompt(request.form.get('existing_analysis', ''))] + chart_parts(charts)
+
+def _analysis_json(response):
+    """Log the outcome of an analysis and return the structured JSON response"""
+    client_ip = request.remote_addr
+    if response['success']:
+        logger.info(f"Technical analysis completed successfully for {client_ip}: {response['analysis']['sentiment']['verdict']} sentiment")
+    else:
+        logger.warning(f"Technical analysis for {client_ip} failed: {response['error']}")
+    return jsonify(response)
+
+def _draw_json(response, rendered=None):
+    """Return the line drawing response, with the rendered chart when there is one"""
+    if rendered is not None:
+        response['rendered'] = rendered
+    logger.info(f"Line drawing analysis completed for {request.remote_addr}")
+    return jsonify(response)
+
+def _should_render(render_format, response):
+    return render_format and not response.get('parse_error')
 
 # Technical analysis API endpoint
 @tech_analyze_bp.route('', methods=['POST'])
+@api_errors('technical analysis API', envelope=True)
 def technical_analysis_api():
     """JSON API endpoint for technical analysis with images"""
+    _log_request("Technical analysis API")
+    mode = _analysis_mode()
+    charts = _required(_read_charts(mode), 'No images provided')
+    return _analysis_json(analyze_charts(mode, charts, pipeline=_use_pipeline(mode, charts)))
+
+# Streaming technical analysis endpoint
+@tech_analyze_bp.route('/stream', methods=['POST'])
+@api_errors('streaming technical analysis API', envelope=True)
+def technical_analysis_stream_api():
+    """Streaming variant of the technical analysis endpoint using Server-Sent Events"""
+    _log_request("Streaming technical analysis")
+    mode = _analysis_mode()
+    # Images must be read while the request is still active
+    charts = _required(_read_charts(mode), 'No images provided')
+    if _use_pipeline(mode, charts):
+        # Per-timeframe results are sent as they finish, then the merged analysis
+        return sse_response(iter_pipeline_analysis(charts))
+    chunks = google_model.generate_stream(_analysis_contents(mode, charts), **_stream_options(mode))
+    return sse_response(chunk_events(chunks, _AnalysisEvents(mode, request.remote_addr)))
+
+# Support/resistance line drawing API endpoint
+@tech_analyze_bp.route('/draw', methods=['POST'])
+@api_errors('technical analysis draw API', envelope=True)
+def technical_analysis_draw_api():
+    """API endpoint for drawing support and resistance lines on charts"""
+    _log_request("Technical analysis draw")
+    render_format = _render_format()
+    charts = _required(_read_charts('simple', keep_original=bool(render_format)), 'No chart image provided')
+    response = draw_annotations(charts[0], request.form.get('existing_analysis', ''))
+    rendered = None
+    if _should_render(render_format, response):
+        rendered = render_chart(charts[0], response['annotations'], render_format)
+    return _draw_json(response, rendered)
+
+# Streaming support/resistance line drawing endpoint
+@tech_analyze_bp.route('/draw/stream', methods=['POST'])
+@api_errors('streaming technical analysis draw API', envelope=True)
+def technical_analysis_draw_stream_api():
+    """Streaming variant of the line drawing endpoint, sending each annotation as soon as it is complete"""
+    _log_request("Streaming technical analysis draw")
+    charts = _required(_read_charts('simple'), 'No chart image provided')
+    chunks = google_model.generate_stream(_draw_contents(charts), **_draw_stream_options())
+    return sse_response(chunk_events(chunks, _AnnotationEvents(charts[0].get('transform'), request.remote_addr)))
+
+# Native ASGI handlers; each mirrors the view of the same path above
+@tech_analyze_async.route('', methods=['POST'])
+@api_errors('technical analysis API', envelope=True)
+async def technical_analysis_api_async():
+    """Async variant of technical_analysis_api"""
+    _log_request("Technical analysis API")
+    mode = _analysis_mode()
+    charts = _required(await _aread_charts(mode), 'No images provided')
+    return _analysis_json(await aanalyze_charts(mode, charts, pipeline=_use_pipeline(mode, charts)))
+
+@tech_analyze_async.route('/stream', methods=['POST'])
+@api_errors('streaming technical analysis API', envelope=True)
+async def technical_analysis_stream_api_async():
+    """Async variant of technical_analysis_stream_api"""
+    _log_request("Streaming technical analysis")
+    mode = _analysis_mode()
+    charts = _required(await _aread_charts(mode), 'No images provided')
+    if _use_pipeline(mode, charts):
+        return EventStream(aiter_pipeline_analysis(charts))
+    chunks = await google_model.agenerate_stream(_analysis_contents(mode, charts), **_stream_options(mode))
+    return EventStream(achunk_events(chunks, _AnalysisEvents(mode, request.remote_addr)))
+
+@tech_analyze_async.route('/draw', methods=['POST'])
+@api_errors('technical analysis draw API', envelope=True)
+async def technical_analysis_draw_api_async():
+    """Async variant of technical_analysis_draw_api; rendering runs in a worker thread"""
+    _log_request("Technical analysis draw")
+    render_format = _render_format()
+    charts = _required(await _aread_charts('simple', keep_original=bool(render_format)), 'No chart image provided')
+    response = await adraw_annotations(charts[0], request.form.get('existing_analysis', ''))
+    rendered = None
+    if _should_render(render_format, response):
+        rendered = await asyncio.to_thread(render_chart, charts[0], response['annotations'], render_format)
+    return _draw_json(response, rendered)
+
+@tech_analyze_async.route('/draw/stream', methods=['POST'])
+@api_errors('streaming technical analysis draw API', envelope=True)
+async def technical_analysis_draw_stream_api_async():
+    """Async variant of technical_analysis_draw_stream_api"""
+    _log_request("Streaming technical analysis draw")
+    charts = _required(await _aread_charts('simple'), 'No chart image provided')
+    chunks = await google_model.agenerate_stream(_draw_contents(charts), **_draw_stream_options())
+    return EventStream(achunk_events(chunks, _AnnotationEvents(charts[0].get('transform'), request.remote_addr)))
+
+# Asynchronous job API
+@tech_analyze_bp.route('/jobs', methods=['POST'])
+def submit_job_api():
+    """Queue a technical analysis or line drawing job and return immediately"""
     client_ip = request.remote_addr
     try:
-        logger.info(f"Technical analysis API request received from {client_ip}")
-        
-        # Get form data
-        mode = request.form.get('mode', 'simple')
-        draw_lines = request.form.get('draw_lines', 'false') == 'true'
-        include_entry_exit = request.form.get('include_entry_exit', 'true') == 'true'
-        
-        logger.info(f"Analysis mode: {mode}, draw_lines: {draw_lines}, include_entry_exit: {include_entry_exit}")
-        
-        # Process images and create content for Google API
-        image_parts = []
-        image_descriptions = []
+        kind = request.form.get('kind', 'analysis')
+        if kind not in HANDLERS:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown job kind: {kind}"
+            }), 400
         
-        # Handle images based on mode
-        if mode == 'simple':
-            if 'chart' in request.files:
-                file = request.files['chart']
-                if file.filename:
-                    img_data = file.read()
-                    # Create a Part object for the image
-                    image_part = Part.from_bytes(data=img_data, mime_type=file.content_type or 'image/jpeg')
-                    image_parts.append(image_part)
-                    image_descriptions.append("Price chart showing recent price action and market structure.")
+        if kind == 'analysis':
+            mode = request.form.get('mode', 'simple')
+            charts = _read_charts(mode)
+            params = {'mode': mode, 'pipeline': _use_pipeline(mode, charts)}
         else:
-            # Handle multiple timeframe charts
-            timeframes = [
-                ('weekly_chart', 'Weekly'),
-                ('daily_chart', 'Daily'),
-                ('four_hour_chart', '4-Hour'),
-                ('one_hour_chart', '1-Hour')
-            ]
-            
-            for file_key, label in timeframes:
-                if file_key in request.files:
-                    file = request.files[file_key]
-                    if file.filename:
-                        img_data = file.read()
-                        # Create a Part object for the image
-                        image_part = Part.from_bytes(data=img_data, mime_type=file.content_type or 'image/jpeg')
-                        image_parts.append(image_part)
-                        image_descriptions.append(f"{label} timeframe chart showing price action and market structure.")
+            params = {'existing_analysis': request.form.get('existing_analysis', '')}
+            charts = _read_charts('simple')
         
-        if not image_parts:
+        if not charts:
             return jsonify({
                 'success': False,
                 'error': 'No images provided'
             }), 400
         
-        # Prepare comprehensive prompt based on mode
-        if mode == 'simple':
-            prompt_text = """You are a professional technical analyst. Analyze this price chart and provide a comprehensive technical analysis.
-
-Focus on:
-1. Price action patterns and market structure
-2. Key support and resistance levels  
-3. Trend direction and strength
-4. Volume analysis if visible
-5. Potential entry and exit points
-6. Risk management considerations
-
-Provide your analysis as a JSON object with the following structure:
-{
-  "verdict": "bullish" | "bearish" | "neutral",
-  "verdict_strength": <number 0-100>,
-  "volatility": "high" | "medium" | "low", 
-  "volatility_strength": <number 0-100>,
-  "insights": [
-    "Key insight 1",
-    "Key insight 2", 
-    "Key insight 3",
-    "Key insight 4"
-  ],
-  "trading_opportunity": "<HTML formatted text describing potential trades, entry/exit points, and risk management>"
-}
-
-Be specific about price levels, patterns, and actionable insights. Focus on pure price action analysis without indicators."""
-        else:
-            prompt_text = """You are a professional technical analyst. Analyze these multiple timeframe charts and provide a comprehensive multi-timeframe technical analysis.
-
-Focus on:
-1. Overall trend direction across timeframes
-2. Key support and resistance levels on each timeframe
-3. Market structure and price action patterns
-4. Confluence between timeframes for potential entries/exits
-5. Volume analysis if visible
-6. Risk management across timeframes
-7. Higher timeframe bias vs lower timeframe execution
-
-Provide your analysis as a JSON object with the following structure:
-{
-  "verdict": "bullish" | "bearish" | "neutral",
-  "verdict_strength": <number 0-100>,
-  "volatility": "high" | "medium" | "low",
-  "volatility_strength": <number 0-100>, 
-  "insights": [
-    "Multi-timeframe insight 1",
-    "Multi-timeframe insight 2",
-    "Multi-timeframe insight 3", 
-    "Multi-timeframe insight 4"
-  ],
-  "trading_opportunity": "<HTML formatted text describing potential trades with timeframe analysis, entry/exit points, and risk management, each point should <br> seperated>"
-}
-
-Be specific about confluence zones, timeframe alignment, and actionable multi-timeframe insights. Focus on pure price action analysis without indicators."""
-        
-        # Create content list for Google API
-        content_parts = [prompt_text] + image_parts
+        job_id = get_job_queue().submit(kind, _job_owner(), params, charts)
+        status_url = url_for('tech_analyze.job_status_api', job_id=job_id)
         
-        # Call Google LLM with image analysis
-        logger.info(f"Calling Google LLM for technical analysis with {len(image_parts)} images")
-        global google_model
-        result = google_model.client.models.generate_content(
-            model=google_model.model_name,
-            contents=content_parts,
-            config={
-                "temperature": 0.3, 
-                "top_k": 20, 
-                "top_p": 0.95,
-                "seed": 0,
-                "max_output_tokens": 65535,
-                "safety_settings": [
-                    {
-                        "category": "HARM_CATEGORY_HATE_SPEECH",
-                        "threshold": "OFF"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                        "threshold": "OFF"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        "threshold": "OFF"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_HARASSMENT",
-                        "threshold": "OFF"
-                    }
-                ],
-                "thinking_config": {
-                    "thinking_budget": -1,
-                }
-            }
-        )
-        
-        # Parse the response to extract structured data
-        try:
-            response_text = result.text
-            logger.info(response_text)
-            logger.info(f"LLM response received: {len(response_text)} characters")
-            
-            # Try to extract JSON from the response
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                structured_data = json.loads(json_str)
-                logger.info("Successfully parsed JSON from LLM response")
-            else:
-                # Fallback if no JSON found
-                logger.warning("No JSON found in LLM response, using fallback")
-                structured_data = {
-                    "verdict": "neutral",
-                    "verdict_strength": 50,
-                    "volatility": "medium",
-                    "volatility_strength": 50,
-                    "insights": [
-                        "Chart analysis completed but could not parse structured data",
-                        "Please try uploading a clearer chart image",
-                        "Ensure the chart shows clear price action and timeframes",
-                        "Manual review may be needed for this analysis"
-                    ],
-                    "trading_opportunity": f"<p>Analysis response: {response_text[:200]}...</p>"
-                }
-        except Exception as e:
-            logger.error(f"Error parsing LLM response: {str(e)}")
-            structured_data = {
-                "verdict": "neutral",
-                "verdict_strength": 50,
-                "volatility": "medium", 
-                "volatility_strength": 50,
-                "insights": [
-                    "Error processing analysis",
-                    "Please try again with a clearer chart",
-                    "Ensure the image shows price data clearly",
-                    "Contact support if the issue persists"
-                ],
-                "trading_opportunity": "<p>Unable to determine trading opportunities. Please try again with a higher quality chart image.</p>"
-            }
-        
-        # Log successful analysis
-        logger.info(f"Technical analysis completed successfully for {client_ip}: {structured_data.get('verdict', 'unknown')} sentiment")
-        
-        # Return structured JSON response
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'mode': mode,
-            'analysis': {
-                'sentiment': {
-                    'verdict': structured_data.get('verdict', 'neutral'),
-                    'strength': structured_data.get('verdict_strength', 50)
-                },
-                'volatility': {
-                    'level': structured_data.get('volatility', 'medium'),
-                    'strength': structured_data.get('volatility_strength', 50)
-                },
-                'insights': structured_data.get('insights', []),
-                'trading_opportunity': structured_data.get('trading_opportunity', '')
-            }
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': status_url,
+            'events_url': url_for('tech_analyze.job_events_api', job_id=job_id)
         })
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
     
+    except JobLimitError:
+        raise
     except Exception as e:
-        logger.error(f"Error in technical analysis API for {client_ip}: {str(e)}")
+        logger.error(f"Error submitting technical analysis job for {client_ip}: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-# Support/resistance line drawing API endpoint
-@tech_analyze_bp.route('/draw', methods=['POST'])
-def technical_analysis_draw_api():
-    """API endpoint for drawing support and resistance lines on charts"""
-    client_ip = request.remote_addr
-    try:
-        logger.info(f"Technical analysis draw request received from {client_ip}")
-        
-        # Get the chart image
-        if 'chart' not in request.files:
-            return jsonify({
-                'success': False,
-                'error': 'No chart image provided'
-            }), 400
-        
-        file = request.files['chart']
-        if not file.filename:
-            return jsonify({
-                'success': False,
-                'error': 'No chart image provided'
-            }), 400
-        
-        img_data = file.read()
-        
-        # Get existing analysis context
-        existing_analysis = request.form.get('existing_analysis', '')
-        
-        # Create image part for Google API
-        image_part = Part.from_bytes(data=img_data, mime_type=file.content_type or 'image/jpeg')
-        
-        # Prepare prompt for line drawing analysis
-        prompt_text = f"""System instruction: You are an expert technical chart analyst. Your task is to analyze the provided trading chart image and identify key technical elements. Return these elements as a JSON array. Each object in the array should represent a single annotation (like a support line, resistance line, trend line, chart pattern, entry/exit point, or signal).
-
-Ensure the JSON array is the only output. Do not include any explanatory text before or after the JSON array. Do not use markdown code fencing (```json ... ```) around the JSON.
-
-Context from previous general analysis (use this to inform your drawing, but focus on coordinate-based annotations):
-{existing_analysis}
-
-Analyze this trading chart and identify the following elements:
-1.  Support levels: Horizontal lines where price has found support.
-2.  Resistance levels: Horizontal lines where price has faced resistance.
-3.  Trend lines: Diagonal lines indicating the primary direction of price movement.
-4.  Chart patterns: Recognizable formations like triangles, head and shoulders, flags, etc.
-5.  Potential entry points: Specific points or small regions suggesting favorable trade entries.
-6.  Potential exit points: Specific points or small regions for taking profits or cutting losses.
-7.  Key signals: Important indicators or candlestick patterns that traders should note (e.g., a pin bar at support).
-
-For each identified element, provide a JSON object with the following fields:
--   "type": (string) The type of element. Examples: "support", "resistance", "trendline", "pattern", "entry", "exit", "signal".
--   "label": (string) A concise description of the element (e.g., "Major Support", "Ascending Triangle", "Entry Signal").
--   "coordinates": (array) The coordinates for the element, expressed as percentages of the image dimensions (0-100).
-    -   For horizontal or diagonal lines (support, resistance, trendline): `[x1, y1, x2, y2]`
-    -   For points (entry, exit, signal): `[x, y]`
-    -   For patterns (e.g., bounding box of a pattern): `[x, y, width, height]`
--   "confidence": (number, 0.0 to 1.0) Your confidence in the accuracy of this identified element.
--   "color": (string, optional) A suggested hex color code for displaying this element (e.g., "#FF0000" for resistance). If not specified, a default will be used.
-
-Example of a single element in the JSON array:
-{{
-  "type": "support",
-  "label": "Support at 100.50",
-  "coordinates": [0, 50, 100, 50],
-  "confidence": 0.85,
-  "color": "#00FF00"
-}}
-
-Provide the response as a single, valid JSON array of such objects. No other text or formatting.
-"""
-        
-        content_parts = [prompt_text, image_part]
-        
-        # Call Google LLM for line analysis
-        global google_model
-        logger.info("Calling Google LLM for support/resistance line analysis")
-        result = google_model.client.models.generate_content(
-            model=google_model.model_name,
-            contents=content_parts,
-            config={
-                "temperature": 0.2, 
-                "top_k": 10, 
-                "top_p": 0.95,
-                "seed": 0,
-                "max_output_tokens": 65535,
-                "safety_settings": [
-                    {
-                        "category": "HARM_CATEGORY_HATE_SPEECH",
-                        "threshold": "OFF"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                        "threshold": "OFF"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        "threshold": "OFF"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_HARASSMENT",
-                        "threshold": "OFF"
-                    }
-                ],
-                "thinking_config": {
-                    "thinking_budget": -1,
-                }
-            }
-        )
-        
-        # Parse the response
-        try:
-            response_text = result.text
-            logger.info(f"Line analysis response received: {len(response_text)} characters")
-            
-            # Try to extract JSON from the response
-            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                annotations_data = json.loads(json_str)
-                logger.info("Successfully parsed line analysis JSON")
-            else:
-                # Fallback
-                logger.warning("No JSON found in line analysis response")
-                annotations_data = []
-        except Exception as e:
-            logger.error(f"Error parsing line analysis response: {str(e)}")
-            annotations_data = []
-        
-        logger.info(f"Line drawing analysis completed for {client_ip}")
-        
+@tech_analyze_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status_api(job_id):
+    """Poll the status of a job; finished jobs include their result"""
+    job = get_job_queue().get(job_id)
+    if job is None:
         return jsonify({
-            'success': True,
-            'annotations': annotations_data
-        })
+            'success': False,
+            'error': 'Job not found or expired'
+        }), 404
     
-    except Exception as e:
-        logger.error(f"Error in technical analysis draw API for {client_ip}: {str(e)}")
-        logger.error(traceback.format_exc())
+    return jsonify({
+        'success': True,
+        'job': _job_response(job)
+    })
+
+def _job_events(job, last_status):
+    """(event, data) tuples for the current state of a job whose status was last reported as last_status"""
+    if job is None:
+        return [("error", {"error": "Job not found or expired"})]
+    events = []
+    if job['status'] != last_status:
+        events.append(("status", {"status": job['status'], "attempts": job['attempts']}))
+    if job['status'] in FINISHED_STATUSES:
+        events.append(("result", _job_response(job)))
+    return events
+
+@tech_analyze_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events_api(job_id):
+    """
+    Send a job's current status as Server-Sent Events
+
+    A stream held open until the job finishes would pin a server thread
+    under WSGI, so an unfinished job gets its status and a retry interval
+    (also sent as Retry-After), after which EventSource reconnects. Finished
+    jobs get their result. The ASGI entry point streams the job with
+    job_events_api_async instead.
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
         return jsonify({
             'success': False,
-            'error': str(e)
-        }), 500 
\ No newline at end of file
+            'error': 'Job not found or expired'
+        }), 404
+    
+    events = _job_events(job, None)
+    if job['status'] in FINISHED_STATUSES:
+        return sse_response(iter(events))
+    
+    frames = f"retry: {JOB_EVENTS_RETRY_AFTER * 1000}\n\n" + ''.join(sse_event(data, event) for event, data in events)
+    return Response(frames, mimetype='text/event-stream',
+                    headers={**SSE_HEADERS, 'Retry-After': str(JOB_EVENTS_RETRY_AFTER)})
+
+@tech_analyze_async.route('/jobs/<job_id>/events', methods=['GET'])
+async def job_events_api_async(job_id):
+    """Async variant of job_events_api, which waits between status checks as a coroutine"""
+    job_queue = get_job_queue()
+    if await asyncio.to_thread(job_queue.get, job_id) is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found or expired'
+        }), 404
+    
+    async def events():
+        job, last_status = await asyncio.to_thread(job_queue.get, job_id), None
+        while True:
+            for event in _job_events(job, last_status):
+                yield event
+            if job is None or job['status'] in FINISHED_STATUSES:
+                return
+            last_status = job['status']
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+            job = await asyncio.to_thread(job_queue.get, job_id)
+    
+    return EventStream(events())
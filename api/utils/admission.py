@@ -0,0 +1,445 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import re
+import threading
+import time
+from flask import g, jsonify, request
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+admissions = metrics.counter(
+    'admission_requests_total',
+    'Requests by admission pool and outcome (admitted, queued, rate_limited, shed_full, shed_deadline)',
+    ('pool', 'outcome')
+)
+
+queue_wait = metrics.histogram(
+    'admission_queue_wait_seconds',
+    'Time admitted requests waited in their pool\'s queue',
+    ('pool',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+
+# Weight of the latest request in a pool's moving average of service times
+SERVICE_TIME_SMOOTHING = 0.2
+
+class AdmissionRejected(Exception):
+    """A request turned away by admission control, with the status and Retry-After to answer it with"""
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class RateLimiter:
+    """
+    Per-client token buckets
+
+    Each client's bucket holds up to burst tokens and refills at rate tokens
+    per second; a request takes one. Buckets of idle clients are full again
+    after burst / rate seconds and are dropped when there are more than
+    max_clients.
+    """
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """
+        Take a token for client
+
+        Returns:
+            0 if the request may proceed, otherwise seconds until the next token
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+            return 0
+
+    def _prune(self, now):
+        refill = self.burst / self.rate
+        self._buckets = {client: (tokens, updated) for client, (tokens, updated) in self._buckets.items()
+                         if now - updated < refill}
+
+class _Waiter:
+    """A request queued for a slot; granted by the request releasing one, or evicted by a fairer one"""
+    __slots__ = ('client', 'granted', 'evicted', 'cancelled', 'event', 'loop', 'future')
+
+    def __init__(self, client, loop=None):
+        self.client = client
+        self.granted = False
+        self.evicted = False
+        self.cancelled = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self):
+        self.granted = True
+        self._wake()
+
+    def evict(self):
+        self.evicted = True
+        self.cancelled = True
+        self._wake()
+
+    def _wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+class Ticket:
+    """An admitted request's slot in its pool, returned with release()"""
+    __slots__ = ('pool', 'client', 'started')
+
+    def __init__(self, pool, client):
+        self.pool = pool
+        self.client = client
+        self.started = time.monotonic()
+
+    def release(self):
+        self.pool.release(self)
+
+class Pool:
+    """
+    Capacity shared by a class of routes in one worker process
+
+    At most capacity requests run at once and at most queue_size more wait
+    for a slot. Waiting requests are ordered by how many requests their
+    client already had running or queued, then by route priority and
+    arrival, so a client flooding the pool is served after the others. When
+    the queue is full, a request that would sort before the last queued one
+    takes its place and the last one is shed; otherwise the new request is.
+    A request is also shed when its expected wait plus the pool's average
+    service time would exceed the deadline.
+    """
+    def __init__(self, name, capacity, queue_size, deadline, service_time, rate, burst):
+        self.name = name
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.service_time = service_time  # Moving average, starting from the configured estimate
+        self.limiter = RateLimiter(rate, burst) if rate else None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._load_by_client = {}  # Running and queued requests per client
+        self._heap = []
+        self._waiting = 0
+        self._sequence = itertools.count()
+
+    def _expected_wait(self, position):
+        return math.ceil(position / self.capacity) * self.service_time
+
+    def _add_load(self, client, amount):
+        load = self._load_by_client.get(client, 0) + amount
+        if load > 0:
+            self._load_by_client[client] = load
+        else:
+            self._load_by_client.pop(client, None)
+
+    def _enter(self, client, priority, loop=None):
+        """Admit, queue or reject a request; returns a Ticket or a queued _Waiter"""
+        if self.limiter is not None:
+            wait = self.limiter.take(client)
+            if wait:
+                admissions.inc(pool=self.name, outcome='rate_limited')
+                raise AdmissionRejected("Too many requests, please slow down", 429, math.ceil(wait))
+
+        with self._lock:
+            if self._active < self.capacity and not self._waiting:
+                admissions.inc(pool=self.name, outcome='admitted')
+                self._active += 1
+                self._add_load(client, 1)
+                return Ticket(self, client)
+            key = (self._load_by_client.get(client, 0), priority, next(self._sequence))
+            if self._waiting >= self.queue_size:
+                last = max((entry for entry in self._heap if not entry[-1].cancelled), default=None)
+                if last is None or last[:3] < key:
+                    admissions.inc(pool=self.name, outcome='shed_full')
+                    raise self._busy(self._waiting + 1)
+                last[-1].evict()
+                self._waiting -= 1
+                self._add_load(last[-1].client, -1)
+            expected = self._expected_wait(self._waiting + 1)
+            if expected + self.service_time > self.deadline:
+                admissions.inc(pool=self.name, outcome='shed_deadline')
+                raise self._busy(self._waiting + 1)
+
+            waiter = _Waiter(client, loop)
+            heapq.heappush(self._heap, key + (waiter,))
+            self._waiting += 1
+            self._add_load(client, 1)
+            return waiter
+
+    def _busy(self, position):
+        return AdmissionRejected("Server is busy, please retry shortly", 503,
+                                 max(1, math.ceil(self._expected_wait(position))))
+
+    def _max_wait(self):
+        return max(0.0, self.deadline - self.service_time)
+
+    def _woken(self, waiter, started):
+        """Ticket for a waiter that was granted a slot, or the rejection of one that was evicted"""
+        if waiter.evicted:
+            admissions.inc(pool=self.name, outcome='shed_full')
+            raise self._busy(self.queue_size)
+        return self._granted(waiter, started)
+
+    def _give_up(self, waiter, started):
+        """Handle a wait that timed out; returns a Ticket if the slot was granted meanwhile"""
+        with self._lock:
+            if waiter.granted or waiter.evicted:
+                return self._woken(waiter, started)
+            waiter.cancelled = True
+            self._waiting -= 1
+            self._add_load(waiter.client, -1)
+        admissions.inc(pool=self.name, outcome='shed_deadline')
+        raise self._busy(1)
+
+    def _granted(self, waiter, started):
+        # release() already counted the waiter as running
+        admissions.inc(pool=self.name, outcome='queued')
+        queue_wait.observe(time.monotonic() - started, pool=self.name)
+        return Ticket(self, waiter.client)
+
+    def acquire(self, client, priority=0):
+        """
+        Wait for a slot, blocking the calling thread
+
+        Returns:
+            Ticket to release when the request is done
+
+        Raises:
+            AdmissionRejected: The request was rate limited or shed
+        """
+        started = time.monotonic()
+        entry = self._enter(client, priority)
+        if isinstance(entry, Ticket):
+            return entry
+        if entry.event.wait(self._max_wait()):
+            return self._woken(entry, started)
+        return self._give_up(entry, started)
+
+    async def aacquire(self, client, priority=0):
+        """Wait for a slot without blocking the event loop (see acquire)"""
+        started = time.monotonic()
+        entry = self._enter(client, priority, asyncio.get_running_loop())
+        if isinstance(entry, Ticket):
+            return entry
+        try:
+            await asyncio.wait_for(asyncio.shield(entry.future), self._max_wait())
+            return self._woken(entry, started)
+        except asyncio.TimeoutError:
+            return self._give_up(entry, started)
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = entry.granted
+                if not granted and not entry.evicted:
+                    entry.cancelled = True
+                    self._waiting -= 1
+                    self._add_load(entry.client, -1)
+            if granted:
+                self.release(Ticket(self, entry.client))
+            raise
+
+    def release(self, ticket):
+        """Free a slot and hand it to the first waiting request"""
+        duration = time.monotonic() - ticket.started
+        with self._lock:
+            self.service_time += SERVICE_TIME_SMOOTHING * (duration - self.service_time)
+            self._active -= 1
+            self._add_load(ticket.client, -1)
+            while self._heap:
+                _, _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled:
+                    continue
+                self._waiting -= 1
+                self._active += 1
+                waiter.grant()
+                break
+
+    def stats(self):
+        """Current pool occupancy"""
+        with self._lock:
+            return {
+                'in_flight': self._active,
+                'queued': self._waiting,
+                'capacity': self.capacity,
+                'queue_size': self.queue_size,
+                'service_time': round(self.service_time, 3),
+            }
+
+class AdmissionController:
+    """
+    Maps requests to pools by path prefix and admits them
+
+    Args:
+        pools: {name: {"capacity", "queue", "deadline", "service_time", "rate", "burst"}} dictionary
+        routes: {path prefix: (pool name, priority) or None} dictionary; the longest matching
+            prefix applies, and requests matching none or a None entry are not limited. A *
+            in a prefix matches one path segment (e.g. a job id)
+    """
+    def __init__(self, pools, routes):
+        self.pools = {
+            name: Pool(name, settings['capacity'], settings['queue'], settings['deadline'],
+                       settings['service_time'], settings.get('rate'), settings.get('burst', 1))
+            for name, settings in pools.items()
+        }
+        # Longest prefix first
+        self.routes = [
+            (re.compile(re.escape(prefix).replace(r'\*', '[^/]+')), target)
+            for prefix, target in sorted(routes.items(), key=lambda item: len(item[0]), reverse=True)
+        ]
+
+    def route(self, path):
+        """(pool, priority) for a request path, or (None, None) if it is not limited"""
+        for prefix, target in self.routes:
+            if prefix.match(path):
+                if target is None:
+                    return None, None
+                pool, priority = target
+                return self.pools[pool], priority
+        return None, None
+
+_controller = None
+
+def get_controller():
+    """The admission controller configured by init_admission(), or None"""
+    return _controller
+
+def client_id():
+    """
+    Identify the client of the current request for rate limits, fairness and job limits
+
+    This is the remote address rather than a header like X-User-Id, which is
+    not authenticated: a client sending a new value with each request would
+    get a full bucket every time. Behind a reverse proxy the server has to
+    pass the client's address on (uWSGI over the uwsgi protocol, or uvicorn
+    with --proxy-headers).
+    """
+    return request.remote_addr
+
+def _rejected_response(e, pool):
+    logger.warning(f"{request.method} {request.path} from {client_id()} rejected by {pool.name} admission "
+                   f"with {e.status_code}: {str(e)}")
+    response = jsonify({"success": False, "error": str(e)})
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def _target():
+    if _controller is None or request.method == 'OPTIONS':
+        return None, None
+    return _controller.route(request.path)
+
+async def aadmit_request():
+    """
+    Admit the current request from an async handler
+
+    The ASGI entry point calls this after the app's before_request hooks,
+    which skip admission for native async handlers so the wait does not block
+    the event loop.
+
+    Returns:
+        None if the request may proceed, otherwise the rejection response
+    """
+    pool, priority = _target()
+    if pool is None:
+        return None
+    try:
+        g.admission = await pool.aacquire(client_id(), priority)
+    except AdmissionRejected as e:
+        return _rejected_response(e, pool)
+    return None
+
+def _server_threads():
+    """Request threads per process of the uWSGI server running the app, or None outside uWSGI"""
+    try:
+        import uwsgi
+    except ImportError:
+        return None
+    threads = uwsgi.opt.get('threads')
+    if isinstance(threads, bytes):
+        threads = threads.decode()
+    try:
+        return int(threads) if threads else 1
+    except ValueError:
+        return None
+
+def check_thread_reserve(config):
+    """
+    Warn when LLM requests can hold every uWSGI thread of a process
+
+    Under uWSGI each admitted or queued LLM request holds a thread while it
+    waits on the model, so the capacity + queue of the pools other than data
+    (or, without admission control, the LLM executor's concurrency + queue)
+    has to stay below the threads per process for data routes to get one.
+    """
+    threads = _server_threads()
+    if threads is None:
+        return
+    if config.get('ADMISSION_ENABLED', True):
+        held = sum(settings['capacity'] + settings['queue']
+                   for name, settings in config['ADMISSION_POOLS'].items() if name != 'data')
+        setting = "capacity + queue of the non-data ADMISSION_POOLS"
+    else:
+        held = config.get('LLM_MAX_CONCURRENCY', 8) + config.get('LLM_MAX_QUEUE', 4)
+        setting = "LLM_MAX_CONCURRENCY + LLM_MAX_QUEUE"
+    if held >= threads:
+        logger.warning(f"LLM requests can hold all {threads} uWSGI threads per process ({setting} is {held}); "
+                       f"chart and quote requests will queue behind the model. Raise threads or lower the limits.")
+
+def init_admission(app):
+    """
+    Admission control for the routes listed in ADMISSION_ROUTES
+
+    Requests are admitted into the ADMISSION_POOLS pool of their route before
+    any view runs, and rejected with 429 (client over its rate) or 503 (pool
+    full, or the wait would outlast the deadline) and a Retry-After header.
+    Pools and rate limits are per worker process; the master process never
+    admits requests, so workers forked from it start with empty pools.
+    """
+    global _controller
+    config = app.config
+    check_thread_reserve(config)
+    if not config.get('ADMISSION_ENABLED', True):
+        return
+    _controller = AdmissionController(config['ADMISSION_POOLS'], config['ADMISSION_ROUTES'])
+
+    @app.before_request
+    def admit_request():
+        if g.get('admission_async') or 'admission' in g:
+            return None
+        pool, priority = _target()
+        if pool is None:
+            return None
+        try:
+            g.admission = pool.acquire(client_id(), priority)
+        except AdmissionRejected as e:
+            return _rejected_response(e, pool)
+        return None
+
+    @app.teardown_request
+    def release_admission(exc):
+        ticket = g.pop('admission', None)
+        if ticket is not None:
+            ticket.release()
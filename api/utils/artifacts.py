@@ -0,0 +1,266 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from flask import current_app, has_app_context
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+evictions = metrics.counter(
+    'temp_artifacts_evicted_total',
+    'Temporary artifacts deleted by the sweeper, by reason (age, quota)',
+    ('reason',)
+)
+
+disk_usage = metrics.gauge(
+    'temp_artifacts_bytes',
+    'Bytes used by temporary artifacts after the last sweep',
+    multiprocess_mode='max'
+)
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the image formats accepted from clients
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+]
+
+# Partial writes older than this are left over from a crashed worker
+STALE_PARTIAL_SECONDS = 3600
+
+PARTIAL_PREFIX = '.partial-'
+
+def image_extension(head):
+    """File extension for the image format starting with head, or None if it is not a supported image"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+class ArtifactStore:
+    """
+    Content-addressed store for temporary files such as rendered charts
+
+    Files are streamed to a partial file in chunks while being hashed, then
+    atomically renamed to their SHA-256, so concurrent writers never collide
+    and identical files are stored once. Saving or serving a file refreshes
+    its modification time, which the sweeper uses to delete files older than
+    max_age and then the least recently used ones until usage is below max_bytes.
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, max_age=86400, sweep_interval=300):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._written = 0
+        self._sweeper = None
+        os.makedirs(directory, exist_ok=True)
+
+    def save_stream(self, chunks, prefix='', extension=None):
+        """
+        Write an iterable of byte chunks to the store
+
+        Args:
+            chunks: Iterable of bytes
+            prefix: Readable prefix of the stored name
+            extension: File extension; detected from the content when None, which
+                rejects anything that is not a supported image
+
+        Returns:
+            Stored file name ("<prefix>_<sha256><extension>")
+        """
+        partial, digest, extension = self._write(chunks, extension)
+        name = f"{prefix}_{digest}{extension}" if prefix else f"{digest}{extension}"
+        return self._commit(partial, name)
+
+    def save_as(self, name, data):
+        """
+        Store a derived artifact under a name chosen by the caller
+
+        The name must identify the content (e.g. a hash of the inputs it was
+        generated from); an existing file with that name is kept.
+        """
+        if self.path(name) is not None:
+            self.touch(name)
+            return name
+        buffer = io.BytesIO(data)
+        partial, _, _ = self._write(iter(lambda: buffer.read(CHUNK_SIZE), b''), os.path.splitext(name)[1])
+        return self._commit(partial, name)
+
+    def _write(self, chunks, extension):
+        """Stream chunks to a partial file, returning (partial path, sha256 hex digest, extension)"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, partial = tempfile.mkstemp(prefix=PARTIAL_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if extension is None:
+                        extension = image_extension(chunk[:16])
+                        if extension is None:
+                            raise ValueError("Unsupported image format")
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            if size == 0:
+                raise ValueError("Empty file")
+            # mkstemp creates the file readable by its owner only; published files are world-readable
+            os.chmod(partial, 0o644)
+            return partial, digest.hexdigest(), extension
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    def _commit(self, partial, name):
+        """Move a partial file into place under name"""
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            # Same content already stored; keep it and mark it as recently used
+            os.remove(partial)
+            self.touch(name)
+        else:
+            size = os.path.getsize(partial)
+            os.replace(partial, path)
+            self._account(size)
+        return name
+
+    def save_bytes(self, data, prefix='', extension=None):
+        """Store an in-memory payload"""
+        buffer = io.BytesIO(data)
+        return self.save_stream(iter(lambda: buffer.read(CHUNK_SIZE), b''), prefix, extension)
+
+    def path(self, name):
+        """Absolute path of a stored file, or None if the name is invalid or missing"""
+        if not name or name != os.path.basename(name) or name.startswith('.'):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def touch(self, name):
+        """Mark a file as recently used"""
+        try:
+            os.utime(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _account(self, size):
+        # Sweep early when this process alone has written a good share of the quota
+        with self._lock:
+            self._written += size
+            over = self._written > self.max_bytes // 4
+            if over:
+                self._written = 0
+        if over:
+            self.sweep()
+
+    def sweep(self):
+        """
+        Delete expired files, then the least recently used ones while over quota
+
+        Returns:
+            Number of files deleted
+        """
+        now = time.time()
+        files = []
+        deleted = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(PARTIAL_PREFIX):
+                    if now - stat.st_mtime > STALE_PARTIAL_SECONDS:
+                        deleted += self._remove(entry.path, 'age')
+                    continue
+                if entry.name.startswith('.'):
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    deleted += self._remove(entry.path, 'age')
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            # Evict down to 90% so the next few writes do not trigger another sweep
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                if self._remove(path, 'quota'):
+                    total -= size
+                    deleted += 1
+
+        disk_usage.set(total)
+        if deleted:
+            logger.info(f"Temp artifact sweep deleted {deleted} files, {total} bytes in use")
+        return deleted
+
+    def _remove(self, path, reason):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another worker process swept it first
+            return 0
+        evictions.inc(reason=reason)
+        return 1
+
+    def start_sweeper(self):
+        """Start the background sweeper thread of this process (idempotent)"""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, name='temp-artifact-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping temp artifacts: {str(e)}")
+            time.sleep(self.sweep_interval)
+
+_artifact_store = None
+_artifact_store_lock = threading.Lock()
+
+def get_artifact_store():
+    """Return the process-wide artifact store, creating it (and its sweeper) from app config on first use"""
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            config = current_app.config if has_app_context() else {}
+            default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data', 'temp')
+            _artifact_store = ArtifactStore(
+                config.get('UPLOAD_FOLDER', default_path),
+                max_bytes=config.get('TEMP_STORE_MAX_BYTES', 512 * 1024 * 1024),
+                max_age=config.get('TEMP_STORE_MAX_AGE', 86400),
+                sweep_interval=config.get('TEMP_STORE_SWEEP_INTERVAL', 300)
+            )
+            _artifact_store.start_sweeper()
+        return _artifact_store
+
+def _reset_after_fork():
+    # The sweeper thread does not survive fork, so each process starts its own
+    global _artifact_store, _artifact_store_lock
+    _artifact_store = None
+    _artifact_store_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,216 @@
+import asyncio
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response, g, request
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from api.utils.sse import asse_frames, SSE_HEADERS
+from api.utils.admission import aadmit_request
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class AsyncRoutes:
+    """
+    Async handlers served natively by the ASGI entry point (asgi.py)
+
+    Used like a blueprint: each feature module declares its handlers with
+    route(), next to the WSGI views they mirror. Rules use Flask's syntax and
+    handlers take the rule's variables as keyword arguments, like views. They
+    run inside a Flask request context, so request, g and current_app work as
+    in a view, and return anything a view may return, or an EventStream.
+    """
+    def __init__(self, url_prefix=''):
+        self.url_prefix = url_prefix
+        self.handlers = {}
+
+    def route(self, rule, methods=('GET',)):
+        def decorator(handler):
+            for method in methods:
+                self.handlers[(method, self.url_prefix + rule)] = handler
+            return handler
+        return decorator
+
+class EventStream:
+    """Handler result streamed to the client as Server-Sent Events"""
+    def __init__(self, events):
+        self.events = events
+
+class ASGIApplication:
+    """
+    ASGI application serving the registered async handlers natively and every
+    other route through the Flask app
+
+    Native handlers wait on the LLM executor as coroutines, so a request
+    waiting on the model costs a coroutine rather than a server thread. Each
+    request still gets a Flask request context built from the buffered body,
+    and the app's before/after request hooks, error handlers and CORS headers
+    apply as they do under WSGI. Routes without an async handler run in a
+    thread through asgiref's WsgiToAsgi adapter.
+    """
+    def __init__(self, app, routes):
+        self.app = app
+        self.handlers = {}
+        for async_routes in routes:
+            self.handlers.update(async_routes.handlers)
+        self.url_map = Map([Rule(rule, endpoint=(method, rule), methods=[method]) for method, rule in self.handlers])
+        self.fallback = WsgiToAsgi(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        match = self._match(scope) if scope['type'] == 'http' else None
+        if match is None:
+            await self.fallback(scope, receive, send)
+            return
+        await self._handle(*match, scope, receive, send)
+
+    def _match(self, scope):
+        """(handler, rule variables) for a request, or None to pass it to the Flask app"""
+        try:
+            endpoint, view_args = self.url_map.bind('').match(scope['path'], method=scope['method'])
+        except HTTPException:
+            # Not found, wrong method or a redirect; the Flask app answers those
+            return None
+        return self.handlers[endpoint], view_args
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Blocking work (market data, prompt compaction, cache lookups) runs in the default executor
+                threads = self.app.config.get('ASGI_BLOCKING_THREADS', 32)
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-blocking')
+                )
+                logger.info(f"ASGI application started with {len(self.handlers)} native routes")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive, limit):
+        """Read the request body, or return None once it exceeds limit bytes"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    def _environ(self, scope, body):
+        """WSGI environ for an ASGI HTTP scope and its buffered body"""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1')
+            if name == 'content-length':
+                continue
+            key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+            value = value.decode('latin-1')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _handle(self, handler, view_args, scope, receive, send):
+        body = await self._read_body(receive, self.app.config.get('MAX_CONTENT_LENGTH'))
+        if body is None:
+            await self._send_response(send, Response('{"error": "Request body too large"}', 413, mimetype='application/json'))
+            return
+
+        ctx = self.app.request_context(self._environ(scope, body))
+        ctx.push()
+        try:
+            try:
+                # Admission waits as a coroutine after the other before_request hooks, not in them
+                g.admission_async = True
+                rv = self.app.preprocess_request()
+                if rv is None:
+                    rv = await aadmit_request()
+                if rv is None:
+                    rv = await handler(**view_args)
+            except Exception as e:
+                rv = self._handle_exception(e)
+
+            if isinstance(rv, EventStream):
+                head = self.app.process_response(Response(mimetype='text/event-stream', headers=SSE_HEADERS))
+                await self._send_events(send, receive, head, rv.events)
+            else:
+                response = self.app.process_response(self.app.make_response(rv))
+                await self._send_response(send, response)
+        finally:
+            ctx.pop()
+
+    def _handle_exception(self, e):
+        """Response from the app's error handlers, or its 500 response"""
+        try:
+            return self.app.handle_user_exception(e)
+        except Exception as unhandled:
+            return self.app.handle_exception(unhandled)
+
+    def _headers(self, response):
+        return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+
+    async def _send_response(self, send, response):
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': self._headers(response)})
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def _send_events(self, send, receive, head, events):
+        """
+        Stream (event, data) tuples as SSE frames until they end or the client disconnects
+
+        A disconnect cancels the stream, which closes the event generators and
+        with them the generation on the LLM executor.
+        """
+        async def stream():
+            await send({'type': 'http.response.start', 'status': head.status_code, 'headers': self._headers(head)})
+            async for frame in asse_frames(events):
+                await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        streaming = asyncio.ensure_future(stream())
+        watcher = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (streaming, watcher):
+                task.cancel()
+            # Let the generators clean up while the request context is still pushed
+            await asyncio.gather(streaming, watcher, return_exceptions=True)
+        if not watcher.cancelled():
+            logger.info(f"Client disconnected from {request.path} mid-stream, generation cancelled")
+        elif not streaming.cancelled():
+            streaming.result()
@@ -0,0 +1,301 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import click
+from flask import abort, request, send_file, url_for
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Subdirectory of the static folder the build writes to, served as /static/dist/
+BUILD_DIRECTORY = 'dist'
+MANIFEST_FILE = 'manifest.json'
+
+# Static files the build fingerprints; anything else under the static folder is left to the static route
+ASSET_EXTENSIONS = ('.css', '.js', '.svg', '.png', '.jpg', '.jpeg', '.gif', '.ico')
+# Text formats worth precompressing; images are already compressed
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg')
+# Raster images that get a resized, optimized copy and a WebP variant
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Characters of the content hash put into built filenames
+HASH_LENGTH = 12
+
+# Strings and comments in CSS; whitespace is collapsed everywhere but in strings
+_CSS_STRINGS_AND_COMMENTS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+
+def _minify_css_code(code):
+    return _CSS_PUNCTUATION.sub(r'\1', _CSS_SPACE.sub(' ', code)).replace(';}', '}')
+
+def minify_css(text):
+    """Drop comments and collapse whitespace in a stylesheet, leaving strings alone"""
+    pieces, code, position = [], [], 0
+    for match in _CSS_STRINGS_AND_COMMENTS.finditer(text):
+        code.append(text[position:match.start()])
+        position = match.end()
+        if match.group(1) is None:
+            code.append(' ')  # A comment separates tokens like whitespace
+            continue
+        pieces.append(_minify_css_code(''.join(code)))
+        pieces.append(match.group(1))
+        code = []
+    code.append(text[position:])
+    pieces.append(_minify_css_code(''.join(code)))
+    return ''.join(pieces).strip()
+
+# Optional packages of the build, and what the build lacks without them
+OPTIONAL_PACKAGES = {
+    'rjsmin': 'scripts are not minified',
+    'brotli': 'no brotli variants are built',
+}
+
+def missing_packages():
+    """{package: effect} for the optional build packages that are not installed"""
+    import importlib.util
+    return {name: effect for name, effect in OPTIONAL_PACKAGES.items() if importlib.util.find_spec(name) is None}
+
+def minify(name, data):
+    """
+    Minified contents of a stylesheet or script
+
+    Stylesheets are minified here. Scripts are minified with rjsmin when it
+    is installed and built as they are otherwise.
+    """
+    extension = os.path.splitext(name)[1]
+    if extension == '.css':
+        return minify_css(data.decode('utf-8')).encode('utf-8')
+    if extension == '.js':
+        try:
+            import rjsmin
+        except ImportError:
+            return data
+        return rjsmin.jsmin(data.decode('utf-8')).encode('utf-8')
+    return data
+
+def optimize_image(path, max_size=None, webp_quality=85):
+    """
+    Optimized copy of a raster image and its WebP variant
+
+    Args:
+        path: Source image
+        max_size: Longest side in pixels; larger images are scaled down
+        webp_quality: Quality of the WebP variant (0-100)
+
+    Returns:
+        (image bytes in the source format, WebP bytes)
+    """
+    import io
+    from PIL import Image
+
+    with Image.open(path) as source:
+        image_format = source.format
+        image = source.copy()
+    if max_size and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    optimized = io.BytesIO()
+    if image_format == 'JPEG':
+        image.convert('RGB').save(optimized, format='JPEG', quality=webp_quality, optimize=True, progressive=True)
+    else:
+        image.save(optimized, format=image_format, optimize=True)
+    webp = io.BytesIO()
+    image.save(webp, format='WEBP', quality=webp_quality, method=6)
+    return optimized.getvalue(), webp.getvalue()
+
+def hashed_name(name, data):
+    """name with the hash of data before its extension, e.g. style.css -> style.0123456789ab.css"""
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}"
+
+def compress(data):
+    """
+    Precompressed variants of data
+
+    Returns:
+        {encoding: bytes} dictionary with the gzip and, if the brotli package
+        is installed, br variants that are smaller than data
+    """
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: variant for encoding, variant in variants.items() if len(variant) < len(data)}
+
+# Suffix of each precompressed variant's file
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def build_assets(static_folder, exclude=(), image_sizes=None, webp_quality=85):
+    """
+    Write fingerprinted, minified and precompressed copies of the static assets
+
+    Every asset under static_folder is written to its dist subdirectory under
+    a name carrying the hash of its contents, next to .gz and .br variants
+    for text formats; raster images are optimized, scaled down to their
+    image_sizes entry and get a WebP variant named like the image with a
+    .webp extension. The manifest mapping source names to built names is
+    replaced last, so pages rendered meanwhile keep pointing at files that
+    exist. Files of earlier builds are kept for pages cached with their names.
+
+    Args:
+        static_folder: The app's static folder
+        exclude: Subdirectories of static_folder to skip (e.g. the upload folder)
+        image_sizes: {name: longest side in pixels} dictionary
+        webp_quality: Quality of optimized JPEG and WebP images
+
+    Returns:
+        {source name: built name} manifest
+    """
+    output = os.path.join(static_folder, BUILD_DIRECTORY)
+    skipped = {os.path.abspath(path) for path in (output, *(os.path.join(static_folder, name) for name in exclude))}
+    image_sizes = image_sizes or {}
+    manifest = {}
+
+    def emit(name, data):
+        built = hashed_name(name, data)
+        path = os.path.join(output, built)
+        _write(path, data)
+        if name.endswith(COMPRESSIBLE_EXTENSIONS):
+            for encoding, variant in compress(data).items():
+                _write(path + ENCODING_SUFFIXES[encoding], variant)
+        manifest[name] = built
+
+    for directory, subdirectories, files in os.walk(static_folder):
+        subdirectories[:] = sorted(name for name in subdirectories
+                                   if os.path.abspath(os.path.join(directory, name)) not in skipped)
+        for filename in sorted(files):
+            if not filename.lower().endswith(ASSET_EXTENSIONS):
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                data, webp = optimize_image(path, image_sizes.get(name), webp_quality)
+                emit(name, data)
+                emit(os.path.splitext(name)[0] + '.webp', webp)
+                continue
+            with open(path, 'rb') as f:
+                emit(name, minify(name, f.read()))
+
+    _write(os.path.join(output, MANIFEST_FILE), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    logger.info(f"Built {len(manifest)} assets into {output}")
+    return manifest
+
+class AssetManifest:
+    """
+    Built assets of the running app, loaded from the manifest at startup
+
+    Args:
+        directory: Build output directory
+        manifest: {source name: built name} dictionary
+    """
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        # Precompressed variants on disk for each built file
+        self.encodings = {
+            built: tuple(encoding for encoding, suffix in ENCODING_SUFFIXES.items()
+                         if os.path.exists(os.path.join(directory, built + suffix)))
+            for built in manifest.values()
+        }
+
+    @classmethod
+    def load(cls, directory):
+        """Manifest written by build_assets(), or None if there is none"""
+        path = os.path.join(directory, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return cls(directory, json.load(f))
+
+_manifest = None
+_max_age = 31536000  # ASSET_MAX_AGE
+
+def asset_url(filename, fallback=True):
+    """
+    URL of a static file, fingerprinted if it was built
+
+    Used like url_for('static', filename=...) in templates. Without a build
+    (or with ASSET_FINGERPRINTING off) it returns the plain static URL, or
+    None if fallback is False, which lets templates offer built-only variants
+    like WebP images conditionally.
+    """
+    built = _manifest.manifest.get(filename) if _manifest is not None else None
+    if built is not None:
+        return url_for('assets', filename=built)
+    return url_for('static', filename=filename) if fallback else None
+
+def _negotiate(encodings):
+    """Best precompressed variant the client accepts, or None for the file itself"""
+    accepted = request.accept_encodings
+    for encoding in encodings:
+        if accepted[encoding]:
+            return encoding
+    return None
+
+def serve_asset(filename):
+    """Serve a built asset, precompressed if the client accepts it, cached for good"""
+    encodings = _manifest.encodings.get(filename) if _manifest is not None else None
+    if encodings is None:
+        abort(404)
+    encoding = _negotiate(encodings)
+    path = os.path.join(_manifest.directory, filename)
+    if encoding is not None:
+        path += ENCODING_SUFFIXES[encoding]
+    etag = filename if encoding is None else f"{filename}-{encoding}"
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=etag, max_age=_max_age)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    # Names carry the content hash, so a name always refers to the same bytes
+    response.headers['Cache-Control'] = f"public, max-age={_max_age}, immutable"
+    return response
+
+def init_assets(app):
+    """
+    Fingerprinted static assets
+
+    Registers the asset_url() template helper, the /static/dist/ route
+    serving the output of the build-assets command, and the command itself.
+    """
+    global _manifest, _max_age
+    config = app.config
+    directory = os.path.join(app.static_folder, BUILD_DIRECTORY)
+    _max_age = config.get('ASSET_MAX_AGE', _max_age)
+    if config.get('ASSET_FINGERPRINTING', True):
+        try:
+            _manifest = AssetManifest.load(directory)
+        except Exception as e:
+            logger.error(f"Error loading the asset manifest: {str(e)}")
+        if _manifest is None:
+            logger.info(f"No asset manifest in {directory}, serving static files as they are")
+
+    app.add_template_global(asset_url)
+    # More specific than the static route, so it takes precedence for the build output
+    app.add_url_rule(f"{app.static_url_path}/{BUILD_DIRECTORY}/<path:filename>", 'assets', serve_asset)
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Fingerprint, minify and precompress the static assets."""
+        for name, effect in missing_packages().items():
+            click.secho(f"WARNING: {name} is not installed, so {effect} (pip install -r requirements.txt)",
+                        fg='yellow', err=True)
+        exclude = [os.path.relpath(config['UPLOAD_FOLDER'], app.static_folder)]
+        manifest = build_assets(app.static_folder, exclude, config.get('ASSET_IMAGE_SIZES'),
+                                config.get('ASSET_WEBP_QUALITY', 85))
+        print(f"Built {len(manifest)} assets into {directory}")
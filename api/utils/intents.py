@@ -0,0 +1,146 @@
+import json
+import logging
+import re
+from api.utils.views import InvalidRequest
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class IntentError(InvalidRequest):
+    """Raised when an inference request names an unknown intent or has an invalid payload"""
+
+# Payload fields of each intent: name -> (accepted types, required)
+INTENT_FIELDS = {
+    'portfolio_news': {
+        'symbols': ((str, list), True),
+    },
+    'portfolio_analysis': {
+        'portfolio': ((dict,), True),
+    },
+    'portfolio_chat': {
+        'portfolio': ((dict,), True),
+        'message': ((str,), True),
+    },
+    'generate': {
+        'prompt': ((str,), True),
+        'urls': ((list,), False),
+    },
+}
+
+# Markers identifying the prompts of the legacy (prompt-only) request format
+NEWS_MARKER = "news items about these financial assets"
+ANALYSIS_MARKER = "Please analyze this portfolio data"
+CHAT_MARKER = "You are a financial portfolio assistant analyzing this portfolio"
+
+# Every pattern starts with a literal and has no nested or unbounded lazy
+# quantifiers, so matching is linear in the prompt length
+NEWS_SYMBOLS = re.compile(r"these financial assets:[ \t]*([^\n]*)")
+CHAT_MESSAGE = re.compile(r"The user asks:[ \t]*([^\n]*)")
+
+_decoder = json.JSONDecoder()
+
+def validate_payload(intent, payload):
+    """
+    Check an intent's payload against INTENT_FIELDS
+
+    Returns:
+        The payload restricted to the intent's fields
+
+    Raises:
+        IntentError: For an unknown intent, a missing required field or a field of the wrong type
+    """
+    if not isinstance(intent, str) or intent not in INTENT_FIELDS:
+        raise IntentError(f"Unknown intent: {intent}")
+    if not isinstance(payload, dict):
+        raise IntentError("payload must be a JSON object")
+
+    validated = {}
+    for field, (types, required) in INTENT_FIELDS[intent].items():
+        value = payload.get(field)
+        if value is None or value == '':
+            if required:
+                raise IntentError(f"{intent} requires {field}")
+            continue
+        if not isinstance(value, types):
+            raise IntentError(f"{intent}.{field} must be of type {' or '.join(t.__name__ for t in types)}")
+        validated[field] = value
+    return validated
+
+def _json_object_after(prompt, marker_end):
+    """Decode the first JSON object after a position in one pass, or return {}"""
+    start = prompt.find('{', marker_end)
+    if start == -1:
+        return {}
+    try:
+        value, _ = _decoder.raw_decode(prompt, start)
+    except ValueError as e:
+        logger.error(f"Error extracting portfolio data from prompt: {str(e)}")
+        return {}
+    return value if isinstance(value, dict) else {}
+
+def parse_legacy_prompt(prompt, urls=None):
+    """
+    Map a legacy prompt-only request onto an intent and payload
+
+    The portfolio is decoded directly from the JSON embedded in the prompt
+    with a single raw_decode pass, instead of locating it with regular
+    expressions first.
+
+    Args:
+        prompt: Prompt text sent by the client
+        urls: Optional URLs for URL-context generation
+
+    Returns:
+        (intent, payload) tuple
+    """
+    news_at = prompt.find(NEWS_MARKER)
+    if news_at != -1:
+        match = NEWS_SYMBOLS.search(prompt, news_at)
+        symbols = match.group(1) if match else ''
+        # The symbol list ends with the sentence, e.g. "...assets: AAPL, MSFT. "
+        end = symbols.find('. ')
+        symbols = symbols[:end] if end != -1 else symbols.rstrip().rstrip('.')
+        return 'portfolio_news', {'symbols': symbols.strip()}
+
+    analysis_at = prompt.find(ANALYSIS_MARKER)
+    if analysis_at != -1:
+        portfolio = _json_object_after(prompt, analysis_at + len(ANALYSIS_MARKER))
+        logger.info(f"Extracted portfolio data with {len(portfolio.get('assets', []))} assets")
+        return 'portfolio_analysis', {'portfolio': portfolio}
+
+    chat_at = prompt.find(CHAT_MARKER)
+    if chat_at != -1:
+        portfolio = _json_object_after(prompt, chat_at + len(CHAT_MARKER))
+        match = CHAT_MESSAGE.search(prompt, chat_at)
+        logger.info(f"Extracted portfolio data for chat with {len(portfolio.get('assets', []))} assets")
+        return 'portfolio_chat', {'portfolio': portfolio, 'message': match.group(1).strip() if match else ''}
+
+    payload = {'prompt': prompt}
+    if urls:
+        payload['urls'] = urls
+    return 'generate', payload
+
+def parse_inference_request(data):
+    """
+    Resolve the intent and payload of an /infer request body
+
+    Structured requests send {"intent": ..., "payload": {...}}; legacy requests
+    send {"prompt": ..., "urls": [...]} and are mapped by parse_legacy_prompt.
+
+    Raises:
+        IntentError: If the body is not a JSON object, has neither an intent nor
+            a prompt, or fails validation
+    """
+    if not isinstance(data, dict):
+        raise IntentError("Request body must be a JSON object")
+    if 'intent' in data:
+        return data['intent'], validate_payload(data['intent'], data.get('payload') or {})
+
+    prompt = data.get('prompt')
+    if not prompt or not isinstance(prompt, str):
+        raise IntentError("No prompt provided")
+    intent, payload = parse_legacy_prompt(prompt, data.get('urls'))
+    # Legacy portfolio prompts may carry no usable portfolio; the handlers accept an empty one
+    if intent in ('portfolio_analysis', 'portfolio_chat'):
+        return intent, payload
+    return intent, validate_payload(intent, payload)
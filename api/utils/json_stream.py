@@ -0,0 +1,125 @@
+import json
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class IncrementalJSONParser:
+    """
+    Incremental scanner that yields the elements of one JSON array as soon as
+    each element is complete, while the rest of the document is still streaming.
+
+    The array is selected by its path of object keys from the root, e.g.
+    ('insights',) for {"insights": [...]} or () for a top-level array. Text
+    before the root value (such as a markdown code fence) is skipped. Each
+    character is scanned once, so feeding a response in chunks costs linear time.
+    """
+    def __init__(self, path=()):
+        self.path = tuple(path)
+        self.text = ""
+        self._pos = 0
+        self._stack = []  # Frames: [type, path, key, expect_key, item_start]
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._done = False
+
+    def feed(self, chunk):
+        """
+        Add a chunk of text
+
+        Returns:
+            List of the target array's elements completed by this chunk (decoded)
+        """
+        self.text += chunk
+        items = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            if self._done:
+                break
+            c = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._end_string(i, items)
+                continue
+
+            if not self._stack:
+                # Skip anything before the root object or array
+                if c in '{[':
+                    self._push(c, i)
+                continue
+
+            frame = self._stack[-1]
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+                if self._is_target(frame) and frame[4] is None:
+                    frame[4] = i
+            elif c in '{[':
+                if self._is_target(frame) and frame[4] is None:
+                    frame[4] = i
+                self._push(c, i)
+            elif c in '}]':
+                if self._is_target(frame) and frame[4] is not None:
+                    # Scalar element right before the closing bracket
+                    self._emit(frame[4], i, items)
+                self._stack.pop()
+                if not self._stack:
+                    self._done = True
+                elif self._is_target(self._stack[-1]) and self._stack[-1][4] is not None:
+                    self._emit(self._stack[-1][4], i + 1, items)
+                    self._stack[-1][4] = None
+            elif c == ',':
+                if frame[0] == 'obj':
+                    frame[3] = True
+                elif self._is_target(frame) and frame[4] is not None:
+                    self._emit(frame[4], i, items)
+                    frame[4] = None
+            elif not c.isspace() and c != ':':
+                # Start of a number, true, false or null
+                if self._is_target(frame) and frame[4] is None:
+                    frame[4] = i
+
+        self._pos = len(text)
+        return items
+
+    def _push(self, c, i):
+        if self._stack:
+            parent = self._stack[-1]
+            path = parent[1] + ((parent[2],) if parent[0] == 'obj' else ('*',))
+        else:
+            path = ()
+        if c == '{':
+            self._stack.append(['obj', path, None, True, None])
+        else:
+            self._stack.append(['arr', path, None, False, None])
+
+    def _is_target(self, frame):
+        return frame[0] == 'arr' and frame[1] == self.path
+
+    def _end_string(self, i, items):
+        frame = self._stack[-1] if self._stack else None
+        if frame is None:
+            return
+        if frame[0] == 'obj' and frame[3]:
+            # The string was an object key
+            frame[2] = json.loads(self.text[self._string_start:i + 1])
+            frame[3] = False
+        elif self._is_target(frame) and frame[4] == self._string_start:
+            self._emit(frame[4], i + 1, items)
+            frame[4] = None
+
+    def _emit(self, start, end, items):
+        fragment = self.text[start:end].strip()
+        if not fragment:
+            return
+        try:
+            items.append(json.loads(fragment))
+        except ValueError as e:
+            logger.warning(f"Skipping malformed streamed JSON element: {str(e)}")
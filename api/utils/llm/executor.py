@@ -0,0 +1,257 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+from flask import current_app, has_app_context
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class LLMUnavailableError(Exception):
+    """Base class for LLM failures that are reported to the client as an HTTP error status"""
+    status_code = 503
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMOverloadedError(LLMUnavailableError):
+    """Raised when an LLM call is rejected because the executor queue is full"""
+
+class LLMStream:
+    """
+    Synchronous iterator over the items produced by an async generator running
+    on the executor loop. Closing it (or dropping it) cancels the generation.
+    """
+    _END = object()
+
+    def __init__(self, items, future):
+        self._items = items
+        self._future = future
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        kind, value = self._items.get()
+        if kind is self._END:
+            raise StopIteration
+        if kind == 'error':
+            raise value
+        return value
+
+    def close(self):
+        if not self._future.done():
+            self._future.cancel()
+
+    def __del__(self):
+        self.close()
+
+class AsyncLLMStream:
+    """
+    Async iterator over the items produced by an async generator running on
+    the executor loop, consumed from another event loop (e.g. the ASGI
+    server's). Closing it (or dropping it) cancels the generation.
+    """
+    def __init__(self, items, future):
+        self._items = items
+        self._future = future
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        kind, value = await self._items.get()
+        if kind is LLMStream._END:
+            raise StopAsyncIteration
+        if kind == 'error':
+            raise value
+        return value
+
+    def close(self):
+        if not self._future.done():
+            self._future.cancel()
+
+    async def aclose(self):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+class LLMExecutor:
+    """
+    Runs LLM calls on the async genai client inside a dedicated event loop thread.
+
+    At most max_concurrency calls are in flight at once and at most max_queue
+    more may wait for a slot; anything beyond that is rejected immediately with
+    LLMOverloadedError so request threads are never parked behind a backlog.
+    """
+    def __init__(self, max_concurrency=4, max_queue=4, retry_after=5):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._pending = 0
+        self._active = 0
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._thread = threading.Thread(target=self._loop.run_forever, name='llm-executor', daemon=True)
+                self._thread.start()
+                logger.info(f"LLM executor started (concurrency={self.max_concurrency}, queue={self.max_queue})")
+            return self._loop
+
+    def _reserve(self):
+        with self._lock:
+            if self._pending >= self.max_concurrency + self.max_queue:
+                logger.warning(f"LLM executor full: {self._active} in flight, {self._pending - self._active} queued")
+                raise LLMOverloadedError("LLM capacity exhausted, please retry shortly", self.retry_after)
+            self._pending += 1
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def _guarded(self, coro_factory):
+        async with self._semaphore:
+            with self._lock:
+                self._active += 1
+            try:
+                return await coro_factory()
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+    def submit(self, coro_factory):
+        """
+        Schedule a coroutine on the executor loop
+
+        Args:
+            coro_factory: Zero-argument callable returning the coroutine to run
+
+        Returns:
+            concurrent.futures.Future with the coroutine's result
+        """
+        loop = self._ensure_loop()
+        self._reserve()
+        future = asyncio.run_coroutine_threadsafe(self._guarded(coro_factory), loop)
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, coro_factory, timeout=None):
+        """Run a coroutine on the executor loop and wait for its result, cancelling it on timeout"""
+        future = self.submit(coro_factory)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def arun(self, coro_factory):
+        """
+        Run a coroutine on the executor loop and await its result from another event loop
+
+        Only a coroutine waits on the result, not a thread; cancelling the
+        awaiting task cancels the call.
+        """
+        return await asyncio.wrap_future(self.submit(coro_factory))
+
+    def _pump(self, agen_factory, put):
+        """Coroutine factory that runs the generator and hands each item to put"""
+        async def pump():
+            try:
+                async for item in await agen_factory():
+                    put(('item', item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                put(('error', e))
+            finally:
+                put((LLMStream._END, None))
+        return pump
+
+    def stream(self, agen_factory):
+        """
+        Start an async generator on the executor loop and iterate it synchronously
+
+        Args:
+            agen_factory: Zero-argument coroutine function returning an async iterator
+
+        Returns:
+            LLMStream yielding the generator's items as they are produced
+        """
+        items = queue.Queue()
+        future = self.submit(self._pump(agen_factory, items.put))
+        return LLMStream(items, future)
+
+    def astream(self, agen_factory):
+        """
+        Start an async generator on the executor loop and iterate it from the calling event loop
+
+        Must be called from a coroutine. The slot is reserved immediately, so
+        LLMOverloadedError is raised here rather than on the first item.
+
+        Args:
+            agen_factory: Zero-argument coroutine function returning an async iterator
+
+        Returns:
+            AsyncLLMStream yielding the generator's items as they are produced
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(items.put_nowait, item)
+            except RuntimeError:
+                # The consumer's loop has shut down; nobody is left to read the item
+                pass
+
+        future = self.submit(self._pump(agen_factory, put))
+        return AsyncLLMStream(items, future)
+
+    def stats(self):
+        """Current executor occupancy"""
+        with self._lock:
+            return {
+                "in_flight": self._active,
+                "queued": self._pending - self._active,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue
+            }
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return the process-wide LLM executor, creating it from app config on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if has_app_context():
+                config = current_app.config
+                _executor = LLMExecutor(
+                    max_concurrency=config.get('LLM_MAX_CONCURRENCY', 8),
+                    max_queue=config.get('LLM_MAX_QUEUE', 4),
+                    retry_after=config.get('LLM_RETRY_AFTER', 5)
+                )
+            else:
+                _executor = LLMExecutor()
+        return _executor
+
+def _reset_after_fork():
+    # The loop thread does not survive fork, so each worker builds its own executor
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
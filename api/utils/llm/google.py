@@ -1,27 +1,425 @@
-from google import genai
-from google.genai.types import GenerateContentConfig, GoogleSearch, HttpOptions, Tool, SafetySetting, ThinkingConfig
+import hashlib
 import json
-import os
 import logging
-from google.cloud import aiplatform
+import time
 from flask import current_app, has_app_context
+from api.utils.llm.executor import get_executor, LLMUnavailableError
+from api.utils.llm.resilience import get_policy, request_deadline, hedge_delay, call_with_policy, stream_with_policy
+from api.utils.llm.registry import get_client
+from api.utils.llm.singleflight import SingleFlight
+from api.utils.llm.router import router, RouteDecision
+from api.utils import metrics
+from api.utils.timing import span
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Identical concurrent requests share one generation across all Google instances
+_single_flight = SingleFlight()
+
+token_usage = metrics.counter(
+    'llm_tokens_total',
+    'Tokens consumed by LLM calls',
+    ('endpoint', 'model', 'type')
+)
+
+request_duration = metrics.histogram(
+    'llm_request_duration_seconds',
+    'Wall-clock duration of completed LLM generations',
+    ('endpoint', 'model')
+)
+
+generations = metrics.counter(
+    'llm_generations_total',
+    'LLM generations by endpoint, model and result (ok, failed; failed includes cancelled streams)',
+    ('endpoint', 'model', 'result')
+)
+
+time_to_first_token = metrics.histogram(
+    'llm_time_to_first_token_seconds',
+    'Time until the first streamed chunk of an LLM response',
+    ('endpoint', 'model')
+)
+
+def record_usage(endpoint, model_name, usage):
+    """Log and count the token usage reported for a finished generation"""
+    if usage is None:
+        return
+    input_tokens = usage.prompt_token_count or 0
+    output_tokens = usage.candidates_token_count or 0
+    thinking_tokens = usage.thoughts_token_count or 0
+    token_usage.inc(input_tokens, endpoint=endpoint, model=model_name, type='input')
+    token_usage.inc(output_tokens, endpoint=endpoint, model=model_name, type='output')
+    token_usage.inc(thinking_tokens, endpoint=endpoint, model=model_name, type='thinking')
+    logger.info(f"LLM usage for {endpoint} on {model_name}: {input_tokens} input, {output_tokens} output, {thinking_tokens} thinking tokens")
+
+def request_key(model_name, contents, config):
+    """
+    Hash a generation request so identical requests map to the same key
+    
+    Strings, parts (including image bytes) and configs are all included, so
+    only requests that would be sent to the model byte-for-byte identically
+    share a key.
+    """
+    digest = hashlib.sha256(model_name.encode())
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, str):
+            digest.update(b"s" + item.encode())
+        elif hasattr(item, 'model_dump_json'):
+            digest.update(b"p" + item.model_dump_json(exclude_none=True).encode())
+        else:
+            digest.update(b"r" + repr(item).encode())
+    if hasattr(config, 'model_dump_json'):
+        digest.update(config.model_dump_json(exclude_none=True).encode())
+    else:
+        digest.update(json.dumps(config, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+class _StreamTracker:
+    """Latencies and token usage of one streamed generation"""
+    def __init__(self, decision):
+        self.decision = decision
+        self.started = time.monotonic()
+        self.usage = None
+        self.latency = None
+        self.ttft = None
+
+    def observe(self, chunk):
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+            time_to_first_token.observe(self.ttft, endpoint=self.decision.endpoint, model=self.decision.model)
+        if getattr(chunk, 'usage_metadata', None) is not None:
+            self.usage = chunk.usage_metadata
+
+    def complete(self):
+        self.latency = time.monotonic() - self.started
+        request_duration.observe(self.latency, endpoint=self.decision.endpoint, model=self.decision.model)
+        record_usage(self.decision.endpoint, self.decision.model, self.usage)
+
+    def end(self):
+        router.end(self.decision, self.latency, self.ttft)
+        generations.inc(endpoint=self.decision.endpoint, model=self.decision.model,
+                        result='ok' if self.latency is not None else 'failed')
+
 class Google:
-    def __init__(self, model_name=None):
-        # Initialize the Vertex AI SDK
-        aiplatform.init()
+    def __init__(self, model_name=None, api_version="v1"):
+        # Construction is cheap: the model name is resolved from app config and
+        # the genai client is fetched from the shared registry when first needed
+        self._model_name = model_name
+        self.api_version = api_version
+
+    @property
+    def model_name(self):
+        """Explicit model name, or DEFAULT_LLM_MODEL from the app config"""
+        if self._model_name:
+            return self._model_name
+        if has_app_context():
+            return current_app.config.get('DEFAULT_LLM_MODEL', 'gemini-2.5-pro')
+        return 'gemini-2.5-pro'
+
+    @property
+    def client(self):
+        """Shared genai client for this model and API version"""
+        return get_client(self.model_name, self.api_version)
+
+    def _route(self, endpoint, request_class=None):
+        """Pick the model and thinking budget for a call (an explicit model name disables routing)"""
+        if self._model_name:
+            return RouteDecision(endpoint, 'explicit', self._model_name, None, 'explicit')
+        return router.select(endpoint, request_class)
+
+    def _apply_route(self, config, decision):
+        """Return config with the routed thinking budget applied"""
+        if decision.thinking_budget is None or config is None:
+            return config
+        if isinstance(config, dict):
+            return {**config, "thinking_config": {"thinking_budget": decision.thinking_budget}}
+        from google.genai.types import ThinkingConfig
+        return config.model_copy(update={"thinking_config": ThinkingConfig(thinking_budget=decision.thinking_budget)})
+
+    def _prepare(self, config, endpoint, request_class, timeout=None, kind='latency'):
+        """
+        Resolve the model, client, policy, deadline and hedge delay of a call
+        
+        This runs on the calling thread, which has the app and request context;
+        the call itself runs on the executor thread.
+        
+        Returns:
+            (decision, config, client, policy, deadline, hedge_after) tuple
+        """
+        decision = self._route(endpoint, request_class)
+        config = self._apply_route(config, decision)
+        client = get_client(decision.model, self.api_version)
+        policy = get_policy(endpoint, request_class)
+        deadline = time.monotonic() + timeout if timeout else request_deadline(policy)
+        hedge_after = hedge_delay(policy, router.percentile(decision.tier, policy.hedge_percentile, kind=kind))
+        return decision, config, client, policy, deadline, hedge_after
+
+    def _record_call(self, decision, response, latency):
+        """Record the duration and token usage of a finished blocking call"""
+        request_duration.observe(latency, endpoint=decision.endpoint, model=decision.model)
+        record_usage(decision.endpoint, decision.model, response.usage_metadata)
+
+    def generate_content(self, contents, config=None, timeout=None, endpoint='default', request_class=None):
+        """
+        Run a raw generate_content call on the async client via the LLM executor
+        
+        The calling thread only waits on a future; the request itself is driven
+        by the executor's event loop, which bounds how many calls run at once.
+        The model and thinking budget are chosen by the router for the endpoint
+        and request class, and the endpoint's request policy sets the deadline,
+        retries and hedging. Concurrent identical requests share a single generation.
+        Raises LLMOverloadedError when the executor queue is full and
+        LLMDeadlineExceeded when the deadline (or timeout, in seconds) passes.
+        """
+        # Blocking calls have no first token, so they hedge on the full latency percentile
+        decision, config, client, policy, deadline, hedge_after = self._prepare(config, endpoint, request_class, timeout)
+        
+        def call():
+            router.begin(decision)
+            started = time.monotonic()
+            latency = None
+            try:
+                response = get_executor().run(
+                    lambda: call_with_policy(
+                        lambda: client.aio.models.generate_content(
+                            model=decision.model,
+                            contents=contents,
+                            config=config,
+                        ),
+                        policy, endpoint, deadline, hedge_after
+                    )
+                )
+                latency = time.monotonic() - started
+            finally:
+                router.end(decision, latency)
+                generations.inc(endpoint=decision.endpoint, model=decision.model, result='ok' if latency is not None else 'failed')
+            self._record_call(decision, response, latency)
+            return response
+        
+        with span('llm'):
+            if not self._single_flight_enabled():
+                return call()
+            return _single_flight.do(request_key(decision.model, contents, config), call)
+
+    async def agenerate_content(self, contents, config=None, timeout=None, endpoint='default', request_class=None):
+        """
+        Async counterpart of generate_content for handlers running on an event loop
+        
+        The call goes through the same executor, routing and request policy, but
+        the caller awaits it as a coroutine instead of parking a thread. Identical
+        requests are not coalesced on this path, since single-flight followers
+        wait on a thread.
+        """
+        decision, config, client, policy, deadline, hedge_after = self._prepare(config, endpoint, request_class, timeout)
+        router.begin(decision)
+        started = time.monotonic()
+        latency = None
+        try:
+            with span('llm'):
+                response = await get_executor().arun(
+                    lambda: call_with_policy(
+                        lambda: client.aio.models.generate_content(
+                            model=decision.model,
+                            contents=contents,
+                            config=config,
+                        ),
+                        policy, endpoint, deadline, hedge_after
+                    )
+                )
+            latency = time.monotonic() - started
+        finally:
+            router.end(decision, latency)
+            generations.inc(endpoint=decision.endpoint, model=decision.model, result='ok' if latency is not None else 'failed')
+        self._record_call(decision, response, latency)
+        return response
+
+    def _stream_opener(self, contents, config, client, policy, decision, deadline, hedge_after):
+        """Coroutine function opening the policy-wrapped stream on the executor loop"""
+        async def open_stream():
+            return stream_with_policy(
+                lambda: client.aio.models.generate_content_stream(
+                    model=decision.model,
+                    contents=contents,
+                    config=config,
+                ),
+                policy, decision.endpoint, deadline, hedge_after
+            )
+        return open_stream
+
+    def generate_content_stream(self, contents, config=None, endpoint='default', request_class=None):
+        """
+        Start a streaming generate_content call on the async client via the LLM executor
+        
+        Returns an iterator of response chunks. The executor slot is reserved
+        immediately, so LLMOverloadedError is raised before any chunk is read.
+        Retries and hedging (on the time-to-first-chunk percentile) apply until
+        the first chunk arrives; the deadline applies to the whole stream.
+        A concurrent identical stream is joined and replayed from the start.
+        """
+        decision, config, client, policy, deadline, hedge_after = self._prepare(config, endpoint, request_class, kind='ttft')
+        open_stream = self._stream_opener(contents, config, client, policy, decision, deadline, hedge_after)
+        
+        def start():
+            stream = get_executor().stream(open_stream)
+            return self._track_stream_usage(stream, decision)
+        
+        if not self._single_flight_enabled():
+            return start()
+        return _single_flight.stream(request_key(decision.model, contents, config), start)
+
+    async def agenerate_content_stream(self, contents, config=None, endpoint='default', request_class=None):
+        """
+        Async counterpart of generate_content_stream
         
-        # Get model name from config if in app context
+        Returns an async iterator of response chunks; LLMOverloadedError is
+        raised when this is awaited. Identical streams are not coalesced.
+        """
+        decision, config, client, policy, deadline, hedge_after = self._prepare(config, endpoint, request_class, kind='ttft')
+        stream = get_executor().astream(self._stream_opener(contents, config, client, policy, decision, deadline, hedge_after))
+        return self._atrack_stream_usage(stream, decision)
+
+    def _track_stream_usage(self, stream, decision):
+        """
+        Pass chunks through, then record the latencies and the usage reported on the final chunk
+
+        The call counts as in flight for routing from the first read until the
+        iterator is exhausted or closed; a stream that is never read is not
+        counted (dropping it cancels the generation).
+        """
+        tracker = _StreamTracker(decision)
+        router.begin(decision)
+        try:
+            for chunk in stream:
+                tracker.observe(chunk)
+                yield chunk
+            tracker.complete()
+        finally:
+            tracker.end()
+            stream.close()
+
+    async def _atrack_stream_usage(self, stream, decision):
+        """Async counterpart of _track_stream_usage"""
+        tracker = _StreamTracker(decision)
+        router.begin(decision)
+        try:
+            async for chunk in stream:
+                tracker.observe(chunk)
+                yield chunk
+            tracker.complete()
+        finally:
+            tracker.end()
+            await stream.aclose()
+
+    def count_tokens(self, contents):
+        """Count the input tokens of contents with the model's tokenizer (one API round trip)"""
+        model_name = self.model_name
+        client = self.client
+        response = get_executor().run(
+            lambda: client.aio.models.count_tokens(model=model_name, contents=contents)
+        )
+        return response.total_tokens
+
+    def _single_flight_enabled(self):
         if has_app_context():
-            self.model_name = model_name or current_app.config.get('DEFAULT_LLM_MODEL', 'gemini-2.5-pro')
-        else:
-            self.model_name = model_name or 'gemini-2.5-pro'
+            return current_app.config.get('LLM_SINGLE_FLIGHT', True)
+        return True
+
+    def _build_config(self, tools, temperature, top_p, top_k, seed, max_tokens, response_schema=None):
+        """Build the generation config shared by blocking and streaming calls"""
+        from google.genai.types import GenerateContentConfig, SafetySetting, ThinkingConfig
+        
+        # A response schema constrains the output to JSON matching it
+        structured = {}
+        if response_schema is not None:
+            structured = {
+                "response_mime_type": "application/json",
+                "response_schema": response_schema,
+            }
+        return GenerateContentConfig(
+            **structured,
+            tools=tools,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            seed=seed,
+            max_output_tokens=max_tokens,
+            response_modalities=["TEXT"],  # Ensure text response
+            safety_settings=[
+                SafetySetting(
+                    category="HARM_CATEGORY_HATE_SPEECH",
+                    threshold="OFF"
+                ),
+                SafetySetting(
+                    category="HARM_CATEGORY_DANGEROUS_CONTENT",
+                    threshold="OFF"
+                ),
+                SafetySetting(
+                    category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                    threshold="OFF"
+                ),
+                SafetySetting(
+                    category="HARM_CATEGORY_HARASSMENT",
+                    threshold="OFF"
+                )
+            ],
+            thinking_config=ThinkingConfig(
+                thinking_budget=-1,
+            ),
+        )
+
+    def _extract_grounding(self, candidate, result):
+        """Copy search suggestions and grounding sources from a candidate into result"""
+        if hasattr(candidate, 'grounding_metadata') and candidate.grounding_metadata:
+            metadata = candidate.grounding_metadata
             
-        self.client = genai.Client(http_options=HttpOptions(api_version="v1"))
-        logger.info(f"Google AI client initialized with model: {self.model_name}")
+            # Extract search entry point (Google Search Suggestions)
+            if hasattr(metadata, 'search_entry_point') and metadata.search_entry_point:
+                result["rendered_content"] = metadata.search_entry_point.rendered_content
+                logger.info("Google Search Suggestions extracted")
+            
+            # Extract grounding sources
+            if hasattr(metadata, 'grounding_chunks') and metadata.grounding_chunks:
+                for chunk in metadata.grounding_chunks:
+                    if hasattr(chunk, 'web') and chunk.web and hasattr(chunk.web, 'uri'):
+                        source = {
+                            "uri": chunk.web.uri,
+                            "title": chunk.web.title if hasattr(chunk.web, 'title') else "Source"
+                        }
+                        result["sources"].append(source)
+                
+                logger.info(f"Extracted {len(result['sources'])} grounding sources")
+
+    def _generation_config(self, top_p, top_k, temperature, max_output_tokens, with_search, response_schema=None):
+        """Generation config for generate() and generate_stream(), with defaults from the app config"""
+        from google.genai.types import GoogleSearch, Tool
+        tools = []
+        
+        # Get config settings from app config or use defaults
+        top_k = top_k or current_app.config.get('LLM_TOP_K', 20)
+        temperature = temperature or current_app.config.get('LLM_TEMPERATURE', 1.0)
+        top_p = top_p or current_app.config.get('LLM_TOP_P', 0.95)
+        seed = current_app.config.get('LLM_SEED', 0)
+        max_tokens = max_output_tokens or current_app.config.get('LLM_MAX_OUTPUT_TOKENS', 65535)
+        
+        # Add Google Search tool if requested
+        if with_search:
+            tools.append(Tool(google_search=GoogleSearch()))
+            logger.info("Google Search tool enabled for grounding")
+        
+        return self._build_config(tools, temperature, top_p, top_k, seed, max_tokens, response_schema)
+
+    def _result(self, response):
+        """Result dictionary of a finished generation: text plus grounding"""
+        result = {
+            "text": response.text.strip(),
+            "sources": [],
+            "rendered_content": None
+        }
+        
+        # Extract grounding metadata if available
+        self._extract_grounding(response.candidates[0], result)
+        return result
 
     def generate(self, template,
                  top_p=None,
@@ -29,7 +427,10 @@ class Google:
                  temperature=None,
                  system_instructions=None,
                  max_output_tokens=None,
-                 with_search=True) -> dict:
+                 with_search=True,
+                 endpoint='default',
+                 response_schema=None,
+                 request_class=None) -> dict:
         """
         Generate content using Google Gemini model with Google Search grounding.
         
@@ -39,90 +440,187 @@ class Google:
         - search_suggestions: Google Search suggestions (if available)
         """
         try:
-            tools = []
-            
-            # Get config settings from app config or use defaults
-            top_k = top_k or current_app.config.get('LLM_TOP_K', 20)
-            temperature = temperature or current_app.config.get('LLM_TEMPERATURE', 1.0)
-            top_p = top_p or current_app.config.get('LLM_TOP_P', 0.95)
-            seed = current_app.config.get('LLM_SEED', 0)
-            max_tokens = max_output_tokens or current_app.config.get('LLM_MAX_OUTPUT_TOKENS', 65535)
-            
-            # Add Google Search tool if requested
-            if with_search:
-                tools.append(Tool(google_search=GoogleSearch()))
-                logger.info("Google Search tool enabled for grounding")
-            
             # --- Model Invocation using genai ---
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=template,
-                config=GenerateContentConfig(
-                    tools=tools,
-                    temperature=temperature,
-                    top_p=top_p,
-                    top_k=top_k,
-                    seed=seed,
-                    max_output_tokens=max_tokens,
-                    response_modalities=["TEXT"],  # Ensure text response
-                    safety_settings=[
-                        SafetySetting(
-                            category="HARM_CATEGORY_HATE_SPEECH",
-                            threshold="OFF"
-                        ),
-                        SafetySetting(
-                            category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                            threshold="OFF"
-                        ),
-                        SafetySetting(
-                            category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                            threshold="OFF"
-                        ),
-                        SafetySetting(
-                            category="HARM_CATEGORY_HARASSMENT",
-                            threshold="OFF"
-                        )
-                    ],
-                    thinking_config=ThinkingConfig(
-                        thinking_budget=-1,
-                    ),
-                ),
+            response = self.generate_content(
+                template,
+                config=self._generation_config(top_p, top_k, temperature, max_output_tokens, with_search, response_schema),
+                endpoint=endpoint,
+                request_class=request_class,
             )
+            return self._result(response)
             
-            # Prepare result dictionary
-            result = {
-                "text": response.text.strip(),
-                "sources": [],
-                "rendered_content": None
-            }
-            
-            # Extract grounding metadata if available
-            if hasattr(response.candidates[0], 'grounding_metadata') and response.candidates[0].grounding_metadata:
-                metadata = response.candidates[0].grounding_metadata
-                
-                # Extract search entry point (Google Search Suggestions)
-                if hasattr(metadata, 'search_entry_point') and metadata.search_entry_point:
-                    result["rendered_content"] = metadata.search_entry_point.rendered_content
-                    logger.info("Google Search Suggestions extracted")
-                
-                # Extract grounding sources
-                if hasattr(metadata, 'grounding_chunks') and metadata.grounding_chunks:
-                    for chunk in metadata.grounding_chunks:
-                        if hasattr(chunk, 'web') and chunk.web and hasattr(chunk.web, 'uri'):
-                            source = {
-                                "uri": chunk.web.uri,
-                                "title": chunk.web.title if hasattr(chunk.web, 'title') else "Source"
-                            }
-                            result["sources"].append(source)
-                    
-                    logger.info(f"Extracted {len(result['sources'])} grounding sources")
-            
-            return result
-            
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Error generating content: {str(e)}")
             return {"text": f"Error generating response: {str(e)}", "sources": [], "search_suggestions": None}
+
+    async def agenerate(self, template,
+                        top_p=None,
+                        top_k=None,
+                        temperature=None,
+                        max_output_tokens=None,
+                        with_search=True,
+                        endpoint='default',
+                        response_schema=None,
+                        request_class=None) -> dict:
+        """Async counterpart of generate"""
+        try:
+            response = await self.agenerate_content(
+                template,
+                config=self._generation_config(top_p, top_k, temperature, max_output_tokens, with_search, response_schema),
+                endpoint=endpoint,
+                request_class=request_class,
+            )
+            return self._result(response)
             
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating content: {str(e)}")
+            return {"text": f"Error generating response: {str(e)}", "sources": [], "search_suggestions": None}
+
+    def generate_stream(self, template,
+                        top_p=None,
+                        top_k=None,
+                        temperature=None,
+                        max_output_tokens=None,
+                        with_search=True,
+                        endpoint='default',
+                        response_schema=None,
+                        request_class=None):
+        """
+        Stream content from the Google Gemini model as it is generated.
+
+        Generation starts (and LLMOverloadedError is raised) when this is called;
+        the returned generator yields dictionaries with a "type" key:
+        - text: {"type": "text", "text": <chunk>} for each text fragment
+        - sources: {"type": "sources", "sources": [...], "rendered_content": ...} once at the end
+        - error: {"type": "error", "error": <message>} if generation fails
+        """
+        stream = self.generate_content_stream(
+            template,
+            config=self._generation_config(top_p, top_k, temperature, max_output_tokens, with_search, response_schema),
+            endpoint=endpoint,
+            request_class=request_class,
+        )
+        return self._stream_chunks(stream)
+
+    async def agenerate_stream(self, template,
+                               top_p=None,
+                               top_k=None,
+                               temperature=None,
+                               max_output_tokens=None,
+                               with_search=True,
+                               endpoint='default',
+                               response_schema=None,
+                               request_class=None):
+        """
+        Async counterpart of generate_stream
+        
+        Generation starts (and LLMOverloadedError is raised) when this is
+        awaited; the returned async generator yields the same dictionaries.
+        """
+        stream = await self.agenerate_content_stream(
+            template,
+            config=self._generation_config(top_p, top_k, temperature, max_output_tokens, with_search, response_schema),
+            endpoint=endpoint,
+            request_class=request_class,
+        )
+        return self._astream_chunks(stream)
+
+    def _sources_chunk(self, grounded_candidate, chunk_count, model_name):
+        """Final "sources" chunk of a stream"""
+        result = {"sources": [], "rendered_content": None}
+        if grounded_candidate is not None:
+            self._extract_grounding(grounded_candidate, result)
+        
+        logger.info(f"Streamed {chunk_count} chunks from {model_name}")
+        return {"type": "sources", **result}
+
+    def _stream_chunks(self, stream):
+        """Translate raw response chunks into generate_stream dictionaries"""
+        try:
+            # Grounding metadata is only complete on the final chunks, so keep the
+            # last candidate that carried it and emit the sources after the text
+            grounded_candidate = None
+            chunk_count = 0
+            for chunk in stream:
+                if chunk.candidates and getattr(chunk.candidates[0], 'grounding_metadata', None):
+                    grounded_candidate = chunk.candidates[0]
+                if chunk.text:
+                    chunk_count += 1
+                    yield {"type": "text", "text": chunk.text}
+
+            yield self._sources_chunk(grounded_candidate, chunk_count, self.model_name)
+
+        except Exception as e:
+            logger.error(f"Error streaming content: {str(e)}")
+            yield {"type": "error", "error": f"Error generating response: {str(e)}"}
+        finally:
+            # Stop the generation if the client went away mid-stream
+            stream.close()
+
+    async def _astream_chunks(self, stream):
+        """Async counterpart of _stream_chunks"""
+        model_name = self.model_name
+        try:
+            grounded_candidate = None
+            chunk_count = 0
+            async for chunk in stream:
+                if chunk.candidates and getattr(chunk.candidates[0], 'grounding_metadata', None):
+                    grounded_candidate = chunk.candidates[0]
+                if chunk.text:
+                    chunk_count += 1
+                    yield {"type": "text", "text": chunk.text}
+
+            yield self._sources_chunk(grounded_candidate, chunk_count, model_name)
+
+        except Exception as e:
+            logger.error(f"Error streaming content: {str(e)}")
+            yield {"type": "error", "error": f"Error generating response: {str(e)}"}
+        finally:
+            await stream.aclose()
+
+    def _url_context_request(self, template, urls, top_p, top_k, temperature, max_output_tokens):
+        """Contents and config of a generation grounded on URL context and Google Search"""
+        from google.genai.types import GoogleSearch, Tool, UrlContext
+        
+        # Configure tools with Google Search and URL context
+        tools = [Tool(google_search=GoogleSearch()), Tool(url_context=UrlContext())]
+        
+        # Get config settings from app config or use defaults
+        top_k = top_k or current_app.config.get('LLM_TOP_K', 20)
+        temperature = temperature or current_app.config.get('LLM_TEMPERATURE', 1.0)
+        top_p = top_p or current_app.config.get('LLM_TOP_P', 0.95)
+        seed = current_app.config.get('LLM_SEED', 0)
+        max_tokens = max_output_tokens or current_app.config.get('LLM_MAX_OUTPUT_TOKENS', 65535)
+        
+        # The URL context tool fetches the URLs referenced in the prompt
+        contents = template
+        if urls and len(urls) > 0:
+            url_context = "Here are some relevant URLs to consider:\n"
+            for url in urls:
+                url_context += f"- {url}\n"
+            contents = [template, url_context]
+            logger.info(f"Using {len(urls)} URLs as context")
+        
+        return contents, self._build_config(tools, temperature, top_p, top_k, seed, max_tokens)
+
+    def _url_context_result(self, response, urls):
+        """Result dictionary of a URL context generation"""
+        # Prepare result with URL context and search results
+        result = {
+            "text": response.text.strip(),
+            "sources": [],
+            "context_urls": urls,
+            "search_suggestions": None
+        }
+        
+        # Extract search metadata if available
+        self._extract_grounding(response.candidates[0], result)
+        return result
+
     def generate_with_url_context(self, template, urls, 
                                  top_p=None,
                                  top_k=None,
@@ -138,103 +636,41 @@ class Google:
         Returns a dictionary with response text and sources
         """
         try:
-            # Configure tools with Google Search
-            tools = [Tool(google_search=GoogleSearch())]
-            
-            # Get config settings from app config or use defaults
-            top_k = top_k or current_app.config.get('LLM_TOP_K', 20)
-            temperature = temperature or current_app.config.get('LLM_TEMPERATURE', 1.0)
-            top_p = top_p or current_app.config.get('LLM_TOP_P', 0.95)
-            seed = current_app.config.get('LLM_SEED', 0)
-            max_tokens = max_output_tokens or current_app.config.get('LLM_MAX_OUTPUT_TOKENS', 65535)
-            
-            # Prepare the content with URL context
-            content_parts = []
-            
-            # Add the user's prompt as the main content
-            content_parts.append(template)
-            
-            # Add URL context as a separate part
-            if urls and len(urls) > 0:
-                url_context = "Here are some relevant URLs to consider:\n"
-                for url in urls:
-                    url_context += f"- {url}\n"
-                
-                # We don't add this directly as we'll use the official URL context approach
-                logger.info(f"Using {len(urls)} URLs as context")
+            contents, config = self._url_context_request(template, urls, top_p, top_k, temperature, max_output_tokens)
             
             # Generate content with Google Search
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=template,
-                config=GenerateContentConfig(
-                    tools=tools,
-                    temperature=temperature,
-                    top_p=top_p,
-                    top_k=top_k,
-                    seed=seed,
-                    max_output_tokens=max_tokens,
-                    response_modalities=["TEXT"],
-                    safety_settings=[
-                        SafetySetting(
-                            category="HARM_CATEGORY_HATE_SPEECH",
-                            threshold="OFF"
-                        ),
-                        SafetySetting(
-                            category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                            threshold="OFF"
-                        ),
-                        SafetySetting(
-                            category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                            threshold="OFF"
-                        ),
-                        SafetySetting(
-                            category="HARM_CATEGORY_HARASSMENT",
-                            threshold="OFF"
-                        )
-                    ],
-                    thinking_config=ThinkingConfig(
-                        thinking_budget=-1,
-                    ),
-                ),
-                # When using URL context with Gemini 2.0, these go in the request
-                # rather than as part of config
-                url_context=urls if urls and len(urls) > 0 else None,
-            )
+            response = self.generate_content(contents, config=config, endpoint='url_context')
+            return self._url_context_result(response, urls)
             
-            # Prepare result with URL context and search results
-            result = {
-                "text": response.text.strip(),
-                "sources": [],
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating content with URL context: {str(e)}")
+            return {
+                "text": f"Error generating response: {str(e)}", 
+                "sources": [], 
                 "context_urls": urls,
                 "search_suggestions": None
             }
+
+    async def agenerate_with_url_context(self, template, urls,
+                                         top_p=None,
+                                         top_k=None,
+                                         temperature=None,
+                                         max_output_tokens=None) -> dict:
+        """Async counterpart of generate_with_url_context"""
+        try:
+            contents, config = self._url_context_request(template, urls, top_p, top_k, temperature, max_output_tokens)
+            response = await self.agenerate_content(contents, config=config, endpoint='url_context')
+            return self._url_context_result(response, urls)
             
-            # Extract search metadata if available
-            if hasattr(response.candidates[0], 'grounding_metadata') and response.candidates[0].grounding_metadata:
-                metadata = response.candidates[0].grounding_metadata
-                
-                # Extract search entry point
-                if hasattr(metadata, 'search_entry_point') and metadata.search_entry_point:
-                    result["rendered_content"] = metadata.search_entry_point.rendered_content
-                
-                # Extract grounding sources
-                if hasattr(metadata, 'grounding_chunks') and metadata.grounding_chunks:
-                    for chunk in metadata.grounding_chunks:
-                        if hasattr(chunk, 'web') and chunk.web and hasattr(chunk.web, 'uri'):
-                            source = {
-                                "uri": chunk.web.uri,
-                                "title": chunk.web.title if hasattr(chunk.web, 'title') else "Source"
-                            }
-                            result["sources"].append(source)
-            
-            return result
-            
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Error generating content with URL context: {str(e)}")
             return {
-                "text": f"Error generating response: {str(e)}", 
-                "sources": [], 
+                "text": f"Error generating response: {str(e)}",
+                "sources": [],
                 "context_urls": urls,
                 "search_suggestions": None
-            } 
\ No newline at end of file
+            }
@@ -0,0 +1,55 @@
+import logging
+import os
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Process-wide genai clients keyed by (model, api_version)
+_clients = {}
+_lock = threading.Lock()
+_vertex_initialized = False
+
+def get_client(model_name, api_version="v1"):
+    """
+    Return the shared genai client for a model and API version, creating it on first use
+
+    Clients (and their HTTP connection pools) are reused for the lifetime of the
+    worker process, so TLS handshakes only happen on the first call per worker.
+    The SDKs themselves are imported here, as importing them takes seconds and
+    would otherwise slow down every worker start.
+    """
+    global _vertex_initialized
+    key = (model_name, api_version)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from google import genai
+            from google.genai.types import HttpOptions
+            
+            if not _vertex_initialized:
+                # Initialize the Vertex AI SDK once per process
+                from google.cloud import aiplatform
+                aiplatform.init()
+                _vertex_initialized = True
+
+            client = genai.Client(http_options=HttpOptions(api_version=api_version))
+            _clients[key] = client
+            logger.info(f"Google AI client created for model {model_name} (api {api_version}) in process {os.getpid()}")
+        return client
+
+def clear_clients():
+    """Forget all cached clients so the next call creates fresh ones"""
+    global _vertex_initialized, _lock
+    _clients.clear()
+    _vertex_initialized = False
+    _lock = threading.Lock()
+
+# Connection pools must not be shared between uWSGI workers, so a forked child
+# drops any client the master created and builds its own on first use
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=clear_clients)
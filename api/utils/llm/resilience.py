@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import random
+import sys
+import time
+from flask import current_app, g, has_app_context
+from api.utils.llm.executor import LLMUnavailableError
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class LLMDeadlineExceeded(LLMUnavailableError):
+    """Raised when an LLM call does not finish before its request deadline"""
+    status_code = 504
+
+attempts = metrics.counter(
+    'llm_attempts_total',
+    'LLM call attempts by outcome (success, retried, error, deadline)',
+    ('endpoint', 'outcome')
+)
+
+hedges = metrics.counter(
+    'llm_hedged_requests_total',
+    'Hedge requests fired after the latency percentile, by which request won',
+    ('endpoint', 'winner')
+)
+
+# Settings used for any key the app config does not override
+DEFAULT_POLICY = {
+    'deadline': 90.0,  # Seconds from the start of the HTTP request, below uWSGI's harakiri
+    'max_retries': 2,
+    'backoff': 0.5,  # Base delay of the exponential backoff, in seconds
+    'max_backoff': 8.0,
+    'hedge': False,
+    'hedge_percentile': 90,
+    'hedge_min_delay': 1.0,
+}
+
+# Rate limiting, timeouts and server errors are worth another attempt; other client errors are not
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+_EMPTY = object()
+
+class RequestPolicy:
+    """Deadline, retry and hedging settings for one endpoint"""
+    def __init__(self, deadline, max_retries, backoff, max_backoff, hedge, hedge_percentile, hedge_min_delay):
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+
+def get_policy(endpoint, request_class=None):
+    """
+    Resolve the request policy for an endpoint from LLM_REQUEST_POLICIES
+
+    Settings are layered: DEFAULT_POLICY, then the 'default' entry, then the
+    endpoint's entry, then the "endpoint:request_class" entry.
+    """
+    policies = current_app.config.get('LLM_REQUEST_POLICIES', {}) if has_app_context() else {}
+    settings = dict(DEFAULT_POLICY)
+    settings.update(policies.get('default', {}))
+    settings.update(policies.get(endpoint, {}))
+    if request_class:
+        settings.update(policies.get(f"{endpoint}:{request_class}", {}))
+    return RequestPolicy(**settings)
+
+def request_deadline(policy):
+    """Absolute deadline (time.monotonic) for a call, counted from the start of the current request"""
+    started = time.monotonic()
+    if has_app_context():
+        started = g.get('request_started', started)
+    return started + policy.deadline
+
+def hedge_delay(policy, percentile):
+    """Seconds to wait before hedging, or None when hedging is off or there is no latency history yet"""
+    if not policy.hedge or percentile is None:
+        return None
+    return max(policy.hedge_min_delay, percentile)
+
+def is_transient(error):
+    """Whether a failed attempt is worth retrying"""
+    # The SDK and httpx are imported lazily; an error can only be one of theirs once they are loaded
+    httpx = sys.modules.get('httpx')
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    errors = sys.modules.get('google.genai.errors')
+    if errors is not None and isinstance(error, errors.APIError):
+        return error.code in TRANSIENT_STATUS_CODES
+    return False
+
+def backoff_delay(policy, attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(policy.max_backoff, policy.backoff * 2 ** attempt))
+
+def _deadline_exceeded(endpoint, policy):
+    attempts.inc(endpoint=endpoint, outcome='deadline')
+    logger.error(f"LLM call for {endpoint} exceeded its {policy.deadline:g}s deadline")
+    return LLMDeadlineExceeded(f"The model did not respond within {policy.deadline:g} seconds, please retry")
+
+async def _aclose(iterator):
+    aclose = getattr(iterator, 'aclose', None)
+    if aclose is not None:
+        await aclose()
+
+async def _race(start, hedge_after, endpoint, discard=None):
+    """
+    Await start(); if it has not finished after hedge_after seconds, start a
+    second identical attempt and return whichever succeeds first
+
+    Args:
+        start: Zero-argument coroutine function making one attempt
+        hedge_after: Seconds before hedging, or None to never hedge
+        endpoint: Endpoint name used in logs and metrics
+        discard: Optional callable releasing the result of an attempt that lost the race
+    """
+    primary = asyncio.ensure_future(start())
+    if hedge_after is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    logger.info(f"No response for {endpoint} after {hedge_after:.1f}s, sending a hedge request")
+    hedge = asyncio.ensure_future(start())
+    names = {primary: 'primary', hedge: 'hedge'}
+    pending = set(names)
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.exception() is None), None)
+            if winner is not None:
+                hedges.inc(endpoint=endpoint, winner=names[winner])
+                for task in done:
+                    if task is not winner and task.exception() is None and discard:
+                        discard(task.result())
+                return winner.result()
+            error = next(iter(done)).exception()
+        raise error
+    finally:
+        for task in names:
+            if not task.done():
+                task.cancel()
+
+async def _with_retries(attempt, policy, endpoint, deadline):
+    """Run attempt() until it succeeds, fails permanently, runs out of retries or hits the deadline"""
+    retry = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise _deadline_exceeded(endpoint, policy)
+        try:
+            result = await asyncio.wait_for(attempt(), remaining)
+            attempts.inc(endpoint=endpoint, outcome='success')
+            return result
+        except asyncio.TimeoutError:
+            raise _deadline_exceeded(endpoint, policy)
+        except Exception as e:
+            delay = backoff_delay(policy, retry)
+            if not is_transient(e) or retry >= policy.max_retries or delay >= deadline - time.monotonic():
+                attempts.inc(endpoint=endpoint, outcome='error')
+                raise
+            attempts.inc(endpoint=endpoint, outcome='retried')
+            logger.warning(f"Transient LLM error for {endpoint} ({str(e)}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            retry += 1
+
+async def call_with_policy(start, policy, endpoint, deadline, hedge_after=None):
+    """
+    Run a blocking LLM call with the endpoint's deadline, retries and hedging
+
+    Args:
+        start: Zero-argument coroutine function making one attempt
+        policy: RequestPolicy for the endpoint
+        endpoint: Endpoint name used in logs and metrics
+        deadline: Absolute deadline from request_deadline()
+        hedge_after: Seconds before a hedge request is sent, or None
+
+    Returns:
+        The result of the first successful attempt
+    """
+    return await _with_retries(lambda: _race(start, hedge_after, endpoint), policy, endpoint, deadline)
+
+async def stream_with_policy(start, policy, endpoint, deadline, hedge_after=None):
+    """
+    Async generator running a streaming LLM call with the endpoint's deadline, retries and hedging
+
+    Retries and hedging only apply until the first chunk arrives: a hedge is
+    sent when no chunk has arrived after hedge_after seconds, and the stream
+    that produces a chunk first is kept. The deadline applies to the whole stream.
+    """
+    async def first_chunk():
+        iterator = await start()
+        try:
+            return iterator, await iterator.__anext__()
+        except StopAsyncIteration:
+            return iterator, _EMPTY
+
+    def discard(result):
+        asyncio.ensure_future(_aclose(result[0]))
+
+    iterator, first = await _with_retries(
+        lambda: _race(first_chunk, hedge_after, endpoint, discard), policy, endpoint, deadline
+    )
+    try:
+        if first is _EMPTY:
+            return
+        yield first
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise _deadline_exceeded(endpoint, policy)
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise _deadline_exceeded(endpoint, policy)
+            yield chunk
+    finally:
+        await _aclose(iterator)
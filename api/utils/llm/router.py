@@ -0,0 +1,149 @@
+import collections
+import logging
+import threading
+import time
+from flask import current_app, has_app_context
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+route_decisions = metrics.counter(
+    'llm_route_decisions_total',
+    'LLM routing decisions by endpoint, chosen tier and reason',
+    ('endpoint', 'tier', 'reason')
+)
+
+# Used when the app config does not define tiers or routes
+DEFAULT_TIERS = {
+    'pro': {'model': 'gemini-2.5-pro', 'thinking_budget': -1, 'max_in_flight': 4, 'fallback': 'fast'},
+    'fast': {'model': 'gemini-2.5-flash', 'thinking_budget': 0, 'max_in_flight': 8, 'fallback': None},
+}
+DEFAULT_ROUTES = {
+    'default': {'tier': 'pro', 'slo_p95': 60.0},
+}
+
+# Number of recent calls per tier used for the latency percentiles
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# Seconds a call counts towards the percentiles; a tier downgraded for its latency gets no new samples,
+# so once its slow calls have aged out it is below MIN_SAMPLES and preferred again
+LATENCY_MAX_AGE = 300
+
+class RouteDecision:
+    """Model and thinking budget chosen for one LLM call"""
+    def __init__(self, endpoint, tier, model, thinking_budget, reason):
+        self.endpoint = endpoint
+        self.tier = tier
+        self.model = model
+        self.thinking_budget = thinking_budget
+        self.reason = reason
+
+class ModelRouter:
+    """
+    Pick a model tier and thinking budget per endpoint and request class.
+
+    Each route names a preferred tier, a p95 latency SLO and optionally a
+    thinking_budget that caps the tier's. When the tier's
+    recent p95 latency exceeds the route's SLO, or the tier already has
+    max_in_flight calls running, the route is downgraded to the tier's
+    fallback (repeatedly, until a healthy tier or the end of the chain).
+    Latencies older than LATENCY_MAX_AGE are ignored, so a downgraded tier
+    is tried again once its slow calls have aged out.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self._ttfts = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self._in_flight = collections.defaultdict(int)
+
+    def _config(self):
+        if has_app_context():
+            return (current_app.config.get('LLM_TIERS', DEFAULT_TIERS),
+                    current_app.config.get('LLM_ROUTES', DEFAULT_ROUTES))
+        return DEFAULT_TIERS, DEFAULT_ROUTES
+
+    def _route_for(self, routes, endpoint, request_class):
+        if request_class and f"{endpoint}:{request_class}" in routes:
+            return routes[f"{endpoint}:{request_class}"]
+        return routes.get(endpoint) or routes.get('default') or DEFAULT_ROUTES['default']
+
+    def percentile(self, tier, pct, kind='latency'):
+        """
+        Percentile (seconds) of a tier's recent calls, or None without enough samples
+
+        kind is 'latency' for the full call duration or 'ttft' for the time to
+        the first streamed chunk.
+        """
+        windows = self._ttfts if kind == 'ttft' else self._latencies
+        oldest = time.monotonic() - LATENCY_MAX_AGE
+        with self._lock:
+            window = windows[tier]
+            while window and window[0][0] < oldest:
+                window.popleft()
+            samples = sorted(latency for _, latency in window)
+        if len(samples) < MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def in_flight(self, tier):
+        with self._lock:
+            return self._in_flight[tier]
+
+    def select(self, endpoint, request_class=None):
+        """Choose the tier for a call to an endpoint"""
+        tiers, routes = self._config()
+        route = self._route_for(routes, endpoint, request_class)
+        slo = route.get('slo_p95')
+        tier_name = route.get('tier', 'pro')
+        reason = 'preferred'
+        visited = set()
+
+        while tier_name in tiers and tier_name not in visited:
+            visited.add(tier_name)
+            tier = tiers[tier_name]
+            p95 = self.percentile(tier_name, 95)
+            in_flight = self.in_flight(tier_name)
+            overloaded = None
+            if slo is not None and p95 is not None and p95 > slo:
+                overloaded = f"p95 {p95:.1f}s over SLO {slo:.1f}s"
+            elif tier.get('max_in_flight') is not None and in_flight >= tier['max_in_flight']:
+                overloaded = f"{in_flight} calls in flight"
+
+            fallback = tier.get('fallback')
+            if overloaded is None or not fallback or fallback not in tiers:
+                break
+            logger.warning(f"Downgrading {endpoint} from tier {tier_name} to {fallback}: {overloaded}")
+            tier_name = fallback
+            reason = 'downgraded'
+
+        tier = tiers.get(tier_name) or DEFAULT_TIERS['pro']
+        thinking_budget = tier.get('thinking_budget', -1)
+        # A route's thinking_budget caps the tier's, e.g. so thinking cannot use up a short output budget
+        cap = route.get('thinking_budget')
+        if cap is not None and (thinking_budget < 0 or thinking_budget > cap):
+            thinking_budget = cap
+        decision = RouteDecision(endpoint, tier_name, tier['model'], thinking_budget, reason)
+        route_decisions.inc(endpoint=endpoint, tier=tier_name, reason=reason)
+        logger.info(f"LLM route for {endpoint}{':' + request_class if request_class else ''}: "
+                    f"tier={tier_name} model={decision.model} thinking_budget={decision.thinking_budget} ({reason})")
+        return decision
+
+    def begin(self, decision):
+        """Mark a call on the decision's tier as started"""
+        with self._lock:
+            self._in_flight[decision.tier] += 1
+
+    def end(self, decision, latency=None, ttft=None):
+        """Mark a call as finished and record its latency and time to first chunk (seconds) if known"""
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight[decision.tier] -= 1
+            if latency is not None:
+                self._latencies[decision.tier].append((now, latency))
+            if ttft is not None:
+                self._ttfts[decision.tier].append((now, ttft))
+
+# Process-wide router shared by all Google instances
+router = ModelRouter()
@@ -0,0 +1,196 @@
+import logging
+import threading
+from api.utils import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+coalesced_requests = metrics.counter(
+    'llm_singleflight_requests_total',
+    'LLM requests by single-flight role (leader ran the generation, follower attached to it)',
+    ('kind', 'role')
+)
+
+_END = object()
+
+class _Call:
+    """A blocking call in flight; followers wait on the event for its outcome"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class _SharedStream:
+    """
+    Fan one source iterator out to any number of subscribers.
+
+    Items are buffered so late subscribers replay the stream from the start.
+    There is no pump thread: whichever subscriber needs the next item pulls it
+    from the source, so the stream keeps going if the original caller leaves.
+    """
+    def __init__(self, source, on_done):
+        self._source = source
+        self._on_done = on_done
+        self._cond = threading.Condition()
+        self._items = []
+        self._done = False
+        self._error = None
+        self._pulling = False
+        self._subscribers = 0
+
+    def _finish(self, error=None):
+        # Called with the condition held; returns True the first time the stream ends
+        self._cond.notify_all()
+        if self._done:
+            return False
+        self._done = True
+        self._error = error
+        return True
+
+    def _item(self, index):
+        while True:
+            with self._cond:
+                if index < len(self._items):
+                    return self._items[index]
+                if self._done:
+                    return _END
+                if self._pulling:
+                    self._cond.wait()
+                    continue
+                self._pulling = True
+
+            error = None
+            try:
+                item = next(self._source)
+            except StopIteration:
+                item = _END
+            except Exception as e:
+                item = _END
+                error = e
+
+            finished = False
+            with self._cond:
+                self._pulling = False
+                if item is _END:
+                    finished = self._finish(error)
+                else:
+                    self._items.append(item)
+                    self._cond.notify_all()
+            if finished:
+                self._on_done()
+
+    def subscribe(self):
+        with self._cond:
+            self._subscribers += 1
+        return _Subscription(self)
+
+    def _unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+            abandoned = self._subscribers == 0 and self._finish()
+        if abandoned:
+            self._on_done()
+            # Nobody is listening any more, stop the generation
+            if hasattr(self._source, 'close'):
+                self._source.close()
+
+class _Subscription:
+    """
+    One subscriber's iterator over a shared stream.
+
+    Running out, closing it or dropping it unsubscribes, so a subscription
+    that is never iterated does not keep the stream alive.
+    """
+    def __init__(self, shared):
+        self._shared = shared
+        self._index = 0
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        item = self._shared._item(self._index)
+        if item is _END:
+            self.close()
+            if self._shared._error is not None:
+                raise self._shared._error
+            raise StopIteration
+        self._index += 1
+        return item
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._shared._unsubscribe()
+
+    def __del__(self):
+        self.close()
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent requests so only one generation runs per key.
+
+    Callers that arrive while a request with the same key is outstanding attach
+    to it and receive its result (or a replay of its stream) instead of
+    starting their own.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+
+    def do(self, key, fn):
+        """Run fn() once per key among concurrent callers and share its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            coalesced_requests.inc(kind='call', role='follower')
+            logger.info(f"Attached to in-flight LLM request {key[:12]}")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        coalesced_requests.inc(kind='call', role='leader')
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stream(self, key, fn):
+        """
+        Start fn() once per key among concurrent callers and share its stream
+
+        Returns an iterator over the stream's items from the beginning.
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is not None:
+                coalesced_requests.inc(kind='stream', role='follower')
+                logger.info(f"Attached to in-flight LLM stream {key[:12]}")
+                return shared.subscribe()
+
+            # Starting the source may raise (e.g. LLMOverloadedError); nothing is registered then
+            source = fn()
+            shared = _SharedStream(iter(source), lambda: self._forget_stream(key, shared))
+            self._streams[key] = shared
+            coalesced_requests.inc(kind='stream', role='leader')
+            return shared.subscribe()
+
+    def _forget_stream(self, key, shared):
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
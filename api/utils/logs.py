@@ -0,0 +1,272 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from api.utils import metrics
+from api.utils.timing import request_spans
+
+try:
+    import fcntl
+except ImportError:  # Windows: rollover is not coordinated between processes
+    fcntl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+dropped_records = metrics.counter(
+    'log_records_dropped_total',
+    'Log records dropped because the log queue was full'
+)
+
+# Client-supplied X-Request-ID values accepted as the request id; others are replaced by a generated id
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,128}')
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] [%(request_id)s] %(message)s'
+
+# Paths that are probes for common vulnerabilities rather than app routes
+SUSPICIOUS_PATTERNS = ('.php', 'wp-', 'admin', 'shell', '.git', 'cgi-bin', 'wp-content')
+
+# Attributes every LogRecord has; anything else was passed with extra= and goes into the JSON record
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName', 'request_id'}
+
+_exception_formatter = logging.Formatter()
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including fields passed with extra="""
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """
+    Size-rotated log file shared by several worker processes
+
+    Rollover happens under an exclusive lock file, and a process that finds
+    the file was rotated by another one reopens it instead of rotating again
+    or writing on into the renamed file.
+    """
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.lock_path = self.baseFilename + '.lock'
+        self._inode = None
+
+    def _open(self):
+        stream = super()._open()
+        self._inode = os.fstat(stream.fileno()).st_ino
+        return stream
+
+    def _rotated_elsewhere(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != self._inode
+        except FileNotFoundError:
+            return True
+
+    def shouldRollover(self, record):
+        if self.stream is not None and self._rotated_elsewhere():
+            self.stream.close()
+            self.stream = self._open()
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        if fcntl is None:
+            super().doRollover()
+            return
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self._rotated_elsewhere():
+                    # Another process rotated the file while this one waited for the lock
+                    if self.stream is not None:
+                        self.stream.close()
+                    self.stream = self._open()
+                else:
+                    super().doRollover()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+class _RequestContextFilter(logging.Filter):
+    """Tags records with the request id and drops the info records of unsampled requests"""
+    def filter(self, record):
+        if not has_request_context():
+            record.request_id = '-'
+            return True
+        record.request_id = g.get('request_id', '-')
+        return record.levelno >= logging.WARNING or g.get('log_sampled', True)
+
+class _QueueHandler(QueueHandler):
+    """Hands records to the writer thread without blocking the logging thread"""
+    def prepare(self, record):
+        # Resolve the message and traceback now; the writer thread only formats
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        _ensure_writer()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc()
+
+_handler = None
+_listener = None
+_writer_pid = None
+_lock = threading.Lock()
+
+def configure_logging(app):
+    """
+    Route all logging through a queue written by one thread per process
+
+    The root logger gets a single QueueHandler; a QueueListener thread formats
+    the records (JSON or text, LOG_FORMAT) and writes them to the rotated
+    LOG_FILE and to stderr. Calling it again replaces the previous setup.
+    """
+    global _handler, _listener, _writer_pid
+    config = app.config
+    formatter = JSONFormatter() if config.get('LOG_FORMAT', 'json') == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    if config.get('LOG_FILE'):
+        os.makedirs(os.path.dirname(config['LOG_FILE']), exist_ok=True)
+        handlers.append(SharedRotatingFileHandler(
+            config['LOG_FILE'], config.get('LOG_MAX_BYTES', 50 * 1024 * 1024), config.get('LOG_BACKUP_COUNT', 10)
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    with _lock:
+        root = logging.getLogger()
+        if _handler is not None:
+            root.removeHandler(_handler)
+            _stop_listener()
+        _handler = _QueueHandler(queue.Queue(config.get('LOG_QUEUE_SIZE', 10000)))
+        _handler.addFilter(_RequestContextFilter())
+        _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _writer_pid = os.getpid()
+        root.addHandler(_handler)
+        root.setLevel(config.get('LOG_LEVEL', 'INFO'))
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def _sample_rate(path, sample_rates):
+    """Sampling rate of the longest LOG_SAMPLE_RATES prefix of path, 1.0 if none matches"""
+    matches = [prefix for prefix in sample_rates if path.startswith(prefix)]
+    return sample_rates[max(matches, key=len)] if matches else 1.0
+
+def init_logging(app):
+    """
+    Configure logging and log one structured line per request
+
+    Each request gets an id (the client's X-Request-ID if it only has letters,
+    digits, _ and -, or a new one), which is added to every record logged
+    while handling it and returned in the X-Request-ID response header. Requests under a LOG_SAMPLE_RATES prefix
+    keep their info records at the configured rate; warnings, errors and
+    failed responses are always logged.
+    """
+    configure_logging(app)
+    sample_rates = app.config.get('LOG_SAMPLE_RATES', {})
+
+    @app.before_request
+    def start_request_log():
+        request_id = request.headers.get('X-Request-ID', '')
+        # The id ends up in log lines and profile filenames, so only accept plain tokens
+        g.request_id = request_id if REQUEST_ID_PATTERN.fullmatch(request_id) else uuid.uuid4().hex
+        g.log_sample_rate = _sample_rate(request.path, sample_rates)
+        g.log_sampled = random.random() < g.log_sample_rate
+
+        if any(pattern in request.path for pattern in SUSPICIOUS_PATTERNS):
+            logger.warning(f"Suspicious request pattern detected: {request.method} {request.path} from {request.remote_addr}")
+
+    @app.after_request
+    def log_request(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        path = request.path
+        if path.startswith('/static/') or path == '/health':
+            return response
+        if response.status_code >= 400:
+            g.log_sampled = True
+
+        started = g.get('request_started')
+        duration_ms = round((time.monotonic() - started) * 1000, 1) if started is not None else None
+        logger.info(f"{request.method} {path} {response.status_code} in {duration_ms}ms", extra={
+            'method': request.method,
+            'path': path,
+            'status': response.status_code,
+            'duration_ms': duration_ms,
+            'bytes': response.content_length,
+            'client_ip': request.remote_addr,
+            'user_agent': request.headers.get('User-Agent', 'Unknown'),
+            'sample_rate': g.get('log_sample_rate', 1.0),
+            'spans_ms': request_spans(),
+        })
+        return response
+
+def _ensure_writer():
+    """
+    Start this process's writer thread if it was forked from the one that configured logging
+
+    The writer thread does not survive fork, and the queue's lock may have been
+    held by it. uWSGI forks its workers without running os.register_at_fork
+    handlers, so the first record logged in a worker starts the thread.
+    """
+    global _listener, _writer_pid
+    if _writer_pid == os.getpid():
+        return
+    with _lock:
+        if _writer_pid == os.getpid() or _listener is None:
+            return
+        _handler.queue = queue.Queue(_handler.queue.maxsize)
+        _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+        _writer_pid = os.getpid()
+
+@atexit.register
+def _flush_at_exit():
+    with _lock:
+        # A process that never started its own writer has nothing queued to flush
+        if _writer_pid == os.getpid():
+            _stop_listener()
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _ensure_writer()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
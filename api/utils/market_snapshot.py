@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+HISTORIES_FILE = 'histories.npz'
+QUOTES_FILE = 'quotes.json'
+
+# OHLC columns stored in the prices array, in order
+PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close')
+
+def history_key(symbol, period, interval):
+    return f"{symbol}|{period}|{interval}"
+
+class MarketSnapshot:
+    """
+    Read-only market data loaded once and shared by all worker processes
+
+    Histories are kept as a handful of contiguous NumPy arrays (timestamps,
+    prices, volumes and per-history offsets into them) instead of one
+    DataFrame per symbol, and quotes as one JSON string per symbol. Loaded in
+    the uWSGI master before it forks, the arrays are shared copy-on-write:
+    workers only read them, and there are too few Python objects for
+    reference counting to copy many pages.
+    """
+    def __init__(self, arrays, quotes, max_age):
+        self.keys = {str(key): index for index, key in enumerate(arrays['keys'])}
+        self.timezones = [str(tz) for tz in arrays['timezones']]
+        self.offsets = arrays['offsets']
+        self.fetched = arrays['fetched']
+        self.timestamps = arrays['timestamps']
+        self.prices = arrays['prices']
+        self.volumes = arrays['volumes']
+        for array in (self.offsets, self.fetched, self.timestamps, self.prices, self.volumes):
+            array.flags.writeable = False
+        self.quotes = quotes
+        self.max_age = max_age
+
+    @classmethod
+    def load(cls, directory, max_age):
+        """
+        Load the snapshot written by write_snapshot()
+
+        Returns:
+            MarketSnapshot, or None if directory holds no snapshot
+        """
+        import numpy as np
+
+        histories_path = os.path.join(directory, HISTORIES_FILE)
+        quotes_path = os.path.join(directory, QUOTES_FILE)
+        if not os.path.exists(histories_path) and not os.path.exists(quotes_path):
+            return None
+
+        arrays = {
+            'keys': np.array([], dtype=str), 'timezones': np.array([], dtype=str),
+            'offsets': np.zeros(1, dtype=np.int64), 'fetched': np.array([], dtype=np.float64),
+            'timestamps': np.array([], dtype=np.int64), 'prices': np.empty((0, len(PRICE_COLUMNS))),
+            'volumes': np.array([], dtype=np.int64),
+        }
+        if os.path.exists(histories_path):
+            with np.load(histories_path, allow_pickle=False) as data:
+                arrays.update({name: data[name] for name in data.files})
+
+        quotes = {}
+        if os.path.exists(quotes_path):
+            with open(quotes_path, encoding='utf-8') as f:
+                for symbol, entry in json.load(f).items():
+                    # Kept serialized: one string per symbol instead of a dictionary tree of small objects
+                    quotes[symbol] = (entry['fetched'], json.dumps(entry['info']))
+        return cls(arrays, quotes, max_age)
+
+    def _fresh(self, fetched, max_age=None):
+        return time.time() - fetched < (self.max_age if max_age is None else max_age)
+
+    def history(self, symbol, period, interval):
+        """
+        History as an OHLCV DataFrame like Ticker.history() returns, or None if not in the snapshot or too old
+
+        The DataFrame wraps read-only views of the shared arrays.
+        """
+        index = self.keys.get(history_key(symbol, period, interval))
+        if index is None or not self._fresh(self.fetched[index]):
+            return None
+
+        import pandas as pd
+
+        start, end = self.offsets[index], self.offsets[index + 1]
+        dates = pd.DatetimeIndex(pd.to_datetime(self.timestamps[start:end], utc=True), name='Date')
+        if self.timezones[index]:
+            dates = dates.tz_convert(self.timezones[index])
+        frame = pd.DataFrame(self.prices[start:end], index=dates, columns=list(PRICE_COLUMNS), copy=False)
+        frame['Volume'] = self.volumes[start:end]
+        return frame
+
+    def quote(self, symbol, max_age=None):
+        """
+        Ticker info dictionary, or None if not in the snapshot or too old
+
+        Args:
+            symbol: Ticker symbol
+            max_age: Maximum age in seconds, instead of the snapshot's max_age
+        """
+        entry = self.quotes.get(symbol)
+        if entry is None or not self._fresh(entry[0], max_age):
+            return None
+        return json.loads(entry[1])
+
+def write_snapshot(directory, histories, quotes):
+    """
+    Write histories and quotes to directory, replacing the previous snapshot
+
+    Args:
+        directory: Snapshot directory (MARKET_SNAPSHOT_DIRECTORY)
+        histories: {(symbol, period, interval): (fetched, DataFrame)} dictionary
+        quotes: {symbol: (fetched, info)} dictionary
+
+    Returns:
+        (histories, quotes) written; empty histories are left out
+    """
+    import numpy as np
+
+    os.makedirs(directory, exist_ok=True)
+    keys, timezones, fetched, offsets = [], [], [], [0]
+    timestamps, prices, volumes = [], [], []
+    for (symbol, period, interval), (fetched_at, frame) in histories.items():
+        if frame is None or frame.empty:
+            continue
+        dates = frame.index
+        keys.append(history_key(symbol, period, interval))
+        timezones.append(str(dates.tz) if dates.tz is not None else '')
+        fetched.append(fetched_at)
+        timestamps.append(dates.asi8)  # Nanoseconds since the epoch in UTC, also for localized indexes
+        prices.append(frame[list(PRICE_COLUMNS)].to_numpy(dtype=np.float64))
+        volumes.append(frame['Volume'].to_numpy(dtype=np.int64) if 'Volume' in frame.columns
+                       else np.zeros(len(frame), dtype=np.int64))
+        offsets.append(offsets[-1] + len(frame))
+
+    path = os.path.join(directory, HISTORIES_FILE)
+    # np.savez appends .npz to names without it
+    partial = path + '.tmp.npz'
+    np.savez(
+        partial,
+        keys=np.array(keys, dtype=str),
+        timezones=np.array(timezones, dtype=str),
+        fetched=np.array(fetched, dtype=np.float64),
+        offsets=np.array(offsets, dtype=np.int64),
+        timestamps=np.concatenate(timestamps) if timestamps else np.array([], dtype=np.int64),
+        prices=np.concatenate(prices) if prices else np.empty((0, len(PRICE_COLUMNS))),
+        volumes=np.concatenate(volumes) if volumes else np.array([], dtype=np.int64),
+    )
+    os.replace(partial, path)
+
+    path = os.path.join(directory, QUOTES_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({symbol: {'fetched': fetched_at, 'info': info} for symbol, (fetched_at, info) in quotes.items()},
+                  f, default=str)
+    os.replace(path + '.tmp', path)
+    logger.info(f"Wrote market data snapshot with {len(keys)} histories and {len(quotes)} quotes to {directory}")
+    return len(keys), len(quotes)
+
+_snapshot = None
+
+def get_snapshot():
+    """The snapshot loaded by warm_up(), or None"""
+    return _snapshot
+
+def warm_up(app):
+    """
+    Load the market data snapshot into this process
+
+    Called while the app is created, which under uWSGI (without lazy-apps)
+    happens in the master, so the forked workers share the loaded arrays and
+    the already imported NumPy and pandas. Nothing is downloaded here; the
+    snapshot is written by the market-snapshot command.
+    """
+    global _snapshot
+    config = app.config
+    started = time.monotonic()
+    try:
+        snapshot = MarketSnapshot.load(config['MARKET_SNAPSHOT_DIRECTORY'], config.get('MARKET_SNAPSHOT_MAX_AGE', 86400))
+    except Exception as e:
+        logger.error(f"Error loading market data snapshot: {str(e)}")
+        return
+    if snapshot is None:
+        logger.info(f"No market data snapshot in {config['MARKET_SNAPSHOT_DIRECTORY']}, skipping warm-up")
+        return
+
+    # Imported by the first snapshot hit anyway; importing it before fork shares it too
+    import pandas  # noqa: F401
+
+    _snapshot = snapshot
+    logger.info(f"Loaded market data snapshot with {len(snapshot.keys)} histories and {len(snapshot.quotes)} quotes "
+                f"in {time.monotonic() - started:.2f}s")
+
+def refresh(app, manager):
+    """
+    Download the hot symbols' histories and quotes and write them as the snapshot
+
+    Symbols that fail to download are logged and keep their entries from the
+    previous snapshot, so an outage does not empty it.
+
+    Returns:
+        (histories, quotes) written
+    """
+    config = app.config
+    directory = config['MARKET_SNAPSHOT_DIRECTORY']
+    previous = MarketSnapshot.load(directory, float('inf'))
+    histories = {}
+    quotes = {}
+    for symbol in config['MARKET_HOT_SYMBOLS']:
+        for period, interval in config['MARKET_HOT_HISTORIES']:
+            try:
+                hist = manager.download_history(symbol, period, interval)
+                if hist is None or hist.empty:
+                    raise ValueError("no data returned")
+                histories[(symbol, period, interval)] = (time.time(), hist)
+            except Exception as e:
+                logger.error(f"Error downloading {period}/{interval} history of {symbol} for the snapshot: {str(e)}")
+                index = previous.keys.get(history_key(symbol, period, interval)) if previous is not None else None
+                if index is not None:
+                    histories[(symbol, period, interval)] = (float(previous.fetched[index]), previous.history(symbol, period, interval))
+        try:
+            quotes[symbol] = (time.time(), manager.download_info(symbol))
+        except Exception as e:
+            logger.error(f"Error downloading quote of {symbol} for the snapshot: {str(e)}")
+            if previous is not None and symbol in previous.quotes:
+                quotes[symbol] = (previous.quotes[symbol][0], previous.quote(symbol))
+    return write_snapshot(directory, histories, quotes)
@@ -0,0 +1,390 @@
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: exited processes are not archived
+    fcntl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class _Metric:
+    """Base class for a named metric with optional labels"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for name, value in pairs:
+            value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{name}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+
+    def snapshot(self):
+        """Current values as JSON-serialisable [labels, value] pairs"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, values):
+        """Add values from a snapshot of another process"""
+        with self._lock:
+            for key, value in values:
+                self._merge_value(tuple(key), value)
+
+    def _merge_value(self, key, value):
+        self._values[key] = self._values.get(key, 0) + value
+
+    def describe(self):
+        """Arguments needed to recreate this metric in another registry"""
+        return {'kind': self.kind, 'documentation': self.documentation, 'labelnames': list(self.labelnames)}
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in self._values.items()]
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down
+
+    multiprocess_mode sets how the values of worker processes are combined:
+    'sum' for per-process quantities, 'max' for values every process measures
+    alike (such as the size of a shared directory).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess_mode='sum'):
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _merge_value(self, key, value):
+        if self.multiprocess_mode == 'max' and key in self._values:
+            self._values[key] = max(self._values[key], value)
+        else:
+            super()._merge_value(key, value)
+
+    def describe(self):
+        return {**super().describe(), 'multiprocess_mode': self.multiprocess_mode}
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in self._values.items()]
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            entry['counts'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, entry in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), entry['counts']):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    samples.append((f"{self.name}_bucket", key, ('le', le), cumulative))
+                samples.append((f"{self.name}_sum", key, None, entry['sum']))
+                samples.append((f"{self.name}_count", key, None, entry['count']))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), {'counts': list(entry['counts']), 'sum': entry['sum'], 'count': entry['count']}]
+                    for key, entry in self._values.items()]
+
+    def _merge_value(self, key, value):
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+        entry['counts'] = [a + b for a, b in zip(entry['counts'], value['counts'])]
+        entry['sum'] += value['sum']
+        entry['count'] += value['count']
+
+    def describe(self):
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+class MetricsRegistry:
+    """Process-local collection of metrics rendered in the Prometheus text format"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), multiprocess_mode='sum'):
+        return self._get_or_create(Gauge, name, documentation, labelnames, multiprocess_mode=multiprocess_mode)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        """Definitions and values of all metrics as a JSON-serialisable dictionary"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {**metric.describe(), 'values': metric.snapshot()} for metric in metrics}
+
+    def merge(self, snapshot, gauges=True):
+        """Add a snapshot taken by snapshot(), creating the metrics it defines"""
+        for name, entry in snapshot.items():
+            if entry['kind'] == 'gauge' and not gauges:
+                continue
+            if entry['kind'] == 'counter':
+                metric = self.counter(name, entry['documentation'], entry['labelnames'])
+            elif entry['kind'] == 'gauge':
+                metric = self.gauge(name, entry['documentation'], entry['labelnames'], entry.get('multiprocess_mode', 'sum'))
+            else:
+                metric = self.histogram(name, entry['documentation'], entry['labelnames'], entry['buckets'])
+                if list(metric.buckets) != entry['buckets']:
+                    # Recorded by an older version with other buckets
+                    continue
+            metric.merge(entry['values'])
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in sorted(metrics, key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, key, extra, value in metric.samples():
+                lines.append(f"{sample_name}{metric._format_labels(key, extra)} {value}")
+        return '\n'.join(lines) + '\n'
+
+class SnapshotStore:
+    """
+    Shares a registry between worker processes through per-process snapshot files
+
+    Each process writes its registry to <directory>/metrics_<pid>.json from a
+    background thread every interval seconds and when it is scraped, so
+    recording a metric stays an in-memory update. render() merges the
+    snapshots of all processes: counters and histograms are summed, gauges
+    combined by their multiprocess_mode. Snapshots of exited processes are
+    folded into an archive, so their counts survive worker restarts (their
+    gauges are dropped).
+    """
+    def __init__(self, directory, registry, interval=5.0):
+        self.pid = None
+        self.directory = directory
+        self.registry = registry
+        self.interval = interval
+        self.archive_path = os.path.join(directory, 'archive.json')
+        self.lock_path = os.path.join(directory, 'archive.lock')
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"metrics_{pid}.json")
+
+    def start(self):
+        self.pid = os.getpid()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-snapshot', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logger.error(f"Error writing metrics snapshot: {str(e)}")
+
+    def write(self):
+        """Write this process's snapshot, replacing the previous one atomically"""
+        path = self._path(os.getpid())
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _snapshot_files(self):
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                files[int(os.path.basename(path)[len('metrics_'):-len('.json')])] = path
+            except ValueError:
+                continue
+        return files
+
+    def _archive_exited(self, files):
+        """Fold the snapshots of exited processes into the archive and remove them"""
+        exited = {pid: path for pid, path in files.items() if pid != os.getpid() and not _alive(pid)}
+        if not exited or fcntl is None:
+            return
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                archive = MetricsRegistry()
+                archive.merge(self._load(self.archive_path) or {})
+                for pid, path in exited.items():
+                    snapshot = self._load(path)
+                    if snapshot is None:
+                        continue  # Archived by another process meanwhile
+                    archive.merge(snapshot, gauges=False)
+                    os.remove(path)
+                with open(self.archive_path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(archive.snapshot(), f)
+                os.replace(self.archive_path + '.tmp', self.archive_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            for pid in exited:
+                files.pop(pid, None)
+
+    def render(self):
+        """Render the metrics of all processes in the Prometheus text format"""
+        self.write()
+        files = self._snapshot_files()
+        self._archive_exited(files)
+        merged = MetricsRegistry()
+        for path in [self.archive_path] + list(files.values()):
+            snapshot = self._load(path)
+            if snapshot is not None:
+                merged.merge(snapshot)
+        return merged.render()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Default process-wide registry
+REGISTRY = MetricsRegistry()
+
+# Set by configure_multiprocess
+_store = None
+
+def counter(name, documentation, labelnames=()):
+    """Get or create a counter in the default registry"""
+    return REGISTRY.counter(name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=(), multiprocess_mode='sum'):
+    """Get or create a gauge in the default registry"""
+    return REGISTRY.gauge(name, documentation, labelnames, multiprocess_mode)
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Get or create a histogram in the default registry"""
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+def configure_multiprocess(directory, interval=5.0):
+    """Aggregate the default registry across the processes sharing directory"""
+    global _store
+    if _store is not None:
+        return
+    _store = SnapshotStore(directory, REGISTRY, interval)
+    _store.start()
+    atexit.register(_write_at_exit)
+
+def render():
+    """Render the default registry, merged across processes when configured"""
+    if _store is None:
+        return REGISTRY.render()
+    check_process()
+    return _store.render()
+
+def check_process():
+    """
+    Start counting for this process if it was forked from the one that configured the store
+
+    Values recorded before the fork are in the parent's snapshot; the child
+    counts from zero under its own pid and needs its own writer thread (with
+    fresh locks, since another thread may have held one at the fork). uWSGI
+    forks its workers without running os.register_at_fork handlers, so this is
+    also called at the start of every request.
+    """
+    if _store is None or _store.pid == os.getpid():
+        return
+    REGISTRY._lock = threading.Lock()
+    for metric in REGISTRY._metrics.values():
+        metric._lock = threading.Lock()
+        metric._values = {}
+    _store.start()
+
+def _write_at_exit():
+    if _store.pid != os.getpid():
+        return
+    try:
+        _store.write()
+    except OSError:
+        pass
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=check_process)
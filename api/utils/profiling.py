@@ -0,0 +1,61 @@
+import collections
+import os
+import sys
+import threading
+
+class SamplingProfiler:
+    """
+    Statistical profiler for one thread
+
+    A background thread records the stack of the profiled thread every
+    interval seconds. The samples are written in the folded-stack format
+    ("frame;frame;frame count" per line) read by flamegraph.pl and speedscope.
+    Under ASGI the profiled thread is the event loop, so the samples include
+    other requests running on the same loop.
+    """
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling the given thread, or the calling thread"""
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def write(self, path):
+        """
+        Write the samples in the folded-stack format
+
+        Returns:
+            The path written
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
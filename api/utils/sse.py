@@ -0,0 +1,127 @@
+import json
+import logging
+from flask import Response, stream_with_context
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def sse_event(data, event=None):
+    """
+    Format a single Server-Sent Event
+
+    Args:
+        data: JSON-serializable payload for the event
+        event: Optional event name (defaults to the browser's "message" event)
+
+    Returns:
+        The event encoded as an SSE frame
+    """
+    frame = ""
+    if event:
+        frame += f"event: {event}\n"
+    frame += f"data: {json.dumps(data)}\n\n"
+    return frame
+
+# Headers of every event stream; X-Accel-Buffering stops nginx from buffering it
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+STREAM_OPENED = ": stream opened\n\n"
+
+def sse_frames(events):
+    """
+    Encode a generator of (event, data) tuples as SSE frames
+
+    An opening comment is sent first so the client gets its first byte before
+    the model produces any tokens, and a final "done" event marks the end of
+    the stream. An exception from the generator becomes an "error" event.
+    """
+    yield STREAM_OPENED
+    try:
+        for event, data in events:
+            yield sse_event(data, event)
+    except Exception as e:
+        logger.error(f"Error while streaming events: {str(e)}")
+        yield sse_event({"error": str(e)}, "error")
+    yield sse_event({}, "done")
+
+async def asse_frames(events):
+    """Async counterpart of sse_frames for an async iterator of (event, data) tuples"""
+    yield STREAM_OPENED
+    try:
+        async for event, data in events:
+            yield sse_event(data, event)
+    except Exception as e:
+        logger.error(f"Error while streaming events: {str(e)}")
+        yield sse_event({"error": str(e)}, "error")
+    yield sse_event({}, "done")
+
+def sse_response(events):
+    """Wrap a generator of (event, data) tuples in a streaming text/event-stream response (see sse_frames)"""
+    return Response(
+        stream_with_context(sse_frames(events)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
+def _llm_event(chunk):
+    """(event, data) tuple for one Google.generate_stream chunk, or None for unknown chunk types"""
+    if chunk["type"] == "text":
+        return "token", {"text": chunk["text"]}
+    if chunk["type"] == "progress":
+        return "progress", {"characters": chunk["characters"]}
+    if chunk["type"] == "report":
+        return "report", {"message": chunk["html"], "report": chunk["report"]}
+    if chunk["type"] == "sources":
+        return "sources", {
+            "sources": chunk.get("sources", []),
+            "search_suggestions": chunk.get("rendered_content") or ""
+        }
+    if chunk["type"] == "error":
+        return "error", {"error": chunk["error"]}
+    return None
+
+def llm_stream_events(chunks):
+    """
+    Translate Google.generate_stream chunks into (event, data) tuples
+
+    Text fragments become "token" events and the grounding information is sent
+    as a final "sources" event. Rendered reports arrive as "report" events,
+    preceded by "progress" events while their values are generated.
+    """
+    for chunk in chunks:
+        event = _llm_event(chunk)
+        if event is not None:
+            yield event
+
+async def allm_stream_events(chunks):
+    """Async counterpart of llm_stream_events"""
+    async for chunk in chunks:
+        event = _llm_event(chunk)
+        if event is not None:
+            yield event
+
+def chunk_events(chunks, translator):
+    """
+    Translate generate_stream chunks into (event, data) tuples with a stateful translator
+
+    The translator's feed(chunk) and finish() return lists of events; once its
+    "failed" attribute is set the stream ends without calling finish().
+    """
+    for chunk in chunks:
+        yield from translator.feed(chunk)
+        if translator.failed:
+            return
+    yield from translator.finish()
+
+async def achunk_events(chunks, translator):
+    """Async counterpart of chunk_events"""
+    async for chunk in chunks:
+        for event in translator.feed(chunk):
+            yield event
+        if translator.failed:
+            return
+    for event in translator.finish():
+        yield event
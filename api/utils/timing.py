@@ -0,0 +1,125 @@
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from api.utils import metrics
+from api.utils.profiling import SamplingProfiler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+request_duration = metrics.histogram(
+    'http_request_duration_seconds',
+    'Time until the response of a request is ready, by route',
+    ('route', 'method', 'status')
+)
+
+span_duration = metrics.histogram(
+    'http_request_span_seconds',
+    'Time spent in an instrumented step while handling a request, by route',
+    ('route', 'span')
+)
+
+# Characters kept in profile filenames; anything else could leave PROFILE_DIRECTORY
+_UNSAFE_FILENAME_CHARACTERS = re.compile(r'[^A-Za-z0-9_-]')
+
+@contextmanager
+def span(name):
+    """
+    Time a step of the current request under name
+
+    Durations of spans with the same name add up. Outside a request, or in a
+    worker thread without the request context, the step is not timed.
+    """
+    if not has_request_context():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - started)
+
+def add_span(name, seconds):
+    """Add a duration measured by the caller to the current request's span name"""
+    if not has_request_context():
+        return
+    spans = g.setdefault('timing_spans', {})
+    total, count = spans.get(name, (0.0, 0))
+    spans[name] = (total + seconds, count + 1)
+
+def request_spans():
+    """Span durations of the current request in milliseconds"""
+    return {name: round(total * 1000, 1) for name, (total, _) in g.get('timing_spans', {}).items()}
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _server_timing(spans, total):
+    entries = [f"{name};dur={duration * 1000:.1f}" + (f";desc=\"x{count}\"" if count > 1 else '')
+               for name, (duration, count) in spans.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+def _profile_requested(config):
+    token = config.get('PROFILE_TOKEN')
+    if token and request.headers.get('X-Profile') == token:
+        return True
+    rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+def init_timing(app):
+    """
+    Time requests by route and instrumented step, and profile them on demand
+
+    Every request is observed in per-route histograms of its total duration and
+    of each span() it went through; with SERVER_TIMING_ENABLED the spans are
+    also returned in a Server-Timing header. A request is profiled by the
+    sampling profiler when it sends an X-Profile header equal to PROFILE_TOKEN,
+    or at random for PROFILE_SAMPLE_RATE of requests; the profile is written to
+    PROFILE_DIRECTORY.
+    """
+    config = app.config
+
+    @app.before_request
+    def start_request_timing():
+        g.timing_started = time.perf_counter()
+        if _profile_requested(config):
+            g.profiler = SamplingProfiler(config.get('PROFILE_INTERVAL', 0.005))
+            g.profiler.start()
+
+    @app.after_request
+    def finish_request_timing(response):
+        if 'timing_started' not in g:
+            return response
+        total = time.perf_counter() - g.timing_started
+        route = _route()
+        spans = g.get('timing_spans', {})
+        request_duration.observe(total, route=route, method=request.method, status=str(response.status_code))
+        for name, (duration, _) in spans.items():
+            span_duration.observe(duration, route=route, span=name)
+        if config.get('SERVER_TIMING_ENABLED', True):
+            response.headers['Server-Timing'] = _server_timing(spans, total)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            label = f"{route.strip('/').replace('/', '_') or 'index'}_{g.get('request_id', os.getpid())}"
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}_{_UNSAFE_FILENAME_CHARACTERS.sub('_', label)}.folded"
+            try:
+                path = profiler.write(os.path.join(config.get('PROFILE_DIRECTORY', 'profiles'), name))
+                response.headers['X-Profile'] = os.path.basename(path)
+                logger.info(f"Wrote profile of {request.method} {request.path} ({profiler.sample_count} samples) to {path}")
+            except OSError as e:
+                logger.error(f"Error writing profile: {str(e)}")
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # after_request does not run when the request fails before a response exists
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
@@ -0,0 +1,66 @@
+import functools
+import inspect
+import logging
+import traceback
+from flask import jsonify, request
+from api.utils.llm.executor import LLMUnavailableError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class InvalidRequest(ValueError):
+    """Raised while reading a request that lacks a parameter or has an invalid one; answered with 400"""
+
+def error_response(e, description, envelope=False):
+    """
+    Response for an exception raised by an API view
+
+    Args:
+        e: The exception, handled inside its except block
+        description: What the view serves, for the log (e.g. "inference endpoint")
+        envelope: Add "success": false to the body, as the technical analysis API does
+
+    Returns:
+        (response, status) tuple: 400 for an InvalidRequest, otherwise 500
+        with the traceback logged
+    """
+    client_ip = request.remote_addr
+    body = {'success': False} if envelope else {}
+    body['error'] = str(e)
+    if isinstance(e, InvalidRequest):
+        logger.warning(f"Invalid request to {description} from {client_ip}: {str(e)}")
+        return jsonify(body), 400
+    logger.error(f"Error in {description} for {client_ip}: {str(e)}")
+    logger.error(traceback.format_exc())
+    return jsonify(body), 500
+
+def api_errors(description, envelope=False):
+    """
+    Map the exceptions of an API view to responses with error_response()
+
+    Works on views and on their async variants served by the ASGI entry
+    point, so both share one error mapping. LLMUnavailableError is left to
+    the app's error handler (503/504). Apply it below the route decorator.
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await view(*args, **kwargs)
+                except LLMUnavailableError:
+                    raise
+                except Exception as e:
+                    return error_response(e, description, envelope)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                return view(*args, **kwargs)
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                return error_response(e, description, envelope)
+        return wrapper
+    return decorator
@@ -1,14 +1,44 @@
-import yfinance as yf
-import pandas as pd
-import numpy as np
 import logging
 import time
 import threading
 from flask import current_app, has_app_context
+from api.utils.timing import span, add_span
+from api.utils import metrics
+from api.utils.market_snapshot import get_snapshot
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+cache_lookups = metrics.counter(
+    'yahoo_cache_lookups_total',
+    'YahooFinanceManager cache lookups by data kind (history, info) and result (hit, snapshot, miss)',
+    ('kind', 'result')
+)
+
+upstream_requests = metrics.counter(
+    'yahoo_upstream_requests_total',
+    'Yahoo Finance downloads by data kind and result (ok, error)',
+    ('kind', 'result')
+)
+
+upstream_duration = metrics.histogram(
+    'yahoo_upstream_seconds',
+    'Duration of successful Yahoo Finance downloads',
+    ('kind',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+throttle_wait = metrics.histogram(
+    'yahoo_throttle_wait_seconds',
+    'Time a download waited for the Yahoo Finance session lock and rate-limit interval',
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.2, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+ticker_retries = metrics.counter(
+    'yahoo_ticker_retries_total',
+    'Retried Yahoo Finance ticker creations'
+)
+
 class YahooFinanceManager:
     """
     Manager for Yahoo Finance API calls with rate limiting, caching, and error handling
@@ -47,6 +77,7 @@ class YahooFinanceManager:
     def session(self):
         with self.session_lock:
             if self._session is None:
+                import yfinance as yf
                 self._session = yf.Tickers("")
                 # Apply headers to the underlying requests session
                 for key, value in self.headers.items():
@@ -55,6 +86,9 @@ class YahooFinanceManager:
             return self._session
     
     def get_ticker(self, symbol):
+        # yfinance pulls in pandas and its HTTP stack; workers import it on the first lookup
+        import yfinance as yf
+        wait_started = time.monotonic()
         with self.session_lock:
             # Rate limiting
             current_time = time.time()
@@ -63,11 +97,15 @@ class YahooFinanceManager:
                 sleep_time = self.min_request_interval - time_since_last_request
                 logger.debug(f"Rate limiting: sleeping for {sleep_time:.2f}s")
                 time.sleep(sleep_time)
+            waited = time.monotonic() - wait_started
+            throttle_wait.observe(waited)
+            add_span('yf_throttle', waited)
             
             # Get or create ticker with retries
             for attempt in range(self.max_retries):
                 try:
                     if attempt > 0:
+                        ticker_retries.inc()
                         logger.info(f"Retry attempt {attempt} for {symbol}")
                         time.sleep(1)  # Add delay between retries
                     
@@ -94,8 +132,27 @@ class YahooFinanceManager:
                             logger.error(f"Final error creating ticker for {symbol}: {str(e2)}")
                             raise
 
+    def _fetch(self, kind, fetch):
+        """Run one Yahoo Finance download, counting and timing it"""
+        started = time.monotonic()
+        try:
+            with span('yf_fetch'):
+                data = fetch()
+        except Exception:
+            upstream_requests.inc(kind=kind, result='error')
+            raise
+        upstream_requests.inc(kind=kind, result='ok')
+        upstream_duration.observe(time.monotonic() - started, kind=kind)
+        return data
+
     def get_history(self, symbol, period='10y', interval='1mo'):
-        """Get historical data with caching"""
+        """
+        Get historical data with caching
+
+        Data downloaded by this worker is cached for cache_ttl seconds; hot
+        symbols are served from the shared market data snapshot when it is
+        fresh, so this cache only holds what the snapshot lacks.
+        """
         cache_key = f"{symbol}_{period}_{interval}"
         current_time = time.time()
         
@@ -103,12 +160,19 @@ class YahooFinanceManager:
         if cache_key in self.history_cache:
             cache_entry = self.history_cache[cache_key]
             if current_time - cache_entry['timestamp'] < self.cache_ttl:
-                logger.info(f"Using cached history data for {symbol}")
+                cache_lookups.inc(kind='history', result='hit')
+                logger.debug(f"Using cached history data for {symbol}")
                 return cache_entry['data']
         
+        snapshot = get_snapshot()
+        hist = snapshot.history(symbol, period, interval) if snapshot is not None else None
+        if hist is not None:
+            cache_lookups.inc(kind='history', result='snapshot')
+            return hist
+        
         # No valid cache, fetch from Yahoo Finance
-        ticker = self.get_ticker(symbol)
-        hist = ticker.history(period=period, interval=interval)
+        cache_lookups.inc(kind='history', result='miss')
+        hist = self.download_history(symbol, period, interval)
         
         # Cache the result
         self.history_cache[cache_key] = {
@@ -118,20 +182,46 @@ class YahooFinanceManager:
         
         return hist
     
+    def download_history(self, symbol, period='10y', interval='1mo'):
+        """Download historical data from Yahoo Finance, bypassing the caches"""
+        ticker = self.get_ticker(symbol)
+        return self._fetch('history', lambda: ticker.history(period=period, interval=interval))
+    
     def get_info(self, symbol):
-        """Get ticker info with caching"""
+        """
+        Get ticker info with caching
+
+        Quotes go stale quickly, so the market data snapshot only serves them
+        while they are younger than cache_ttl, like this worker's own cache.
+        Older snapshot quotes (up to MARKET_SNAPSHOT_MAX_AGE) are only used
+        when the download fails.
+        """
         current_time = time.time()
         
         # Check if we have cached data and it's still valid
         if symbol in self.info_cache:
             cache_entry = self.info_cache[symbol]
             if current_time - cache_entry['timestamp'] < self.cache_ttl:
-                logger.info(f"Using cached info data for {symbol}")
+                cache_lookups.inc(kind='info', result='hit')
+                logger.debug(f"Using cached info data for {symbol}")
                 return cache_entry['data']
         
+        snapshot = get_snapshot()
+        info = snapshot.quote(symbol, max_age=self.cache_ttl) if snapshot is not None else None
+        if info is not None:
+            cache_lookups.inc(kind='info', result='snapshot')
+            return info
+        
         # No valid cache, fetch from Yahoo Finance
-        ticker = self.get_ticker(symbol)
-        info = ticker.info
+        cache_lookups.inc(kind='info', result='miss')
+        try:
+            info = self.download_info(symbol)
+        except Exception as e:
+            info = snapshot.quote(symbol) if snapshot is not None else None
+            if info is None:
+                raise
+            logger.warning(f"Serving the market data snapshot's quote for {symbol} after a failed download: {str(e)}")
+            return info
         
         # Cache the result
         self.info_cache[symbol] = {
@@ -139,4 +229,9 @@ class YahooFinanceManager:
             'data': info
         }
         
-        return info 
\ No newline at end of file
+        return info 
+    
+    def download_info(self, symbol):
+        """Download ticker info from Yahoo Finance, bypassing the caches"""
+        ticker = self.get_ticker(symbol)
+        return self._fetch('info', lambda: ticker.info)
@@ -1,10 +1,18 @@
-from flask import Flask
+from flask import Flask, g
 from flask_cors import CORS
 import logging
 import os
+import time
 import datetime
-from config import get_config, LOG_FILENAME
+import gc
+from config import get_config
 from api.utils.helpers import CustomJSONEncoder
+from api.utils.logs import init_logging
+from api.utils.timing import init_timing
+from api.utils.admission import init_admission
+from api.utils.assets import init_assets
+from api.utils import metrics
+from api.utils import market_snapshot
 
 def create_app(config_name=None):
     """Create and configure the Flask application"""
@@ -14,15 +22,19 @@ def create_app(config_name=None):
     config = get_config()
     app.config.from_object(config)
     
-    # Configure logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] %(message)s',
-        handlers=[
-            logging.FileHandler(LOG_FILENAME),
-            logging.StreamHandler()
-        ]
-    )
+    # Configure logging (queued, one writer thread) and per-request access lines
+    init_logging(app)
+    
+    # Per-route timing histograms, Server-Timing headers and the opt-in profiler
+    init_timing(app)
+    
+    # Share metrics between worker processes so /metrics reports all of them
+    if app.config.get('METRICS_MULTIPROCESS', True):
+        metrics.configure_multiprocess(app.config['METRICS_DIRECTORY'], app.config.get('METRICS_FLUSH_INTERVAL', 5.0))
+        app.before_request(metrics.check_process)
+    
+    # Per-client rate limits and bounded, prioritized pools for the LLM and market data routes
+    init_admission(app)
     logger = logging.getLogger(__name__)
     
     # Enable CORS
@@ -42,6 +54,9 @@ def create_app(config_name=None):
     app.register_blueprint(yahoo_bp)
     app.register_blueprint(tech_analyze_bp)
     
+    # Fingerprinted, precompressed static assets and the asset_url() template helper
+    init_assets(app)
+    
     # Ensure the temp folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
@@ -50,9 +65,31 @@ def create_app(config_name=None):
     def inject_now():
         return {'now': datetime.datetime.now()}
     
+    # Record when each request started so LLM deadlines include the time already spent
+    @app.before_request
+    def mark_request_start():
+        g.request_started = time.monotonic()
+    
     # Initialize the app with config
     config.init_app(app)
     
+    # Load the hot market data; under uWSGI this runs in the master, so the workers share it
+    if app.config.get('MARKET_WARMUP', True):
+        market_snapshot.warm_up(app)
+    
+    @app.cli.command('market-snapshot')
+    def market_snapshot_command():
+        """Download the hot symbols into the market data snapshot."""
+        from api.portfolio.routes import yf_manager
+        histories, quotes = market_snapshot.refresh(app, yf_manager)
+        print(f"Wrote {histories} histories and {quotes} quotes to {app.config['MARKET_SNAPSHOT_DIRECTORY']}")
+        print("Running workers keep the snapshot they loaded at startup; restart or reload them to serve the new one")
+    
+    if app.config.get('GC_FREEZE', True):
+        # Everything allocated so far lives as long as the process; workers forked from here
+        # keep sharing those pages instead of copying them when the collector scans the objects
+        gc.freeze()
+    
     logger.info("Application initialized with all blueprints registered")
     
     return app
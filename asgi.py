@@ -0,0 +1,12 @@
+# ASGI entry point, alongside the WSGI app in app.py. The LLM, streaming and
+# market data routes are served by async handlers; every other route goes
+# through the Flask app unchanged.
+#
+#     uvicorn asgi:application --host 0.0.0.0 --port 3619 --workers 2
+from app import app
+from api.utils.asgi import ASGIApplication
+from api.routes import main_async
+from api.portfolio.routes import portfolio_async, yahoo_async
+from api.tech_analyze.routes import tech_analyze_async
+
+application = ASGIApplication(app, [main_async, portfolio_async, yahoo_async, tech_analyze_async])
@@ -0,0 +1,203 @@
+"""
+Load test LLM-bound endpoints under uWSGI (app.py) and under the ASGI entry
+point (asgi.py) with uvicorn.
+
+Both servers are started with the same number of worker processes: uWSGI
+with the classic 2 processes x 4 threads, uvicorn with 2 event-loop workers.
+Each scenario fires --requests requests with --concurrency in flight and
+reports throughput, latency percentiles and errors; streaming scenarios also
+report the time to the first event.
+
+Usage:
+    python benchmarks/asgi_load.py --simulate [--latency 2.0] [--concurrency 8 64 256] [--requests 512]
+
+--simulate swaps the genai clients in the servers for ones that sleep for
+--latency seconds (spread over the chunks when streaming), and raises the
+LLM executor limits so that the servers, not the simulated upstream quota, are
+what is measured. Without it the servers call the configured Gemini models.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Set in the server processes started by this script
+SIMULATED_LATENCY_ENV = 'BENCHMARK_SIMULATED_LATENCY'
+
+SIMULATED_CHUNKS = 10
+
+SCENARIOS = {
+    'infer': ('/infer', {'intent': 'generate', 'payload': {'prompt': 'Summarise the market in one line'}}),
+    'infer_stream': ('/infer/stream', {'intent': 'generate', 'payload': {'prompt': 'Summarise the market in one line'}}),
+}
+
+class SimulatedModels:
+    """Stands in for client.aio.models with a fixed latency instead of API calls"""
+    def __init__(self, latency):
+        self.latency = latency
+
+    def _chunk(self, text):
+        candidate = types.SimpleNamespace(grounding_metadata=None)
+        return types.SimpleNamespace(text=text, usage_metadata=None, candidates=[candidate])
+
+    async def generate_content(self, model, contents, config):
+        await asyncio.sleep(self.latency)
+        return self._chunk("Simulated response")
+
+    async def generate_content_stream(self, model, contents, config):
+        async def chunks():
+            for index in range(SIMULATED_CHUNKS):
+                await asyncio.sleep(self.latency / SIMULATED_CHUNKS)
+                yield self._chunk(f"token{index} ")
+        return chunks()
+
+def install_simulation(app, latency):
+    from api.utils.llm import registry
+    client = types.SimpleNamespace(aio=types.SimpleNamespace(models=SimulatedModels(latency)))
+    for tier in app.config['LLM_TIERS'].values():
+        registry._clients[(tier['model'], 'v1')] = client
+
+if os.environ.get(SIMULATED_LATENCY_ENV) is not None:
+    # Imported by a server worker started below
+    from app import app as wsgi_app
+    from asgi import application as asgi_app
+    if float(os.environ[SIMULATED_LATENCY_ENV]) > 0:
+        install_simulation(wsgi_app, float(os.environ[SIMULATED_LATENCY_ENV]))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(kind, port, latency, backlog):
+    env = {**os.environ, SIMULATED_LATENCY_ENV: str(latency), 'PYTHONPATH': ROOT}
+    if latency > 0:
+        # Let the servers hold as many LLM waits as they can
+        env.update(LLM_MAX_CONCURRENCY='100000', LLM_MAX_QUEUE='0', LLM_SINGLE_FLIGHT='False', ADMISSION_ENABLED='False')
+    if kind == 'wsgi':
+        command = ['uwsgi', '--http', f"127.0.0.1:{port}", '--module', 'benchmarks.asgi_load:wsgi_app',
+                   '--master', '--processes', '2', '--threads', '4', '--enable-threads', '--lazy-apps',
+                   '--listen', str(backlog), '--die-on-term', '--disable-logging', '--harakiri', '120']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'benchmarks.asgi_load:asgi_app', '--host', '127.0.0.1',
+                   '--port', str(port), '--workers', '2', '--backlog', str(backlog), '--log-level', 'warning',
+                   '--no-access-log']
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_until_ready(client, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get(url + '/metrics', timeout=2)
+            return
+        except Exception:
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not start")
+
+async def one_request(client, url, path, body, stream):
+    started = time.monotonic()
+    first_event = None
+    try:
+        if stream:
+            async with client.stream('POST', url + path, json=body) as response:
+                async for line in response.aiter_lines():
+                    if first_event is None and line.startswith('event:'):
+                        first_event = time.monotonic() - started
+                status = response.status_code
+        else:
+            response = await client.post(url + path, json=body)
+            status = response.status_code
+    except Exception as e:
+        status = type(e).__name__
+    return status, time.monotonic() - started, first_event
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 3)
+
+async def run_scenario(client, url, scenario, concurrency, requests):
+    path, body = SCENARIOS[scenario]
+    stream = scenario.endswith('_stream')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index):
+        async with semaphore:
+            # Distinct prompts, so nothing can be served from a shared generation
+            payload = {**body, 'payload': {**body['payload'], 'prompt': f"{body['payload']['prompt']} #{index}"}}
+            return await one_request(client, url, path, payload, stream)
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(limited(index) for index in range(requests)))
+    elapsed = time.monotonic() - started
+
+    latencies = [latency for status, latency, _ in results if status == 200]
+    first_events = [first for status, _, first in results if status == 200 and first is not None]
+    errors = {}
+    for status, _, _ in results:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    summary = {
+        'ok': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'mean': round(statistics.mean(latencies), 3) if latencies else None
+    }
+    if stream:
+        summary['first_event_p50'] = percentile(first_events, 50)
+        summary['first_event_p95'] = percentile(first_events, 95)
+    return summary
+
+async def benchmark(kind, args):
+    import httpx
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = start_server(kind, port, args.latency if args.simulate else 0, max(args.concurrency) * 2)
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+            await wait_until_ready(client, url)
+            results = {}
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    results[f"{scenario}@{concurrency}"] = await run_scenario(client, url, scenario, concurrency, args.requests)
+            return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--simulate', action='store_true', help='Use simulated model latency instead of the API')
+    parser.add_argument('--latency', type=float, default=2.0, help='Simulated seconds per generation')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64, 256])
+    parser.add_argument('--requests', type=int, default=512, help='Requests per scenario and concurrency level')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--servers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    parser.add_argument('--timeout', type=float, default=120.0, help='Client timeout per request in seconds')
+    args = parser.parse_args()
+
+    results = {
+        'simulated_latency': args.latency if args.simulate else None,
+        'requests': args.requests,
+    }
+    for kind in args.servers:
+        results[kind] = asyncio.run(benchmark(kind, args))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
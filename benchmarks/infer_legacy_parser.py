@@ -0,0 +1,130 @@
+"""
+Benchmark parsing of legacy /infer prompts: the regular expressions /infer
+used to locate the portfolio JSON vs the single-pass parser in api.utils.intents.
+
+Prompts are built the way the legacy client (static/js/script.js) builds them,
+for portfolios of increasing size. The "chat_no_sentiment" case is a chat
+prompt whose marketSentiment is null (no sentiment loaded yet), which the old
+pattern cannot match, so the portfolio was silently dropped.
+
+Usage:
+    python benchmarks/infer_legacy_parser.py [--sizes 10 100 500 1000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.utils.intents import parse_legacy_prompt
+
+# Patterns used before intent dispatch
+OLD_ANALYSIS = r'{\s*"assets":.+?news":\s*\[.+?\]\s*}'
+OLD_CHAT = r'{\s*"assets":.+?marketSentiment":\s*[\d\.]+\s*}'
+
+def make_portfolio(assets):
+    return {
+        'assets': [
+            {
+                'symbol': f"SYM{i}",
+                'name': f"Asset {i} Holdings",
+                'allocation': round(100 / assets, 4),
+                'avgReturn': 0.07 + i % 5 / 100,
+                'volatility': 0.2 + i % 7 / 100,
+                'fiveYearGrowth': 40.2,
+                'tenYearGrowth': 96.7
+            }
+            for i in range(assets)
+        ],
+        'initialInvestment': 10000,
+        'recurringAmount': 500,
+        'recurringFrequency': 'monthly',
+        'fiveYearValue': 52000,
+        'tenYearValue': 121000,
+        'portfolioSentiment': 0.62,
+        'news': [
+            {
+                'title': f"Asset {i} beats estimates [update {j}]",
+                'source': 'Newswire',
+                'date': '2025-05-01',
+                'url': f"https://example.com/news/{i}/{j}",
+                'summary': 'Quarterly results {beat} expectations; guidance raised.',
+                'sentiment': 0.7
+            }
+            for i in range(assets) for j in range(2)
+        ]
+    }
+
+def analysis_prompt(portfolio):
+    return f"""Please analyze this portfolio data and create a detailed but concise VISUAL report:
+{json.dumps(portfolio, indent=2)}
+
+Use this exact HTML template structure, filling in the appropriate values from the portfolio data:
+<div class="glass-card p-4">[GRADE]</div>"""
+
+def chat_prompt(portfolio, sentiment):
+    context = {
+        'assets': portfolio['assets'],
+        'initialInvestment': portfolio['initialInvestment'],
+        'projectedValue': {'fiveYear': portfolio['fiveYearValue'], 'tenYear': portfolio['tenYearValue']},
+        'marketSentiment': sentiment
+    }
+    return f"""You are a financial portfolio assistant analyzing this portfolio:
+{json.dumps(context, indent=2)}
+
+The user asks: Should I rebalance?
+
+Please provide a brief, helpful answer with financial insights related specifically to this portfolio."""
+
+def old_parse(prompt, pattern):
+    match = re.search(pattern, prompt, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        return json.loads(match.group(0))
+    except ValueError:
+        return {}
+
+def timed(function, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1000, 3), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 1000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        portfolio = make_portfolio(size)
+        cases = {
+            'analysis': (analysis_prompt(portfolio), OLD_ANALYSIS),
+            'chat': (chat_prompt(portfolio, 0.62), OLD_CHAT),
+            'chat_no_sentiment': (chat_prompt(portfolio, None), OLD_CHAT),
+        }
+        for case, (prompt, pattern) in cases.items():
+            old_ms, old_result = timed(lambda: old_parse(prompt, pattern), args.runs)
+            new_ms, (_, payload) = timed(lambda: parse_legacy_prompt(prompt), args.runs)
+            results.append({
+                'assets': size,
+                'case': case,
+                'prompt_chars': len(prompt),
+                'regex_ms': old_ms,
+                'regex_assets_parsed': len(old_result.get('assets', [])),
+                'parser_ms': new_ms,
+                'parser_assets_parsed': len(payload['portfolio'].get('assets', [])),
+            })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Measure how long the app takes to start and to serve its first requests.
+
+Three measurements, each in fresh processes:
+
+* import: runs `python -X importtime -c "import app"` and reports the total
+  import time, the self time per top-level package and the slowest modules
+  by cumulative time.
+* first requests: imports the app in a new interpreter and times the first
+  GET of --path and the first /infer request through the Flask test client.
+  The LLM client is simulated, so the /infer time is what the first call
+  pays for importing the SDK and building its config, not the model latency.
+* servers: starts uWSGI (app.py) and uvicorn (asgi.py) and times from
+  process start to the first successful response to --path.
+
+Usage:
+    python benchmarks/startup.py [--runs 3] [--top 15] [--path /] [--servers wsgi asgi]
+
+Results are medians over --runs and are printed as JSON.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def parse_importtime(output):
+    """
+    Parse -X importtime output
+
+    Returns:
+        List of (module, self_us, cumulative_us, depth) in import order
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+def measure_import(module, top):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - started
+    modules = parse_importtime(result.stderr)
+
+    by_package = {}
+    for name, self_us, _, _ in modules:
+        package = name.split('.')[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+    total = next(cumulative for name, _, cumulative, depth in modules if name == module and depth == 0)
+    return {
+        'total_ms': round(total / 1000, 1),
+        'wall_ms': round(wall * 1000, 1),
+        'by_package_ms': {package: round(us / 1000, 1) for package, us in
+                          sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]},
+        'slowest_ms': {name: round(cumulative / 1000, 1) for name, _, cumulative, _ in
+                       sorted(modules, key=lambda item: item[2], reverse=True)[:top]},
+    }
+
+def first_requests(path):
+    """Run in a fresh interpreter by measure_first_requests()"""
+    started = time.perf_counter()
+    from app import app
+    imported = time.perf_counter()
+
+    client = app.test_client()
+    status = client.get(path).status_code
+    first_response = time.perf_counter()
+
+    from benchmarks.asgi_load import install_simulation
+    install_simulation(app, 0)
+    before_llm = time.perf_counter()
+    llm_status = client.post('/infer', json={'intent': 'generate', 'payload': {'prompt': 'Hello'}}).status_code
+    after_llm = time.perf_counter()
+    second_llm_status = client.post('/infer', json={'intent': 'generate', 'payload': {'prompt': 'Hello again'}}).status_code
+    second_llm = time.perf_counter() - after_llm
+
+    return {
+        'import_ms': round((imported - started) * 1000, 1),
+        'first_response_ms': round((first_response - imported) * 1000, 1),
+        'first_response_status': status,
+        'first_llm_ms': round((after_llm - before_llm) * 1000, 1),
+        'second_llm_ms': round(second_llm * 1000, 1),
+        'llm_status': [llm_status, second_llm_status],
+    }
+
+def measure_first_requests(path):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--first-requests', '--path', path],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def measure_server(kind, path, timeout=120):
+    port = free_port()
+    if kind == 'wsgi':
+        command = ['uwsgi', '--http', f"127.0.0.1:{port}", '--module', 'app:app', '--master', '--processes', '2',
+                   '--threads', '4', '--enable-threads', '--die-on-term', '--disable-logging']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', '2', '--log-level', 'warning', '--no-access-log']
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=ROOT, env={**os.environ, 'PYTHONPATH': ROOT},
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=2) as response:
+                    return {'ready_ms': round((time.perf_counter() - started) * 1000, 1), 'status': response.status}
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+        raise RuntimeError(f"{kind} server did not respond within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def median_of(runs):
+    """Median of each duration over the runs; other fields are taken from the first run"""
+    merged = {}
+    for key, value in runs[0].items():
+        # The top modules can differ between runs; a key's median is over the runs that have it
+        present = [run[key] for run in runs if key in run]
+        if isinstance(value, dict):
+            merged[key] = median_of(present)
+        elif isinstance(value, float):
+            merged[key] = round(statistics.median(present), 1)
+        else:
+            merged[key] = value
+    return merged
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='Fresh processes per measurement')
+    parser.add_argument('--top', type=int, default=15, help='Packages and modules listed in the import breakdown')
+    parser.add_argument('--path', default='/', help='Path requested as the first response')
+    parser.add_argument('--servers', nargs='*', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    parser.add_argument('--first-requests', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.first_requests:
+        print(json.dumps(first_requests(args.path)))
+        return
+
+    results = {
+        'import': {module: median_of([measure_import(module, args.top) for _ in range(args.runs)])
+                   for module in ('app', 'asgi')},
+        'first_requests': median_of([measure_first_requests(args.path) for _ in range(args.runs)]),
+        'servers': {kind: median_of([measure_server(kind, args.path) for _ in range(args.runs)])
+                    for kind in args.servers},
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+"""
+Offline micro-benchmarks of the chart, market data, JSON and prompt-parsing
+hot paths, with JSON baselines to compare against.
+
+Benchmarks (all in one process; no network, credentials or servers):
+
+* yahoo_cache: YahooFinanceManager history and info lookups that hit the
+  worker cache, are served from the market data snapshot, or miss and go to
+  a fake provider (without the rate-limit sleep).
+* chart: GET /api/yahoo-finance/chart through the Flask test client for
+  1k, 10k and 100k-bar histories, with the convert and serialize spans read
+  from its Server-Timing header.
+* json: CustomJSONEncoder against the standard encoder, Flask's JSON
+  provider (what jsonify uses) and orjson if it is installed, on native
+  lists, on NumPy arrays and on lists of NumPy scalars.
+* html_extract: extract_structured_data_from_html on a typical analysis, a
+  1 MB one and a 1 MB one whose trading opportunity is never closed.
+* infer_parsing: parse_legacy_prompt on news, analysis and chat prompts of
+  up to 5000 assets, built as in infer_legacy_parser.py.
+
+Usage:
+    python benchmarks/suite.py run [--only chart json] [--runs 5] [--output results.json]
+    python benchmarks/suite.py compare benchmarks/baselines/suite.json [results.json] [--threshold 0.25]
+
+run prints the median and minimum time per call of every case as JSON and
+writes it to --output, e.g. to refresh the baseline. compare runs the suite
+(or reads a results file) and lists the cases slower than the baseline by
+more than --threshold and --min-delta-ms; it exits with status 1 if there
+are any. Baselines are only comparable on the same machine and Python, so
+compare warns when the environment differs.
+
+startup.py, asgi_load.py and tech_analysis_pipeline.py start servers or
+call the models and are run on their own.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The chart benchmark imports the app: measure the production config (compact JSON) without
+# warming up, admission limits or a log line per request
+for name, value in (('FLASK_ENV', 'production'), ('MARKET_WARMUP', 'False'), ('ADMISSION_ENABLED', 'False'),
+                    ('METRICS_MULTIPROCESS', 'False'), ('LOG_LEVEL', 'WARNING')):
+    os.environ.setdefault(name, value)
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'suite.json')
+
+CHART_SIZES = (1000, 10000, 100000)
+PROMPT_SIZES = (100, 1000, 5000)
+
+def measure(function, runs, min_time):
+    """
+    Time function
+
+    Returns:
+        Median and minimum milliseconds per call over runs samples, each of
+        enough calls to last min_time seconds
+    """
+    timer = timeit.Timer(function)
+    loops = 1
+    while (elapsed := timer.timeit(loops)) < min_time:
+        loops = max(loops * 2, math.ceil(loops * min_time / elapsed)) if elapsed > 0 else loops * 10
+    samples = [timer.timeit(loops) / loops for _ in range(runs)]
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 4),
+        'min_ms': round(min(samples) * 1000, 4),
+        'loops': loops,
+    }
+
+def make_history(bars, interval_seconds=86400):
+    """OHLCV DataFrame shaped like Ticker.history(), with a localized index"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(bars)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+    start = pd.Timestamp('2000-01-03', tz='America/New_York')
+    index = pd.DatetimeIndex(start + pd.to_timedelta(np.arange(bars) * interval_seconds, unit='s'), name='Date')
+    return pd.DataFrame({
+        'Open': close * (1 + rng.normal(0, 0.002, bars)),
+        'High': close * 1.01,
+        'Low': close * 0.99,
+        'Close': close,
+        'Volume': rng.integers(1_000, 10_000_000, bars),
+    }, index=index)
+
+def make_info(symbol):
+    """Ticker info dictionary of roughly the size Yahoo Finance returns"""
+    info = {'symbol': symbol, 'shortName': f"{symbol} Holdings", 'currency': 'USD', 'regularMarketPrice': 187.5}
+    info.update({f"field{i}": i * 1.5 for i in range(150)})
+    return info
+
+def bench_yahoo_cache(runs, min_time):
+    from api.utils import market_snapshot
+    from api.utils.yahoo import YahooFinanceManager
+
+    hist = make_history(120, 30 * 86400)  # 10y of monthly bars, what the portfolio charts request
+    info = make_info('BENCH')
+    provider = types.SimpleNamespace(history=lambda period, interval: hist, info=info)
+
+    def manager(cache_ttl):
+        yf_manager = YahooFinanceManager()
+        yf_manager.min_request_interval = 0
+        yf_manager.cache_ttl = cache_ttl
+        yf_manager.get_ticker = lambda symbol: provider
+        return yf_manager
+
+    cached = manager(float('inf'))
+    cached.get_history('BENCH')
+    cached.get_info('BENCH')
+    uncached = manager(0)
+
+    results = {
+        'history_hit': measure(lambda: cached.get_history('BENCH'), runs, min_time),
+        'history_miss': measure(lambda: uncached.get_history('BENCH'), runs, min_time),
+        'info_hit': measure(lambda: cached.get_info('BENCH'), runs, min_time),
+        'info_miss': measure(lambda: uncached.get_info('BENCH'), runs, min_time),
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        now = time.time()
+        market_snapshot.write_snapshot(directory, {('BENCH', '10y', '1mo'): (now, hist)}, {'BENCH': (now, info)})
+        market_snapshot._snapshot = market_snapshot.MarketSnapshot.load(directory, float('inf'))
+        try:
+            results['history_snapshot'] = measure(lambda: uncached.get_history('BENCH'), runs, min_time)
+            results['info_snapshot'] = measure(lambda: uncached.get_info('BENCH'), runs, min_time)
+        finally:
+            market_snapshot._snapshot = None
+    return results
+
+def parse_server_timing(header):
+    """{span: milliseconds} from a Server-Timing header"""
+    spans = {}
+    for entry in header.split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            if param.startswith('dur='):
+                spans[name] = float(param[len('dur='):])
+    return spans
+
+def bench_chart(runs, min_time):
+    from app import app
+    from api.portfolio.routes import yf_manager
+
+    # Served from the worker cache, so the requests measure conversion and serialization
+    yf_manager.cache_ttl = float('inf')
+    client = app.test_client()
+    results = {}
+    for bars in CHART_SIZES:
+        symbol = f"BENCH{bars}"
+        # Hourly bars: 100k daily ones would run past the last date pandas can represent
+        yf_manager.history_cache[f"{symbol}_2y_1h"] = {'timestamp': time.time(), 'data': make_history(bars, 3600)}
+        url = f"/api/yahoo-finance/chart?symbol={symbol}&period=2y&interval=1h"
+        spans = []
+
+        def request():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+            spans.append(parse_server_timing(response.headers.get('Server-Timing', '')))
+
+        result = measure(request, runs, min_time)
+        result['bytes'] = len(client.get(url).data)
+        result['spans_ms'] = {name: round(statistics.median(entry.get(name, 0.0) for entry in spans), 2)
+                              for name in ('convert', 'serialize')}
+        results[f"bars_{bars}"] = result
+    return results
+
+def bench_json(runs, min_time):
+    import numpy as np
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    from api.utils.helpers import CustomJSONEncoder
+
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    hist = make_history(10000)
+    columns = {name.lower(): hist[name].to_numpy() for name in ('Open', 'High', 'Low', 'Close', 'Volume')}
+    timestamps = (hist.index.asi8 // 10**9)
+    payloads = {
+        # What the chart route builds: lists of Python numbers, which never reach CustomJSONEncoder.default
+        'native': {'timestamp': timestamps.tolist(), **{name: values.tolist() for name, values in columns.items()}},
+        'numpy_arrays': {'timestamp': timestamps, **columns},
+        # Every value goes through CustomJSONEncoder.default
+        'numpy_scalars': {'timestamp': list(timestamps), **{name: list(values) for name, values in columns.items()}},
+    }
+    provider = DefaultJSONProvider(Flask(__name__))
+
+    def tolist(payload):
+        return {name: np.asarray(values).tolist() for name, values in payload.items()}
+
+    results = {}
+    for name, payload in payloads.items():
+        cases = {
+            'custom_encoder': lambda: json.dumps(payload, cls=CustomJSONEncoder),
+            'tolist_stdlib': lambda: json.dumps(tolist(payload)),
+        }
+        if name == 'native':
+            cases['stdlib'] = lambda: json.dumps(payload)
+            cases['flask_provider'] = lambda: provider.dumps(payload)
+        if orjson is not None:
+            cases['orjson'] = lambda: orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+        for case, function in cases.items():
+            results[f"{name}.{case}"] = measure(function, runs, min_time)
+    return results
+
+def analysis_html(insights, opportunity_chars, closed=True):
+    """Technical analysis HTML with the data attributes the extractor reads"""
+    parts = [
+        '<div class="analysis">',
+        '<div class="verdict" data-verdict="bullish" data-verdict-strength="72">Bullish</div>',
+        '<div class="volatility" data-volatility="medium" data-volatility-strength="48">Medium</div>',
+        '<ul>',
+    ]
+    parts.extend(f'<li data-insight>Support held at level {i} with rising volume and a higher low</li>'
+                 for i in range(insights))
+    parts.append('</ul>')
+    opportunity = ('<p>Buy above resistance, stop below the last swing low. </p>' *
+                   max(1, opportunity_chars // 60))
+    parts.append(f'<div data-trading-opportunity>{opportunity}' + ('</div>' if closed else ''))
+    parts.append('</div>')
+    return '\n'.join(parts)
+
+def bench_html_extract(runs, min_time):
+    from api.utils.helpers import extract_structured_data_from_html
+
+    documents = {
+        'typical': analysis_html(5, 600),
+        'large': analysis_html(5000, 500_000),
+        'large_unclosed': analysis_html(5000, 500_000, closed=False),
+    }
+    results = {}
+    for name, html in documents.items():
+        results[name] = measure(lambda: extract_structured_data_from_html(html), runs, min_time)
+        results[name]['chars'] = len(html)
+    return results
+
+def news_prompt(assets):
+    symbols = ', '.join(f"SYM{i}" for i in range(assets))
+    return (f"Please find and analyse 5-10 recent True Existing news items about these financial assets: {symbols}. \n"
+            "Return the results as JSON with title, source, date, url, summary and sentiment.")
+
+def bench_infer_parsing(runs, min_time):
+    from api.utils.intents import parse_legacy_prompt
+    from benchmarks.infer_legacy_parser import make_portfolio, analysis_prompt, chat_prompt
+
+    results = {}
+    for assets in PROMPT_SIZES:
+        portfolio = make_portfolio(assets)
+        prompts = {
+            'news': news_prompt(assets),
+            'analysis': analysis_prompt(portfolio),
+            'chat': chat_prompt(portfolio, 0.62),
+            'chat_no_sentiment': chat_prompt(portfolio, None),
+        }
+        for case, prompt in prompts.items():
+            result = measure(lambda: parse_legacy_prompt(prompt), runs, min_time)
+            result['chars'] = len(prompt)
+            results[f"{case}_{assets}"] = result
+    return results
+
+BENCHMARKS = {
+    'yahoo_cache': bench_yahoo_cache,
+    'chart': bench_chart,
+    'json': bench_json,
+    'html_extract': bench_html_extract,
+    'infer_parsing': bench_infer_parsing,
+}
+
+def environment():
+    import numpy
+    import pandas
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+    }
+
+def run_suite(only, runs, min_time):
+    results = {}
+    for name, benchmark in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        started = time.perf_counter()
+        for case, result in benchmark(runs, min_time).items():
+            results[f"{name}.{case}"] = result
+        print(f"{name}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': environment(),
+        'runs': runs,
+        'results': results,
+    }
+
+def compare(baseline, current, threshold, min_delta_ms):
+    """
+    Cases of current that are slower than in baseline
+
+    A case regressed when its median is more than threshold (a fraction)
+    and more than min_delta_ms above the baseline's.
+
+    Returns:
+        (rows, regressions) with one row per case in either
+    """
+    rows = []
+    regressions = []
+    base_results, current_results = baseline['results'], current['results']
+    for case in sorted(set(base_results) | set(current_results)):
+        before = base_results.get(case, {}).get('median_ms')
+        after = current_results.get(case, {}).get('median_ms')
+        if before is None or after is None:
+            rows.append((case, before, after, None, 'only in baseline' if after is None else 'new'))
+            continue
+        change = (after - before) / before if before else 0.0
+        status = ''
+        if change > threshold and after - before > min_delta_ms:
+            status = 'REGRESSION'
+            regressions.append(case)
+        elif change < -threshold and before - after > min_delta_ms:
+            status = 'faster'
+        rows.append((case, before, after, change, status))
+    return rows, regressions
+
+def print_comparison(rows):
+    width = max(len(row[0]) for row in rows)
+    print(f"{'case':<{width}}  {'baseline ms':>12}  {'current ms':>12}  {'change':>8}")
+    for case, before, after, change, status in rows:
+        before = f"{before:.4f}" if before is not None else '-'
+        after = f"{after:.4f}" if after is not None else '-'
+        change = f"{change:+.1%}" if change is not None else '-'
+        print(f"{case:<{width}}  {before:>12}  {after:>12}  {change:>8}  {status}".rstrip())
+
+def write_results(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_run_arguments(command):
+        command.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run')
+        command.add_argument('--runs', type=int, default=5, help='Samples per case')
+        command.add_argument('--min-time', type=float, default=0.05, help='Minimum seconds per sample')
+
+    run = commands.add_parser('run', help='Run the suite and print the results')
+    add_run_arguments(run)
+    run.add_argument('--output', help=f"Also write the results here (e.g. {os.path.relpath(DEFAULT_BASELINE, ROOT)})")
+
+    check = commands.add_parser('compare', help='Compare results against a baseline; exit 1 on regressions')
+    check.add_argument('baseline', nargs='?', default=DEFAULT_BASELINE)
+    check.add_argument('results', nargs='?', help='Results file; the suite is run if omitted')
+    check.add_argument('--threshold', type=float, default=0.25, help='Slowdown counted as a regression (0.25 = 25%%)')
+    check.add_argument('--min-delta-ms', type=float, default=0.01, help='Ignore slowdowns smaller than this')
+    check.add_argument('--output', help='Write the results of the run here')
+    add_run_arguments(check)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_suite(args.only, args.runs, args.min_time)
+        if args.output:
+            write_results(args.output, results)
+        print(json.dumps(results, indent=2))
+        return
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if args.results:
+        with open(args.results, encoding='utf-8') as f:
+            current = json.load(f)
+    else:
+        # Only the baseline's benchmarks, unless --only narrows them further
+        only = args.only or sorted({case.split('.', 1)[0] for case in baseline['results']} & set(BENCHMARKS))
+        current = run_suite(only, args.runs, args.min_time)
+        if args.output:
+            write_results(args.output, current)
+
+    if baseline.get('environment') != current.get('environment'):
+        print(f"warning: baseline environment {baseline.get('environment')} differs from "
+              f"{current.get('environment')}; timings may not be comparable", file=sys.stderr)
+    if args.only:
+        baseline = {**baseline, 'results': {case: result for case, result in baseline['results'].items()
+                                            if case.split('.', 1)[0] in args.only}}
+    rows, regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+    print_comparison(rows)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\nNo regressions above {args.threshold:.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark advanced-mode technical analysis: one multimodal request vs the
+per-timeframe pipeline (parallel timeframe calls plus a merge call).
+
+Usage:
+    python benchmarks/tech_analysis_pipeline.py weekly.png daily.png 4h.png 1h.png [--runs 3]
+    python benchmarks/tech_analysis_pipeline.py --simulate [--runs 5]
+
+With chart images both modes call the configured Gemini models, so Google
+credentials are required. --simulate swaps the genai clients for ones that
+sleep for a latency proportional to the number of images and the output
+budget of each call, which compares how the two modes schedule their calls
+without making API requests.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from api.tech_analyze.analysis import analyze_charts, TIMEFRAMES
+from api.utils.llm import registry
+
+# Simulated latency: fixed overhead, image encoding per chart and generation time by output budget
+SIMULATED_BASE = 0.5
+SIMULATED_PER_IMAGE = 0.8
+SIMULATED_GENERATION = {65535: 12.0, 8192: 3.0, 4096: 2.5}
+
+SIMULATED_RESPONSE = json.dumps({
+    "verdict": "bullish",
+    "verdict_strength": 65,
+    "volatility": "medium",
+    "volatility_strength": 50,
+    "insights": ["Simulated insight"],
+    "trading_opportunity": "<p>Simulated</p>"
+})
+
+class SimulatedModels:
+    """Stands in for client.aio.models with a latency model instead of API calls"""
+    def __init__(self, scale):
+        self.scale = scale
+
+    async def generate_content(self, model, contents, config):
+        parts = contents if isinstance(contents, list) else [contents]
+        images = sum(1 for part in parts if not isinstance(part, str))
+        generation = SIMULATED_GENERATION.get(config.get('max_output_tokens'), 3.0)
+        await asyncio.sleep((SIMULATED_BASE + SIMULATED_PER_IMAGE * images + generation) * self.scale)
+        return types.SimpleNamespace(text=SIMULATED_RESPONSE, usage_metadata=None, candidates=[])
+
+def install_simulation(scale):
+    client = types.SimpleNamespace(aio=types.SimpleNamespace(models=SimulatedModels(scale)))
+    for tier in app.config['LLM_TIERS'].values():
+        registry._clients[(tier['model'], 'v1')] = client
+
+def load_charts(paths):
+    charts = []
+    for (_, label), path in zip(TIMEFRAMES, paths):
+        with open(path, 'rb') as f:
+            mime_type = 'image/png' if path.lower().endswith('.png') else 'image/jpeg'
+            charts.append({'timeframe': label, 'data': f.read(), 'mime_type': mime_type})
+    return charts
+
+def measure(charts, pipeline, runs):
+    timings = []
+    for _ in range(runs):
+        with app.test_request_context():
+            # Each run is a fresh request, so identical calls are not coalesced across runs
+            app.config['LLM_SINGLE_FLIGHT'] = False
+            started = time.perf_counter()
+            analyze_charts('advanced', charts, pipeline=pipeline)
+            timings.append(time.perf_counter() - started)
+    return {
+        'runs': runs,
+        'mean': round(statistics.mean(timings), 3),
+        'median': round(statistics.median(timings), 3),
+        'min': round(min(timings), 3),
+        'max': round(max(timings), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('charts', nargs='*', help='Up to four chart images, weekly to hourly')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--simulate', action='store_true', help='Use simulated model latency instead of the API')
+    parser.add_argument('--scale', type=float, default=0.1, help='Multiplier for simulated latencies')
+    args = parser.parse_args()
+
+    if args.simulate:
+        install_simulation(args.scale)
+        charts = [{'timeframe': label, 'data': b'chart', 'mime_type': 'image/png'} for _, label in TIMEFRAMES]
+    elif args.charts:
+        charts = load_charts(args.charts)
+    else:
+        parser.error('pass chart images or --simulate')
+
+    results = {
+        'charts': len(charts),
+        'simulated': args.simulate,
+        'single_request': measure(charts, False, args.runs),
+        'pipeline': measure(charts, True, args.runs)
+    }
+    results['speedup'] = round(results['single_request']['median'] / results['pipeline']['median'], 2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
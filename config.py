@@ -1,6 +1,4 @@
 import os
-import logging
-import datetime
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -14,8 +12,6 @@ LOG_DIRECTORY = os.path.join(BASE_DIR, 'logs')
 if not os.path.exists(LOG_DIRECTORY):
     os.makedirs(LOG_DIRECTORY)
 
-LOG_FILENAME = os.path.join(LOG_DIRECTORY, f'app_{datetime.datetime.now().strftime("%Y%m%d")}.log')
-
 # App configuration
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard-to-guess-string'
@@ -24,14 +20,75 @@ class Config:
     # Google API configuration
     GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
     
-    # File upload configuration
-    UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'temp')
+    # Logging: records are queued and written by one thread per process (api/utils/logs.py)
+    LOG_FILE = os.environ.get('LOG_FILE', os.path.join(LOG_DIRECTORY, 'app.log'))
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' for structured records, 'text' for plain lines
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024))  # Size at which LOG_FILE is rotated
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 10))
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # Records waiting for the writer before new ones are dropped
+    
+    # Fraction of requests under a path prefix whose info records are logged (warnings and failures always are)
+    LOG_SAMPLE_RATES = {
+        '/api/yahoo-finance/chart': float(os.environ.get('LOG_SAMPLE_RATE_CHART', 0.1)),
+        '/api/yahoo-finance/quote': float(os.environ.get('LOG_SAMPLE_RATE_QUOTE', 0.1)),
+    }
+    
+    # Request timing (api/utils/timing.py): per-route histograms, plus the span breakdown in a Server-Timing header
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'True').lower() in ('true', '1', 't')
+    
+    # Metrics: each worker process writes its metrics to METRICS_DIRECTORY, and /metrics merges them
+    METRICS_MULTIPROCESS = os.environ.get('METRICS_MULTIPROCESS', 'True').lower() in ('true', '1', 't')
+    METRICS_DIRECTORY = os.environ.get('METRICS_DIRECTORY', os.path.join(BASE_DIR, 'data', 'metrics'))
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5.0))  # Seconds between snapshots
+    
+    # Sampling profiler: requests sending "X-Profile: <PROFILE_TOKEN>" and PROFILE_SAMPLE_RATE of all requests
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # Unset disables the header trigger
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))  # Seconds between stack samples
+    PROFILE_DIRECTORY = os.environ.get('PROFILE_DIRECTORY', os.path.join(LOG_DIRECTORY, 'profiles'))
+    
+    # File upload configuration; kept outside the static folder so artifacts are only served by /temp/<name>
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(BASE_DIR, 'data', 'temp'))
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload size
     
+    # Temporary artifacts in UPLOAD_FOLDER are evicted by age, then least recently used first over the quota
+    TEMP_STORE_MAX_BYTES = int(os.environ.get('TEMP_STORE_MAX_BYTES', 512 * 1024 * 1024))
+    TEMP_STORE_MAX_AGE = int(os.environ.get('TEMP_STORE_MAX_AGE', 86400))  # Seconds since last use
+    TEMP_STORE_SWEEP_INTERVAL = int(os.environ.get('TEMP_STORE_SWEEP_INTERVAL', 300))
+    
+    # Static assets built by `flask --app app build-assets` into static/dist: content-hashed names, minified,
+    # with .gz/.br variants picked by Accept-Encoding, so they can be cached as immutable
+    ASSET_FINGERPRINTING = os.environ.get('ASSET_FINGERPRINTING', 'True').lower() in ('true', '1', 't')
+    ASSET_MAX_AGE = int(os.environ.get('ASSET_MAX_AGE', 31536000))  # Seconds; one year
+    ASSET_IMAGE_SIZES = {'logo.png': 192}  # Longest side of built images; the logo is shown at 48px at most
+    ASSET_WEBP_QUALITY = int(os.environ.get('ASSET_WEBP_QUALITY', 85))
+    
     # Yahoo Finance settings
     YF_REQUEST_INTERVAL = 0.2  # 200ms between requests
     YF_CACHE_TTL = 300  # 5 minutes cache TTL
     
+    # Market data snapshot: hot symbols written by `flask --app app market-snapshot` and loaded at startup,
+    # before uWSGI forks its workers, so they are served without a download in every fresh worker
+    MARKET_WARMUP = os.environ.get('MARKET_WARMUP', 'True').lower() in ('true', '1', 't')
+    MARKET_SNAPSHOT_DIRECTORY = os.environ.get('MARKET_SNAPSHOT_DIRECTORY', os.path.join(BASE_DIR, 'data', 'market'))
+    MARKET_SNAPSHOT_MAX_AGE = int(os.environ.get('MARKET_SNAPSHOT_MAX_AGE', 86400))  # Older entries are downloaded again; quotes only use YF_CACHE_TTL
+    # The predefined commodities, bonds, indices, cryptocurrencies and currencies of the portfolio builder
+    MARKET_HOT_SYMBOLS = [symbol.strip() for symbol in os.environ.get('MARKET_HOT_SYMBOLS', ','.join([
+        'GC=F', 'SI=F', 'HG=F', 'CL=F', 'NG=F',
+        '^TNX', '^FVX', '^IRX',
+        '^GSPC', '^DJI', '^IXIC', '^RUT', '^N225', '^HSI', '^FTSE', '^GDAXI', '^FCHI', '^STOXX50E', '^SSEC', '^BSESN',
+        'BTC-USD', 'ETH-USD', 'SOL-USD', 'ADA-USD', 'DOT-USD', 'AVAX-USD', 'LINK-USD', 'MATIC-USD', 'XRP-USD', 'BNB-USD',
+        'USD=X', 'EURUSD=X', 'GBPUSD=X', 'JPYUSD=X', 'CHFUSD=X', 'AUDUSD=X', 'CADUSD=X', 'NZDUSD=X', 'CNYUSD=X',
+        'HKDUSD=X', 'SGDUSD=X', 'INRUSD=X',
+    ])).split(',') if symbol.strip()]
+    # period:interval pairs downloaded for each hot symbol; 10y:1mo is what the portfolio charts request
+    MARKET_HOT_HISTORIES = [tuple(entry.strip().split(':')) for entry in os.environ.get('MARKET_HOT_HISTORIES', '10y:1mo').split(',') if entry.strip()]
+    
+    # Move the objects created at startup out of the garbage collector's reach before workers are forked,
+    # so collections in the workers do not write to (and un-share) the pages holding them
+    GC_FREEZE = os.environ.get('GC_FREEZE', 'True').lower() in ('true', '1', 't')
+    
     # LLM settings
     DEFAULT_LLM_MODEL = os.environ.get('DEFAULT_LLM_MODEL', 'gemini-2.5-pro')
     LLM_TEMPERATURE = float(os.environ.get('LLM_TEMPERATURE', 1.0))
@@ -40,6 +97,129 @@ class Config:
     LLM_SEED = int(os.environ.get('LLM_SEED', 0))
     LLM_MAX_OUTPUT_TOKENS = int(os.environ.get('LLM_MAX_OUTPUT_TOKENS', 65535))
     
+    # LLM executor settings (per worker process)
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))  # Calls in flight at once
+    LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', 4))  # Calls waiting for a slot before rejecting with 503
+    LLM_RETRY_AFTER = int(os.environ.get('LLM_RETRY_AFTER', 5))  # Retry-After seconds sent with 503
+    
+    # Admission control (api/utils/admission.py), per worker process: requests are admitted into the pool of
+    # their route, waiting in a bounded queue when it is full, and rejected with 429 when the client is over the
+    # pool's rate (tokens per second, up to burst) or 503 when the queue is full or the expected wait plus
+    # service_time (seconds, the initial estimate of the moving average) would exceed the deadline
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'True').lower() in ('true', '1', 't')
+    ADMISSION_POOLS = {
+        # Under uWSGI every admitted or queued request holds a thread: keep capacity + queue of the llm and
+        # events pools below the threads per process (16 in uwsgi.ini.example) so the data routes always get one
+        'llm': {
+            'capacity': int(os.environ.get('ADMISSION_LLM_CAPACITY', 4)),
+            'queue': int(os.environ.get('ADMISSION_LLM_QUEUE', 4)),
+            'deadline': float(os.environ.get('ADMISSION_LLM_DEADLINE', 90.0)),
+            'service_time': 15.0,
+            'rate': float(os.environ.get('ADMISSION_LLM_RATE', 0.2)),
+            'burst': int(os.environ.get('ADMISSION_LLM_BURST', 6)),
+        },
+        # Job event streams; under ASGI a stream keeps its slot until the job finishes, so capacity bounds
+        # the open streams per process and further ones are rejected at once (no queue)
+        'events': {
+            'capacity': int(os.environ.get('ADMISSION_EVENTS_CAPACITY', 4)),
+            'queue': int(os.environ.get('ADMISSION_EVENTS_QUEUE', 0)),
+            'deadline': float(os.environ.get('ADMISSION_EVENTS_DEADLINE', 5.0)),
+            'service_time': 0.1,
+            'rate': float(os.environ.get('ADMISSION_EVENTS_RATE', 2.0)),
+            'burst': int(os.environ.get('ADMISSION_EVENTS_BURST', 10)),
+        },
+        'data': {
+            'capacity': int(os.environ.get('ADMISSION_DATA_CAPACITY', 8)),
+            'queue': int(os.environ.get('ADMISSION_DATA_QUEUE', 32)),
+            'deadline': float(os.environ.get('ADMISSION_DATA_DEADLINE', 10.0)),
+            'service_time': 0.5,
+            'rate': float(os.environ.get('ADMISSION_DATA_RATE', 10.0)),
+            'burst': int(os.environ.get('ADMISSION_DATA_BURST', 120)),  # A portfolio load fetches a chart and quote per asset
+        },
+    }
+    # Path prefix -> (pool, priority) or None; the longest prefix applies, * matches one path segment, lower
+    # priorities are served first from the queue, and None or no match (pages, static files, /metrics) is not limited
+    ADMISSION_ROUTES = {
+        '/infer': ('llm', 1),
+        '/api/portfolio': ('llm', 1),
+        '/api/portfolio/chat': ('llm', 0),
+        '/api/technical-analysis': ('llm', 2),
+        '/api/technical-analysis/jobs': None,  # Submissions are limited by JOB_MAX_ACTIVE_PER_USER
+        '/api/technical-analysis/jobs/*/events': ('events', 0),
+        '/api/yahoo-finance': ('data', 0),
+    }
+
+    # ASGI mode (asgi.py): threads for blocking work such as market data and cache lookups, per worker process
+    ASGI_BLOCKING_THREADS = int(os.environ.get('ASGI_BLOCKING_THREADS', 32))
+    
+    # Prompt budgets: estimated input tokens per endpoint before portfolio data is compacted further
+    LLM_INPUT_TOKEN_BUDGETS = {
+        'portfolio_news': 1000,
+        'portfolio_analysis': 6000,
+        'portfolio_chat': 3000,
+    }
+    LLM_COUNT_TOKENS_REMOTE = os.environ.get('LLM_COUNT_TOKENS_REMOTE', 'False').lower() in ('true', '1', 't')  # Use the count_tokens API instead of an estimate
+    
+    # Model tiers; a tier is downgraded to its fallback when it is over a route's SLO or max_in_flight
+    LLM_TIERS = {
+        'pro': {'model': DEFAULT_LLM_MODEL, 'thinking_budget': -1, 'max_in_flight': 4, 'fallback': 'fast'},
+        'fast': {'model': os.environ.get('FAST_LLM_MODEL', 'gemini-2.5-flash'), 'thinking_budget': 0, 'max_in_flight': 8, 'fallback': None},
+    }
+    
+    # Preferred tier and p95 latency SLO (seconds) per endpoint, or per "endpoint:request_class"; thinking_budget
+    # caps the tier's (thinking tokens count against the call's max_output_tokens)
+    LLM_ROUTES = {
+        'default': {'tier': 'pro', 'slo_p95': 60.0},
+        'portfolio_news': {'tier': 'fast', 'slo_p95': 20.0},
+        'portfolio_analysis': {'tier': 'pro', 'slo_p95': 30.0},
+        'portfolio_chat': {'tier': 'fast', 'slo_p95': 10.0},
+        'technical_analysis': {'tier': 'pro', 'slo_p95': 45.0},
+        'technical_analysis:advanced': {'tier': 'pro', 'slo_p95': 60.0},
+        'technical_analysis_draw': {'tier': 'fast', 'slo_p95': 15.0},
+        'technical_analysis_timeframe': {'tier': 'pro', 'slo_p95': 30.0, 'thinking_budget': 4096},
+        'technical_analysis_merge': {'tier': 'fast', 'slo_p95': 10.0, 'thinking_budget': 4096},
+    }
+    
+    # Deadline (seconds from the start of the request, below uWSGI's harakiri), retries on
+    # transient errors and hedging at the tier's latency percentile, per endpoint or
+    # "endpoint:request_class"; missing keys fall back to the 'default' entry
+    LLM_REQUEST_POLICIES = {
+        'default': {'deadline': 90.0, 'max_retries': 2, 'backoff': 0.5, 'hedge': False, 'hedge_percentile': 90},
+        'portfolio_news': {'deadline': 45.0, 'hedge': True},
+        'portfolio_chat': {'deadline': 30.0, 'hedge': True},
+        'technical_analysis:advanced': {'deadline': 105.0, 'max_retries': 1},
+        'technical_analysis_draw': {'deadline': 45.0, 'hedge': True},
+    }
+    LLM_SINGLE_FLIGHT = os.environ.get('LLM_SINGLE_FLIGHT', 'True').lower() in ('true', '1', 't')  # Coalesce identical in-flight requests
+    
+    # Chart images are cropped, downsampled and re-encoded before being sent to the model
+    CHART_MAX_EDGE = int(os.environ.get('CHART_MAX_EDGE', 1536))  # Longest edge in pixels (2x2 tiles of 768)
+    CHART_IMAGE_FORMAT = os.environ.get('CHART_IMAGE_FORMAT', 'WEBP')  # WEBP, PNG or JPEG
+    CHART_IMAGE_QUALITY = int(os.environ.get('CHART_IMAGE_QUALITY', 90))
+    CHART_PREPROCESS_WORKERS = int(os.environ.get('CHART_PREPROCESS_WORKERS', 4))
+    
+    # Reuse analyses of identical or nearly identical chart uploads (shared by all workers)
+    ANALYSIS_CACHE_ENABLED = os.environ.get('ANALYSIS_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    ANALYSIS_CACHE_DATABASE = os.environ.get('ANALYSIS_CACHE_DATABASE', os.path.join(BASE_DIR, 'data', 'analysis_cache.sqlite3'))
+    ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 900))  # Seconds an analysis is reused
+    ANALYSIS_CACHE_MAX_DISTANCE = int(os.environ.get('ANALYSIS_CACHE_MAX_DISTANCE', 10))  # Differing bits of the 256-bit perceptual hash, at most 15
+    
+    # Analyze advanced-mode charts per timeframe in parallel and merge the results (per request: form field "pipeline")
+    TECH_ANALYSIS_PIPELINE = os.environ.get('TECH_ANALYSIS_PIPELINE', 'False').lower() in ('true', '1', 't')
+    # Timeframe calls of one pipeline in flight at once, at most half of LLM_MAX_CONCURRENCY, so concurrent
+    # pipelines and other LLM requests are not rejected by a full executor; 4 analyzes the four timeframes
+    # in one round, so a pipeline takes about the slowest chart plus the merge
+    TECH_ANALYSIS_PIPELINE_WIDTH = int(os.environ.get('TECH_ANALYSIS_PIPELINE_WIDTH', 4))
+    
+    # Technical analysis job queue (state is shared by all worker processes on the host)
+    JOB_DATABASE = os.environ.get('JOB_DATABASE', os.path.join(BASE_DIR, 'data', 'jobs.sqlite3'))
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # Job threads per worker process, 0 to only accept jobs
+    JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))  # Seconds finished jobs are kept
+    JOB_MAX_ACTIVE_PER_USER = int(os.environ.get('JOB_MAX_ACTIVE_PER_USER', 2))  # Queued or running jobs per client
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))  # A job whose worker stops renewing this long is rerun
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_MAX_REQUEUES = int(os.environ.get('JOB_MAX_REQUEUES', 20))  # Times a job is put back while the LLM is overloaded
+    
     @staticmethod
     def init_app(app):
         """Initialize app with this configuration"""
@@ -52,19 +232,6 @@ class DevelopmentConfig(Config):
 # Production configuration
 class ProductionConfig(Config):
     DEBUG = False
-    
-    @staticmethod
-    def init_app(app):
-        # Set up production-specific logging
-        Config.init_app(app)
-        
-        # Configure production logging to file
-        file_handler = logging.FileHandler(LOG_FILENAME)
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s [%(levelname)s] %(message)s'
-        ))
-        app.logger.addHandler(file_handler)
 
 # Configuration dictionary
 config = {